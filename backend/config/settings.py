@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'trips',
     'ninja',
     'corsheaders',
@@ -51,6 +52,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'trips.query_budget.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -85,13 +87,55 @@ WSGI_APPLICATION = 'config.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'cartopic_db',  # Change to your database name
-        'USER': 'postgres',     # Change to your PostgreSQL user
-        'PASSWORD': 'postgres', # Change to your PostgreSQL password
-        'HOST': 'localhost',
-        'PORT': '5432',
+        'NAME': os.getenv('DB_NAME', 'cartopic_db'),
+        'USER': os.getenv('DB_USER', 'postgres'),
+        'PASSWORD': os.getenv('DB_PASSWORD', 'postgres'),
+        'HOST': os.getenv('DB_HOST', 'localhost'),
+        'PORT': os.getenv('DB_PORT', '5432'),
+        # Seconds a connection is kept open for the following requests of the same thread
+        # (0 = one connection per request). Keep 0 under ASGI and use DB_POOL_MAX_SIZE instead.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        # Check a reused connection before the request's first query (a server restart would
+        # otherwise fail that request)
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', 'true').lower() == 'true',
+        'OPTIONS': {},
     }
 }
+# DB_ENGINE=sqlite: a local SQLite file (DB_NAME, default db.sqlite3) instead of PostgreSQL, e.g.
+# to run the test suite without a server. Search falls back to substring matching there.
+if os.getenv('DB_ENGINE', 'postgresql') == 'sqlite':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('DB_NAME', str(BASE_DIR / 'db.sqlite3')),
+    }
+# Process-wide connection pool (psycopg 3 only: requires `psycopg[binary,pool]` in place of
+# psycopg2-binary). Shared by all threads, so it suits ASGI workers; excludes CONN_MAX_AGE.
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '0'))  # 0 = no pool
+if DB_POOL_MAX_SIZE:
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+        'max_size': DB_POOL_MAX_SIZE,
+        'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),  # seconds to wait for a free connection
+    }
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory by default (dev / tests). In production point it to a shared backend, e.g.
+#   DJANGO_CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache DJANGO_CACHE_LOCATION=/var/tmp/cartopic_cache
+#   DJANGO_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache DJANGO_CACHE_LOCATION=redis://127.0.0.1:6379
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('DJANGO_CACHE_LOCATION', 'cartopic'),
+    }
+}
+# Cache alias and timeout (seconds) used for pre-rendered trip payloads (trips/cache.py)
+TRIPS_CACHE_ALIAS = os.getenv('TRIPS_CACHE_ALIAS', 'default')
+TRIPS_CACHE_TIMEOUT = int(os.getenv('TRIPS_CACHE_TIMEOUT', '86400'))
+# Steps encoded one by one in a vector tile; a tile with more gets the step clusters instead (trips/routes.py)
+TILE_MAX_STEPS = int(os.getenv('TILE_MAX_STEPS', '500'))
 
 
 # Password validation
@@ -137,6 +181,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True
+# Pagination cursor of GET /api/trips is returned as a response header
+CORS_EXPOSE_HEADERS = ['X-Next-Cursor']
 
 # ownCloud / Nextcloud integration settings (configure via environment variables)
 OWNCLOUD_BASE_URL = os.getenv('OWNCLOUD_BASE_URL', '').rstrip('/')  # e.g. https://cloud.example.com
@@ -145,3 +191,83 @@ OWNCLOUD_PASSWORD = os.getenv('OWNCLOUD_PASSWORD', '')
 OWNCLOUD_UPLOAD_ROOT = os.getenv('OWNCLOUD_UPLOAD_ROOT', '/Photos/Cartopic')  # remote folder path
 OWNCLOUD_SHARE_PUBLIC = os.getenv('OWNCLOUD_SHARE_PUBLIC', 'true').lower() == 'true'
 OWNCLOUD_SHARE_PERMISSIONS = int(os.getenv('OWNCLOUD_SHARE_PERMISSIONS', '1'))  # 1 = read
+# Connection pool / timeouts (seconds) / retries of the shared client (trips.services.owncloud.get_client)
+OWNCLOUD_POOL_SIZE = int(os.getenv('OWNCLOUD_POOL_SIZE', '10'))
+OWNCLOUD_CONNECT_TIMEOUT = float(os.getenv('OWNCLOUD_CONNECT_TIMEOUT', '5'))
+OWNCLOUD_READ_TIMEOUT = float(os.getenv('OWNCLOUD_READ_TIMEOUT', '120'))
+OWNCLOUD_RETRIES = int(os.getenv('OWNCLOUD_RETRIES', '3'))  # extra attempts on 5xx / connection errors
+OWNCLOUD_RETRY_BACKOFF = float(os.getenv('OWNCLOUD_RETRY_BACKOFF', '0.5'))  # first delay, doubled each retry
+# Connections per event loop of the async client used by async views under ASGI (get_async_client);
+# bounds the uploads one ASGI worker keeps in flight
+OWNCLOUD_ASYNC_POOL_SIZE = int(os.getenv('OWNCLOUD_ASYNC_POOL_SIZE', '100'))
+
+# Uploads larger than this (bytes) are spooled to a temporary file instead of memory,
+# then streamed to ownCloud from disk (see trips.services.owncloud.upload_file).
+# Both handlers also hash the file as it arrives (trips/upload_handlers.py).
+FILE_UPLOAD_HANDLERS = [
+    'trips.upload_handlers.HashingMemoryFileUploadHandler',
+    'trips.upload_handlers.HashingTemporaryFileUploadHandler',
+]
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(os.getenv('FILE_UPLOAD_MAX_MEMORY_SIZE', str(2 * 1024 * 1024)))
+
+# Batch uploads (POST .../photos/batch): files per request and parallel ownCloud transfers
+UPLOAD_BATCH_MAX_FILES = int(os.getenv('UPLOAD_BATCH_MAX_FILES', '500'))
+UPLOAD_BATCH_CONCURRENCY = int(os.getenv('UPLOAD_BATCH_CONCURRENCY', '8'))
+DATA_UPLOAD_MAX_NUMBER_FILES = UPLOAD_BATCH_MAX_FILES
+
+# Bulk endpoints (POST/PATCH /trips/{id}/steps/bulk, POST /trips/{id}/photos/bulk): items per request
+BULK_MAX_ITEMS = int(os.getenv('BULK_MAX_ITEMS', '1000'))
+
+# Photo variants (trips/services/derivatives.py): generated on upload unless disabled
+PHOTO_VARIANTS_ENABLED = os.getenv('PHOTO_VARIANTS_ENABLED', 'true').lower() == 'true'
+PHOTO_VARIANT_FORMAT = os.getenv('PHOTO_VARIANT_FORMAT', 'WEBP').upper()  # WEBP or JPEG
+PHOTO_VARIANT_QUALITY = int(os.getenv('PHOTO_VARIANT_QUALITY', '80'))
+# Perceptual hashes flag visually similar photos within a trip (exact copies are always deduplicated)
+PHOTO_PERCEPTUAL_HASH_ENABLED = os.getenv('PHOTO_PERCEPTUAL_HASH_ENABLED', 'false').lower() == 'true'
+PHOTO_NEAR_DUPLICATE_DISTANCE = int(os.getenv('PHOTO_NEAR_DUPLICATE_DISTANCE', '6'))  # max differing bits of 64
+# Distance between a step and the median position of its geotagged photos reported as an issue
+PHOTO_EXIF_STEP_TOLERANCE_KM = float(os.getenv('PHOTO_EXIF_STEP_TOLERANCE_KM', '5'))
+
+# Deferred uploads: files wait here until `manage.py process_uploads` pushes them to ownCloud
+UPLOAD_SPOOL_DIR = os.getenv('UPLOAD_SPOOL_DIR', str(BASE_DIR / 'spool'))
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '4'))
+UPLOAD_MAX_ATTEMPTS = int(os.getenv('UPLOAD_MAX_ATTEMPTS', '5'))
+UPLOAD_CLAIM_TIMEOUT = int(os.getenv('UPLOAD_CLAIM_TIMEOUT', '900'))  # seconds before a claimed upload is retried
+
+# Trip import from geotagged photos (trips/services/ingest.py): a new step starts after
+# this many hours without photos, or for a photo this far from the current step
+INGEST_STEP_GAP_HOURS = float(os.getenv('INGEST_STEP_GAP_HOURS', '6'))
+INGEST_STEP_RADIUS_KM = float(os.getenv('INGEST_STEP_RADIUS_KM', '25'))
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '8'))  # threads reading / spooling the photos
+# POST /trips/import extracts the photos to the spool before answering: archives larger than
+# this (bytes, compressed or not) get 413; import them with `manage.py import_trip` instead
+TRIP_IMPORT_MAX_BYTES = int(os.getenv('TRIP_IMPORT_MAX_BYTES', str(512 * 1024 * 1024)))
+
+# GPS track import (trips/tracks.py): simplification tolerance, and what counts as a stop
+TRACK_TOLERANCE_M = float(os.getenv('TRACK_TOLERANCE_M', '10'))  # also absorbs GPS jitter while standing still
+TRACK_STOP_RADIUS_M = float(os.getenv('TRACK_STOP_RADIUS_M', '150'))
+TRACK_STOP_MIN_MINUTES = float(os.getenv('TRACK_STOP_MIN_MINUTES', '20'))
+
+# Delta sync (GET /api/sync, trips/sync.py): rows per page, and how long deletions are kept
+# by `manage.py prune_tombstones` (clients that have not synced for longer start over)
+SYNC_PAGE_MAX = int(os.getenv('SYNC_PAGE_MAX', '5000'))
+SYNC_TOMBSTONE_DAYS = int(os.getenv('SYNC_TOMBSTONE_DAYS', '90'))
+
+# Query budgets of the API (trips/query_budget.py): queries allowed per request, by
+# operation (view function) name, so each method of a path has its own; breaches are logged, and
+# raise QueryBudgetExceeded when strict (the test suite turns it on).
+API_QUERY_BUDGET_DEFAULT = int(os.getenv('API_QUERY_BUDGET_DEFAULT', '50'))
+API_QUERY_BUDGETS = {
+    'list_trips': 4,
+    'get_trip': 4,
+    'list_steps_in_bbox': 1,
+    'list_clusters': 1,
+    'get_trip_route': 4,
+    'photo_status': 1,
+    'import_progress': 2,
+    'sync_changes': 20,
+    'search_all': 1,
+}
+API_QUERY_BUDGET_STRICT = os.getenv('API_QUERY_BUDGET_STRICT', 'false').lower() == 'true'
+# Report each API response's query count / database time in a Server-Timing header
+API_QUERY_BUDGET_HEADERS = os.getenv('API_QUERY_BUDGET_HEADERS', str(DEBUG)).lower() == 'true'
@@ -1,6 +1,8 @@
 
 from django.contrib import admin
-from .models import Trip, Step, Photo
+from django.forms.models import BaseModelFormSet
+from .models import Trip, Step, Photo, UploadSession
+from .ordering import save_orders
 from django.utils.html import format_html
 
 
@@ -13,11 +15,27 @@ class PhotoInline(admin.TabularInline):
 	model = Photo
 	extra = 1
 
+class StepChangelistFormSet(BaseModelFormSet):
+	"""Changelist formset whose forms know it, so StepAdmin collects the edited orders on it."""
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.edited_orders = []
+
+	def _construct_form(self, i, **kwargs):
+		form = super()._construct_form(i, **kwargs)
+		form.formset = self
+		return form
+
 @admin.register(Trip)
 class TripAdmin(admin.ModelAdmin):
-	list_display = ("id", "name", "cover_photo")
+	list_display = ("id", "name", "cover_photo", "step_count", "photo_count", "distance", "steps_started_at", "steps_ended_at")
 	inlines = [StepInline]
 
+	@admin.display(description="distance", ordering="distance_km")
+	def distance(self, obj):
+		return f"{obj.distance_km:.1f} km"
+
 @admin.register(Step)
 class StepAdmin(admin.ModelAdmin):
 	list_display = ("id", "name", "trip", "order", "cover_photo", "photo_count", "started_at", "ended_at")
@@ -25,14 +43,34 @@ class StepAdmin(admin.ModelAdmin):
 	list_editable = ("order",)
 	inlines = [PhotoInline]
 
-	def photo_count(self, obj):
-		return obj.photos.count()
+	def get_changelist_formset(self, request, **kwargs):
+		return super().get_changelist_formset(request, formset=StepChangelistFormSet, **kwargs)
+
+	def save_model(self, request, obj, form, change):
+		formset = getattr(form, "formset", None)
+		if formset is not None and change and set(form.changed_data) <= {"order"}:
+			# Written with the other edited orders by save_related
+			formset.edited_orders.append(obj)
+			return
+		super().save_model(request, obj, form, change)
+
+	def save_related(self, request, form, formsets, change):
+		super().save_related(request, form, formsets, change)
+		formset = getattr(form, "formset", None)
+		# Still in the atomic block of the changelist: one bulk_update after the last edited row
+		if formset is not None and formset.edited_orders and form is [f for f in formset.forms if f.has_changed()][-1]:
+			save_orders(formset.edited_orders)
 
 @admin.register(Photo)
 class PhotoAdmin(admin.ModelAdmin):
-	list_display = ("id", "name", "step", "date", "thumbnail")
+	list_display = ("id", "name", "step", "date", "taken_at", "thumbnail")
 
 	def thumbnail(self, obj):
 		if obj.url:
-			return format_html('<img src="{}" style="height:40px;width:auto;object-fit:cover;" />', obj.url)
+			return format_html('<img src="{}" style="height:40px;width:auto;object-fit:cover;" />', obj.thumbnail_url)
 		return ""
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+	list_display = ("id", "original_name", "step", "status", "total_size", "created_at")
+	list_filter = ("status",)
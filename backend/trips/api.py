@@ -1,16 +1,42 @@
+import asyncio
+import os
+import tempfile
+import zipfile
+from datetime import datetime, timedelta
+from asgiref.sync import sync_to_async
 from ninja import NinjaAPI
-from .models import Trip, Step, Photo
-from django.shortcuts import get_object_or_404
-from ninja import Schema, File, Form
+from .models import Trip, Step, Photo, UploadSession
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.http import Http404, HttpResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from ninja import Schema, Field, File, Form
 from ninja.files import UploadedFile
-from .services.owncloud import upload_file, OwnCloudError
+from .services import dedup, derivatives, exif, ingest, owncloud, upload_queue
+from .services.owncloud import OwnCloudError, SizedReader
+from .serializers import parse_expand, photo_dict, cover_photo_from_values
+from .cache import render_trips, invalidate_trip
+from .renderers import ORJSONRenderer, dumps
+from .routes import MAX_ZOOM, route_geojson, render_tile
+from .geo import parse_bbox, bbox_q
+from .clustering import clusters
+from . import bulk, ordering, search, sync, tracks
 
-api = NinjaAPI()
+api = NinjaAPI(renderer=ORJSONRenderer())
 
 
 class CoverPhotoRef(Schema):
     id: int
     url: str
+    thumbnail_url: str | None = None
+
+class PhotoVariantSchema(Schema):
+    url: str
+    width: int
+    height: int
 
 class PhotoSchema(Schema):
     id: int
@@ -18,6 +44,13 @@ class PhotoSchema(Schema):
     description: str | None = None
     date: str
     url: str
+    width: int | None = None
+    height: int | None = None
+    variants: dict[str, PhotoVariantSchema] = {}
+    taken_at: str | None = None
+    lat: float | None = None
+    lng: float | None = None
+    orientation: int | None = None
 
 class StepSchema(Schema):
     id: int
@@ -30,6 +63,7 @@ class StepSchema(Schema):
     photos: list[PhotoSchema] = []
     started_at: str | None = None
     ended_at: str | None = None
+    photo_count: int = 0
 
 class StepCreateSchema(Schema):
     name: str
@@ -41,8 +75,32 @@ class TripSchema(Schema):
     id: int
     name: str
     cover_photo: CoverPhotoRef | None = None
+    step_count: int = 0
+    photo_count: int = 0
+    # [minLng, minLat, maxLng, maxLat] of the steps and the recorded track
+    bbox: list[float] | None = None
+    # Great-circle length of the route through the steps, in order
+    distance_km: float = 0
+    # First step start / last step end
+    steps_started_at: str | None = None
+    steps_ended_at: str | None = None
     steps: list[StepSchema] = []
 
+class StepMarkerSchema(Schema):
+    id: int
+    trip_id: int
+    name: str
+    lat: float
+    lng: float
+    order: int
+    cover_photo: CoverPhotoRef | None = None
+
+class ClusterSchema(Schema):
+    lat: float
+    lng: float
+    count: int
+    cover_photo: CoverPhotoRef | None = None
+
 class PhotoCreateSchema(Schema):
     name: str
     description: str | None = None
@@ -54,47 +112,369 @@ class PhotoUploadResponse(Schema):
     description: str | None = None
     url: str
     date: str
+    width: int | None = None
+    height: int | None = None
+    variants: dict[str, PhotoVariantSchema] = {}
+    taken_at: str | None = None
+    lat: float | None = None
+    lng: float | None = None
+    orientation: int | None = None
+    duplicate_of: int | None = None
+    near_duplicates: list[int] = []
+
+class PhotoStatusSchema(Schema):
+    id: int
+    name: str
+    status: str
+    url: str
+    error: str = ""
+
+class BatchUploadItem(Schema):
+    filename: str
+    ok: bool
+    photo: PhotoUploadResponse | None = None
+    error: str | None = None
+
+class BatchUploadResponse(Schema):
+    created: int
+    failed: int
+    results: list[BatchUploadItem]
+
+class UploadSessionCreateSchema(Schema):
+    filename: str
+    name: str | None = None
+    description: str | None = None
+    size: int | None = None
+
+class UploadSessionSchema(Schema):
+    id: int
+    status: str
+    filename: str
+    size: int | None = None
+    chunks: list[int] = []
+    received: int = 0
+
+class StepDerivationSchema(Schema):
+    started_at: datetime | None = None
+    ended_at: datetime | None = None
+    lat: float | None = None
+    lng: float | None = None
+    photos: int
+    located: int
+    issues: list[str] = []
+    applied: bool = False
+
+class StepBulkItem(Schema):
+    name: str
+    description: str = ''
+    lat: float = Field(ge=-90, le=90)
+    lng: float = Field(ge=-180, le=180)
+    started_at: datetime | None = None
+    ended_at: datetime | None = None
+
+class StepBulkCreateSchema(Schema):
+    steps: list[StepBulkItem]
+
+class StepBulkUpdateItem(Schema):
+    id: int
+    name: str | None = None
+    description: str | None = None
+    lat: float | None = Field(None, ge=-90, le=90)
+    lng: float | None = Field(None, ge=-180, le=180)
+    started_at: datetime | None = None
+    ended_at: datetime | None = None
+
+class StepBulkUpdateSchema(Schema):
+    steps: list[StepBulkUpdateItem]
+
+class PhotoBulkItem(PhotoCreateSchema):
+    step_id: int
+
+class PhotoBulkCreateSchema(Schema):
+    photos: list[PhotoBulkItem]
+
+class BulkResponse(Schema):
+    ids: list[int]
+
+class TrackStopSchema(Schema):
+    lat: float
+    lng: float
+    started_at: datetime
+    ended_at: datetime
+    points: int
+
+class TrackImportResponse(Schema):
+    points: int
+    kept: int
+    stops: list[TrackStopSchema]
+    step_ids: list[int] = []
+
+class StepOrderSchema(Schema):
+    step_ids: list[int]
+
+class StepOrderItem(Schema):
+    id: int
+    order: int
+
+class ImportProgressSchema(Schema):
+    pending: int
+    uploading: int
+    ready: int
+    failed: int
+    total: int
+
+class TripImportResponse(Schema):
+    trip_id: int
+    steps: int
+    progress: ImportProgressSchema
+
+class SearchResultSchema(Schema):
+    type: str  # trip, step or photo
+    id: int
+    trip_id: int
+    step_id: int | None = None
+    name: str
+    rank: float
+
+class SyncStepSchema(StepSchema):
+    trip_id: int
+
+class SyncPhotoSchema(PhotoSchema):
+    step_id: int
+
+class SyncDeletedSchema(Schema):
+    trips: list[int] = []
+    steps: list[int] = []
+    photos: list[int] = []
+
+class SyncSchema(Schema):
+    token: int
+    more: bool
+    trips: list[TripSchema]
+    steps: list[SyncStepSchema]
+    photos: list[SyncPhotoSchema]
+    deleted: SyncDeletedSchema
+
+TRIPS_PAGE_MAX = 200
+
 
 @api.get("/trips", response=list[TripSchema])
-def list_trips(request):
-    trips = Trip.objects.prefetch_related(
-        'cover_photo',
-        'steps__cover_photo',
-        'steps__photos'
-    ).all()
-    return [TripSchema(
-        id=t.id, #type: ignore
-        name=t.name,
-        steps=[
-            StepSchema(
-                id=s.id,
-                name=s.name,
-                lat=s.lat,
-                lng=s.lng,
-                description=s.description,
-                order=s.order,  # type: ignore[attr-defined]
-                cover_photo=(
-                    CoverPhotoRef(id=s.cover_photo.id, url=s.cover_photo.url) # type: ignore
-                    if s.cover_photo else None
-                ),
-                started_at=s.started_at.isoformat() if s.started_at else None,
-                ended_at=s.ended_at.isoformat() if s.ended_at else None,
-                photos=[
-                    PhotoSchema(
-                        id=p.id,
-                        name=p.name,
-                        description=p.description,
-                        date=p.date.isoformat(),
-                        url=p.url
-                    ) for p in s.photos.all() # type: ignore
-                ]
-            ) for s in t.steps.all().order_by('order') #type: ignore
-        ]
-        , cover_photo=(
-            CoverPhotoRef(id=t.cover_photo.id, url=t.cover_photo.url) # type: ignore
-            if t.cover_photo else None
-        )
-    ) for t in trips]
+async def list_trips(
+    request,
+    cursor: int | None = None,
+    limit: int | None = None,
+    expand: str = "steps,photos",
+):
+    """List trips ordered by id.
+
+    Keyset pagination: pass `limit` (max TRIPS_PAGE_MAX) and, for the following pages, the
+    `cursor` returned in the `X-Next-Cursor` header (the last trip id seen). Without `limit`
+    every trip is returned.
+    `expand` selects the nested levels: "steps,photos" (default), "steps" (steps without
+    photos) or "" (trip summary only: id, name, cover_photo).
+    Trip payloads are served pre-rendered from the trip cache (see trips/cache.py).
+    """
+    try:
+        levels = parse_expand(expand)
+    except ValueError as e:
+        return api.create_response(request, {"error": str(e)}, status=400)
+    if limit is not None and not 1 <= limit <= TRIPS_PAGE_MAX:
+        return api.create_response(request, {"error": f"limit must be between 1 and {TRIPS_PAGE_MAX}"}, status=400)
+    trips = Trip.objects.only('id', 'revision', 'updated_at').order_by('id')
+    if cursor is not None:
+        trips = trips.filter(id__gt=cursor)
+    next_cursor = None
+    if limit is not None:
+        # Fetch one extra row to know whether another page exists
+        trips = [trip async for trip in trips[:limit + 1]]
+        if len(trips) > limit:
+            trips = trips[:limit]
+            next_cursor = trips[-1].pk
+    else:
+        trips = [trip async for trip in trips]
+    payloads = await sync_to_async(render_trips)(trips, steps='steps' in levels, photos='photos' in levels)
+    response = HttpResponse(b'[' + b','.join(payloads) + b']', content_type='application/json')
+    if next_cursor is not None:
+        response['X-Next-Cursor'] = str(next_cursor)
+    return response
+
+@api.post("/trips/import", response={202: TripImportResponse})
+def import_trip(
+    request,
+    file: UploadedFile = File(...),  # type: ignore
+    name: str | None = Form(None),  # type: ignore
+    description: str = Form(''),  # type: ignore
+    gap_hours: float | None = Form(None),  # type: ignore
+    radius_km: float | None = Form(None),  # type: ignore
+):  # type: ignore
+    """Create a trip from a zip archive of geotagged photos.
+
+    Declared before /trips/{trip_id} so that "import" is not taken for a trip id.
+
+    Steps are built from the photos' EXIF capture time and GPS position (see
+    services/ingest.py). The photos are queued for upload: 202 is returned as soon as the
+    trip exists, follow the uploads with GET /trips/{id}/import.
+
+    The upload handlers stream the request body to a temporary file as it arrives, but the
+    photos are extracted to the spool before answering: archives over TRIP_IMPORT_MAX_BYTES
+    (compressed or extracted) are refused with 413, `manage.py import_trip` takes them.
+    """
+    options = {
+        'description': description,
+        'gap': timedelta(hours=gap_hours) if gap_hours is not None else None,
+        'radius_km': radius_km,
+    }
+    too_large = {"error": f"archive larger than {settings.TRIP_IMPORT_MAX_BYTES} bytes, use manage.py import_trip"}
+    if file.size > settings.TRIP_IMPORT_MAX_BYTES:
+        return api.create_response(request, too_large, status=413)
+    try:
+        with zipfile.ZipFile(file) as archive:
+            if sum(info.file_size for info in archive.infolist()) > settings.TRIP_IMPORT_MAX_BYTES:
+                return api.create_response(request, too_large, status=413)
+            trip = ingest.ingest(name or os.path.splitext(file.name)[0], ingest.archive_sources(archive), **options)
+    except zipfile.BadZipFile:
+        return api.create_response(request, {"error": "file must be a zip archive"}, status=400)
+    except ingest.IngestError as e:
+        return api.create_response(request, {"error": str(e)}, status=400)
+    return 202, {'trip_id': trip.id, 'steps': trip.steps.count(), 'progress': ingest.import_progress(trip.id)}  # type: ignore[attr-defined]
+
+@api.get("/trips/{trip_id}/import", response=ImportProgressSchema)
+async def import_progress(request, trip_id: int):
+    """Upload status counts of a trip's photos."""
+    await aget_object_or_404(Trip, id=trip_id)
+    return await sync_to_async(ingest.import_progress)(trip_id)
+
+@api.get("/trips/{trip_id}", response=TripSchema)
+async def get_trip(request, trip_id: int):
+    """Return one trip with its steps and photos, supporting conditional GET.
+
+    The ETag / Last-Modified come from the trip revision (bumped on any trip, step or photo
+    write), so a matching If-None-Match / If-Modified-Since is answered with 304 after a
+    single indexed query, without loading or serializing the tree.
+    """
+    trip = await aget_object_or_404(Trip.objects.only('id', 'revision', 'updated_at'), id=trip_id)
+    last_modified = int(trip.updated_at.timestamp())
+    response = get_conditional_response(request, etag=trip.etag, last_modified=last_modified)
+    if response is None:
+        payloads = await sync_to_async(render_trips)([trip])
+        response = HttpResponse(payloads[0], content_type='application/json')
+        # Allow the browser to keep a copy but always revalidate it
+        response['Cache-Control'] = 'no-cache'
+    response['ETag'] = trip.etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+SEARCH_PAGE_MAX = 100
+
+
+@api.get("/search", response=list[SearchResultSchema])
+async def search_all(request, q: str, limit: int = 20, offset: int = 0):
+    """Trips, steps and photos whose name or description match `q`, best match first.
+
+    Every word of `q` matches as a prefix ("lyo" finds "Lyon"); names close to `q` also match,
+    despite typos (PostgreSQL, see trips/search.py). Paginated with `limit` (max
+    SEARCH_PAGE_MAX) and `offset`; the next offset is returned in the `X-Next-Offset` header.
+    """
+    if not 1 <= limit <= SEARCH_PAGE_MAX:
+        return api.create_response(request, {"error": f"limit must be between 1 and {SEARCH_PAGE_MAX}"}, status=400)
+    if offset < 0:
+        return api.create_response(request, {"error": "offset must not be negative"}, status=400)
+    try:
+        results, more = await sync_to_async(search.search)(q, limit, offset)
+    except ValueError as e:
+        return api.create_response(request, {"error": str(e)}, status=400)
+    response = api.create_response(request, results, status=200)
+    if more:
+        response['X-Next-Offset'] = str(offset + limit)
+    return response
+
+@api.get("/sync", response=SyncSchema)
+def sync_changes(request, since: int = 0, limit: int | None = None):
+    """Trips, steps and photos created or updated since a sync token, and the deleted ids.
+
+    Start with since=0 (everything, no deletions), then pass the returned `token` each time.
+    Trips come without their steps, steps without their photos (each carries its parent id);
+    photos are reported once ready. With `more`, call again at once with the new token: a page
+    holds about `limit` (max SYNC_PAGE_MAX) rows, changes sequenced together are not split.
+    410 means the token is too old (deletions were pruned): sync again from 0.
+
+    Pending changes are given their sequence values here, the only writes of the request
+    (see trips/sync.py for why they are not taken by the writers).
+    """
+    if limit is not None and not 1 <= limit <= settings.SYNC_PAGE_MAX:
+        return api.create_response(request, {"error": f"limit must be between 1 and {settings.SYNC_PAGE_MAX}"}, status=400)
+    if since < 0:
+        return api.create_response(request, {"error": "since must be a token returned by /sync"}, status=400)
+    try:
+        return sync.changes(since, limit)
+    except sync.TokenExpired as e:
+        return api.create_response(request, {"error": str(e)}, status=410)
+
+STEPS_BBOX_MAX = 5000
+
+
+@api.get("/steps", response=list[StepMarkerSchema])
+async def list_steps_in_bbox(request, bbox: str, trip_id: int | None = None, limit: int = STEPS_BBOX_MAX):
+    """Steps inside the map viewport `bbox=minLng,minLat,maxLng,maxLat`, with their cover photo.
+
+    Optionally restricted to one trip. At most `limit` (<= STEPS_BBOX_MAX) steps are returned.
+    """
+    try:
+        box = parse_bbox(bbox)
+    except ValueError as e:
+        return api.create_response(request, {"error": str(e)}, status=400)
+    steps = Step.objects.filter(bbox_q(box))
+    if trip_id is not None:
+        steps = steps.filter(trip_id=trip_id)
+    rows = steps.order_by('trip_id', 'order', 'id').values(
+        'id', 'trip_id', 'name', 'lat', 'lng', 'order', 'cover_photo_id', 'cover_photo__url', 'cover_photo__variants',
+    )[:max(1, min(limit, STEPS_BBOX_MAX))]
+    return [{
+        'id': r['id'],
+        'trip_id': r['trip_id'],
+        'name': r['name'],
+        'lat': r['lat'],
+        'lng': r['lng'],
+        'order': r['order'],
+        'cover_photo': cover_photo_from_values(r),
+    } async for r in rows]
+
+@api.get("/clusters", response=list[ClusterSchema])
+def list_clusters(request, bbox: str, zoom: int):
+    """Step clusters (centroid, count, representative cover photo) for a map viewport and zoom.
+
+    Read from the precomputed grid index, so the cost depends on the number of cells on
+    screen rather than on the number of steps.
+    """
+    try:
+        box = parse_bbox(bbox)
+    except ValueError as e:
+        return api.create_response(request, {"error": str(e)}, status=400)
+    return clusters(box, zoom)
+
+@api.get("/trips/{trip_id}/route")
+def get_trip_route(request, trip_id: int, zoom: int = MAX_ZOOM):
+    """GeoJSON FeatureCollection of a trip: route LineString simplified for `zoom` plus step Points."""
+    if not 0 <= zoom <= MAX_ZOOM:
+        return api.create_response(request, {"error": f"zoom must be between 0 and {MAX_ZOOM}"}, status=400)
+    trip = get_object_or_404(Trip.objects.only('id', 'revision', 'updated_at'), id=trip_id)
+    etag = f'{trip.etag[:-1]}-z{zoom}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(dumps(route_geojson(trip, zoom)), content_type='application/geo+json')
+        response['Cache-Control'] = 'no-cache'
+    response['ETag'] = etag
+    return response
+
+@api.get("/tiles/{z}/{x}/{y}.mvt")
+def get_tile(request, z: int, x: int, y: int):
+    """Mapbox Vector Tile with `routes` (simplified trip lines) and `steps` (points) layers.
+
+    Tiles with more than TILE_MAX_STEPS steps have a `clusters` layer (points with a `count`) instead of `steps`.
+    """
+    if not 0 <= z <= MAX_ZOOM or not 0 <= x < (1 << z) or not 0 <= y < (1 << z):
+        return api.create_response(request, {"error": "Tile out of range"}, status=400)
+    return HttpResponse(render_tile(z, x, y), content_type='application/vnd.mapbox-vector-tile')
 
 @api.post("/trips", response=TripSchema)
 def create_trip(request, data: TripSchema):
@@ -107,14 +487,101 @@ def add_step(request, trip_id: int, data: StepCreateSchema):
     step = Step.objects.create(trip=trip, **data.dict())
     return StepSchema(id=step.id, name=step.name, lat=step.lat, lng=step.lng, description=step.description, order=step.order) # type: ignore[attr-defined]
 
+@api.post("/trips/{trip_id}/track", response=TrackImportResponse)
+def import_track(
+    request,
+    trip_id: int,
+    file: UploadedFile = File(...),  # type: ignore
+    create_steps: bool = Form(False),  # type: ignore
+):  # type: ignore
+    """Attach a recorded GPS track (GPX or GeoJSON) to a trip, replacing any previous one.
+
+    The track is simplified and stored compactly on the trip; it becomes the trip's route.
+    Detected stops are returned, and with create_steps=true also appended as steps.
+    """
+    trip = get_object_or_404(Trip, id=trip_id)
+    try:
+        result = tracks.import_track(file, file.name)
+    except tracks.TrackError as e:
+        return api.create_response(request, {"error": str(e)}, status=400)
+    step_ids = []
+    try:
+        # The track is only kept along with its steps
+        with transaction.atomic():
+            trip.track = result['track']
+            trip.save(update_fields=['track', 'revision', 'updated_at'])
+            if create_steps and result['stops']:
+                step_ids = bulk.create_steps(trip_id, tracks.stop_steps(result['stops']))
+    except ValueError as e:
+        return api.create_response(request, {"error": str(e)}, status=400)
+    return {**result, 'step_ids': step_ids}
+
+@api.post("/trips/{trip_id}/steps/bulk", response=BulkResponse)
+def add_steps_bulk(request, trip_id: int, data: StepBulkCreateSchema):
+    """Append up to BULK_MAX_ITEMS (default 1000) steps, in the given order, in one transaction.
+
+    Returns the ids of the created steps in payload order.
+    """
+    try:
+        ids = bulk.create_steps(trip_id, [item.dict() for item in data.steps])
+    except Trip.DoesNotExist:
+        raise Http404("Trip not found")
+    except ValueError as e:
+        return api.create_response(request, {"error": str(e)}, status=400)
+    return {'ids': ids}
+
+@api.patch("/trips/{trip_id}/steps/bulk", response=BulkResponse)
+def update_steps_bulk(request, trip_id: int, data: StepBulkUpdateSchema):
+    """Partially update up to BULK_MAX_ITEMS steps of a trip with one bulk_update; omitted fields are kept."""
+    get_object_or_404(Trip, id=trip_id)
+    try:
+        ids = bulk.update_steps(trip_id, [item.dict() for item in data.steps])
+    except ValueError as e:
+        return api.create_response(request, {"error": str(e)}, status=400)
+    return {'ids': ids}
+
+@api.post("/trips/{trip_id}/photos/bulk", response=BulkResponse)
+def add_photos_bulk(request, trip_id: int, data: PhotoBulkCreateSchema):
+    """Create up to BULK_MAX_ITEMS photo records (already hosted `url`s) on steps of a trip."""
+    get_object_or_404(Trip, id=trip_id)
+    try:
+        ids = bulk.create_photos(trip_id, [item.dict() for item in data.photos])
+    except ValueError as e:
+        return api.create_response(request, {"error": str(e)}, status=400)
+    return {'ids': ids}
+
+@api.patch("/trips/{trip_id}/steps/order", response=list[StepOrderItem])
+def reorder_steps(request, trip_id: int, data: StepOrderSchema):
+    """Apply a whole new step ordering: `step_ids` lists every step of the trip in its new order."""
+    get_object_or_404(Trip, id=trip_id)
+    try:
+        steps = ordering.reorder_steps(trip_id, data.step_ids)
+    except ValueError as e:
+        return api.create_response(request, {"error": str(e)}, status=400)
+    return [{'id': step.id, 'order': step.order} for step in steps]  # type: ignore[attr-defined]
+
 @api.post("/trips/{trip_id}/steps/{step_id}/photos", response=PhotoSchema)
 def create_photo(request, trip_id: int, step_id: int, data: PhotoCreateSchema):
     step = get_object_or_404(Step, id=step_id, trip_id=trip_id)
     photo = Photo.objects.create(step=step, name=data.name, description=data.description, url=data.url)
     return PhotoSchema(id=photo.id, name=photo.name, description=photo.description, date=photo.date.isoformat(), url=photo.url) # type: ignore
 
+@api.post("/trips/{trip_id}/steps/{step_id}/derive-from-photos", response=StepDerivationSchema)
+def derive_step_from_photos(request, trip_id: int, step_id: int, apply: bool = False):
+    """Validate a step against the EXIF capture times / GPS positions of its photos.
+
+    Returns the derived span and position with the disagreements found; with ?apply=true
+    the step's started_at / ended_at / lat / lng are replaced by the derived values.
+    """
+    step = get_object_or_404(Step, id=step_id, trip_id=trip_id)
+    return exif.derive_step(step, apply=apply)
+
+def owncloud_error_response(request, error: OwnCloudError):
+    status = 400 if 'incomplete' in str(error).lower() else 500
+    return api.create_response(request, {"error": str(error)}, status=status)
+
 @api.post("/trips/{trip_id}/steps/{step_id}/photos/upload", response=PhotoUploadResponse)
-def upload_photo(
+async def upload_photo(
     request,
     trip_id: int,
     step_id: int,
@@ -125,19 +592,263 @@ def upload_photo(
     """Upload a photo file and create a Photo record.
 
     name / description are expected as multipart form fields together with the file.
+    The file is streamed to ownCloud from Django's upload (a temporary file above
+    FILE_UPLOAD_MAX_MEMORY_SIZE), never read in memory as a whole.
+
+    A file already uploaded (same SHA-256) is not sent again: the new photo reuses the
+    remote file of the earlier one (`duplicate_of`), and re-uploading it to the same step
+    returns the existing photo.
+
+    The view is async: under ASGI the ownCloud round trips are awaited on the shared async
+    client instead of holding a worker thread; file hashing / reading and image decoding
+    (EXIF, perceptual hash, variants) run in threads.
     """
-    step = get_object_or_404(Step, id=step_id, trip_id=trip_id)
+    step = await aget_object_or_404(Step, id=step_id, trip_id=trip_id)
     display_name = name or file.name
+    digest = await sync_to_async(dedup.content_hash, thread_sensitive=False)(file)
+    originals = await sync_to_async(dedup.find_originals)(step.id, [digest])  # type: ignore[attr-defined]
+    original = originals.get(digest)
+    if original is not None:
+        photo = original
+        if original.step_id != step.id:  # type: ignore[attr-defined]
+            photo = await Photo.objects.acreate(
+                step=step, name=display_name, description=description, content_hash=digest, **dedup.reused_fields(original),
+            )
+        return {**photo_dict(photo), 'duplicate_of': original.id}  # type: ignore[attr-defined]
+    metadata = await sync_to_async(exif.read_metadata, thread_sensitive=False)(file)
     try:
-        share_page_url, direct_url = upload_file(file.read(), file.name)
+        share_page_url, direct_url = await owncloud.upload_from_view(request, file, file.name)
     except OwnCloudError as e:
-        status = 400 if 'incomplete' in str(e).lower() else 500
-        return api.create_response(request, {"error": str(e)}, status=status)
-    photo = Photo.objects.create(step=step, name=display_name, description=description, url=direct_url)
-    return PhotoUploadResponse(
-    id=photo.id,  # type: ignore[attr-defined]
-        name=photo.name,
-        description=photo.description,
-        url=photo.url,
-        date=photo.date.isoformat(),
-    )  # type: ignore
+        return owncloud_error_response(request, e)
+    perceptual_hash = await sync_to_async(dedup.perceptual_hash, thread_sensitive=False)(file)
+    variants = None
+    if settings.PHOTO_VARIANTS_ENABLED:
+        variants = await sync_to_async(derivatives.create_variants, thread_sensitive=False)(file, file.name)
+    photo = await Photo.objects.acreate(
+        step=step, name=display_name, description=description, url=direct_url,
+        content_hash=digest, perceptual_hash=perceptual_hash, **metadata, **(variants or {}),
+    )
+    near = await sync_to_async(dedup.near_duplicates)(trip_id, [photo])
+    return {**photo_dict(photo), 'near_duplicates': near.get(photo.id, [])}  # type: ignore[attr-defined]
+
+
+@api.post("/trips/{trip_id}/steps/{step_id}/photos/batch", response=BatchUploadResponse)
+async def upload_photos_batch(
+    request,
+    trip_id: int,
+    step_id: int,
+    files: list[UploadedFile] = File(...),  # type: ignore
+):  # type: ignore
+    """Upload many photos in one multipart request (repeated `files` fields).
+
+    Files are pushed to ownCloud concurrently (UPLOAD_BATCH_CONCURRENCY at a time) and the
+    Photo rows of the successful ones are inserted with a single bulk_create. The response
+    lists the outcome of every file, in request order; failures do not abort the batch.
+    Files already uploaded, or repeated within the batch, are deduplicated as in /upload.
+    """
+    step = await aget_object_or_404(Step, id=step_id, trip_id=trip_id)
+    if len(files) > settings.UPLOAD_BATCH_MAX_FILES:
+        return api.create_response(request, {"error": f"At most {settings.UPLOAD_BATCH_MAX_FILES} files per batch"}, status=400)
+    digests = [await sync_to_async(dedup.content_hash, thread_sensitive=False)(file) for file in files]
+    originals = await sync_to_async(dedup.find_originals)(step.id, digests)  # type: ignore[attr-defined]
+    # One upload per distinct unknown content
+    pending: dict[str, UploadedFile] = {}
+    for file, digest in zip(files, digests):
+        if digest not in originals:
+            pending.setdefault(digest, file)
+    slots = asyncio.Semaphore(settings.UPLOAD_BATCH_CONCURRENCY)
+
+    async def push(file: UploadedFile):
+        async with slots:
+            metadata = await sync_to_async(exif.read_metadata, thread_sensitive=False)(file)
+            try:
+                share_page_url, direct_url = await owncloud.upload_from_view(request, file, file.name)
+            except OwnCloudError as e:
+                return None, str(e)
+            perceptual_hash = await sync_to_async(dedup.perceptual_hash, thread_sensitive=False)(file)
+            fields = None
+            if settings.PHOTO_VARIANTS_ENABLED:
+                fields = await sync_to_async(derivatives.create_variants, thread_sensitive=False)(file, file.name)
+        return {'url': direct_url, 'perceptual_hash': perceptual_hash, **metadata, **(fields or {})}, None
+
+    pushed = dict(zip(pending, await asyncio.gather(*(push(file) for file in pending.values()))))
+    return await sync_to_async(save_batch)(step, files, digests, originals, pushed)
+
+
+def save_batch(step: Step, files: list[UploadedFile], digests: list[str], originals: dict[str, Photo], pushed: dict) -> dict:
+    """Insert the photos of an upload batch and build its response (see upload_photos_batch)."""
+    trip_id = step.trip_id  # type: ignore[attr-defined]
+    new_photos: dict[str, Photo] = {}
+    for file, digest in zip(files, digests):
+        original = originals.get(digest)
+        if digest in new_photos or (original is not None and original.step_id == step.id):  # type: ignore[attr-defined]
+            continue
+        fields = dedup.reused_fields(original) if original is not None else pushed[digest][0]
+        if fields is not None:
+            new_photos[digest] = Photo(step=step, name=file.name, content_hash=digest, **fields)
+    photos = Photo.objects.bulk_create(list(new_photos.values()))
+    if photos:
+        # bulk_create skips the model signals
+        Step.objects.filter(id=step.id).update(photo_count=F('photo_count') + len(photos), change_seq=None)  # type: ignore[attr-defined]
+        Trip.objects.filter(id=trip_id).touch(photo_count=F('photo_count') + len(photos))
+        invalidate_trip(trip_id)
+    near = dedup.near_duplicates(trip_id, photos)
+    results = []
+    first_file: dict[str, UploadedFile] = {}
+    for file, digest in zip(files, digests):
+        original = originals.get(digest)
+        photo = new_photos.get(digest)
+        if original is not None and original.step_id == step.id:  # type: ignore[attr-defined]
+            photo, duplicate_of = original, original.id  # type: ignore[attr-defined]
+        elif photo is None:
+            results.append({'filename': file.name, 'ok': False, 'error': pushed[digest][1]})
+            continue
+        elif first_file.setdefault(digest, file) is file:
+            duplicate_of = original.id if original is not None else None  # type: ignore[attr-defined]
+        else:
+            duplicate_of = photo.id  # type: ignore[attr-defined]
+        item = {**photo_dict(photo), 'duplicate_of': duplicate_of, 'near_duplicates': near.get(photo.id, [])}  # type: ignore[attr-defined]
+        results.append({'filename': file.name, 'ok': True, 'photo': item})
+    failed = sum(not result['ok'] for result in results)
+    return {'created': len(photos), 'failed': failed, 'results': results}
+
+@api.post("/trips/{trip_id}/steps/{step_id}/photos/upload-async", response={202: PhotoStatusSchema})
+def upload_photo_async(
+    request,
+    trip_id: int,
+    step_id: int,
+    file: UploadedFile = File(...),  # type: ignore
+    name: str | None = Form(None),  # type: ignore
+    description: str | None = Form(None),  # type: ignore
+):  # type: ignore
+    """Accept a photo without waiting for ownCloud.
+
+    The file is spooled locally and a `pending` Photo is returned with 202; a
+    `manage.py process_uploads` worker uploads it and flips it to `ready` with its URL.
+    Poll GET /photos/{id}/status for the outcome.
+    """
+    step = get_object_or_404(Step, id=step_id, trip_id=trip_id)
+    photo = upload_queue.spool_photo(step, file, name or file.name, description)
+    return 202, photo
+
+@api.get("/photos/{photo_id}/status", response=PhotoStatusSchema)
+async def photo_status(request, photo_id: int):
+    return await aget_object_or_404(Photo.objects.only('id', 'name', 'status', 'url', 'error'), id=photo_id)
+
+def upload_session_response(session: UploadSession, chunks: dict[int, int] | None = None) -> UploadSessionSchema:
+    chunks = chunks or {}
+    return UploadSessionSchema(
+        id=session.id,  # type: ignore[attr-defined]
+        status=session.status,
+        filename=session.original_name,
+        size=session.total_size,
+        chunks=sorted(chunks),
+        received=sum(chunks.values()),
+    )
+
+@api.post("/trips/{trip_id}/steps/{step_id}/uploads", response=UploadSessionSchema)
+def start_upload(request, trip_id: int, step_id: int, data: UploadSessionCreateSchema):
+    """Open a resumable upload (Nextcloud chunking v2).
+
+    Send the file as numbered chunks with PUT /uploads/{id}/chunks/{n} (1-based, any order,
+    re-sendable), check progress with GET /uploads/{id} and finish with POST /uploads/{id}/complete.
+    """
+    step = get_object_or_404(Step, id=step_id, trip_id=trip_id)
+    remote_path = owncloud.new_remote_path(data.filename)
+    try:
+        upload_id = owncloud.start_chunked_upload(remote_path)
+    except OwnCloudError as e:
+        return owncloud_error_response(request, e)
+    session = UploadSession.objects.create(
+        step=step, name=data.name or data.filename, description=data.description, original_name=data.filename,
+        total_size=data.size, upload_id=upload_id, remote_path=remote_path,
+    )
+    return upload_session_response(session)
+
+@api.get("/uploads/{session_id}", response=UploadSessionSchema)
+def get_upload(request, session_id: int):
+    """Upload status, including the chunk numbers already received for an open upload."""
+    session = get_object_or_404(UploadSession, id=session_id)
+    if session.status != UploadSession.STATUS_OPEN:
+        return upload_session_response(session)
+    try:
+        return upload_session_response(session, owncloud.list_chunks(session.upload_id))
+    except OwnCloudError as e:
+        return owncloud_error_response(request, e)
+
+@api.put("/uploads/{session_id}/chunks/{number}", response={204: None})
+def put_upload_chunk(request, session_id: int, number: int):
+    """Store one chunk; the raw request body is streamed to ownCloud."""
+    session = get_object_or_404(UploadSession, id=session_id)
+    if session.status != UploadSession.STATUS_OPEN:
+        return api.create_response(request, {"error": f"Upload is {session.status}"}, status=409)
+    if not 1 <= number <= owncloud.MAX_CHUNKS:
+        return api.create_response(request, {"error": f"Chunk number must be between 1 and {owncloud.MAX_CHUNKS}"}, status=400)
+    length = int(request.META.get('CONTENT_LENGTH') or 0)
+    if not length:
+        return api.create_response(request, {"error": "Empty chunk"}, status=400)
+    try:
+        owncloud.upload_chunk(session.upload_id, session.remote_path, number, SizedReader(request, length))
+    except OwnCloudError as e:
+        return owncloud_error_response(request, e)
+    return 204, None
+
+@api.post("/uploads/{session_id}/complete", response=PhotoUploadResponse)
+def complete_upload(request, session_id: int):
+    """Assemble the chunks, share the file and create the Photo.
+
+    Chunks arrive in any order and may be re-sent, so the assembled file is read back once to
+    be processed like a single request upload (/upload): content hash and duplicate detection,
+    EXIF metadata, perceptual hash and variants. An exact copy of an earlier upload is deleted
+    from ownCloud and the photo reuses the earlier remote file (`duplicate_of`).
+    """
+    session = get_object_or_404(UploadSession.objects.select_related('step'), id=session_id)
+    if session.status != UploadSession.STATUS_OPEN:
+        return api.create_response(request, {"error": f"Upload is {session.status}"}, status=409)
+    step = session.step
+    with tempfile.TemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR) as file:
+        try:
+            owncloud.assemble_chunked_upload(session.upload_id, session.remote_path, session.total_size)
+            owncloud.download_file(session.remote_path, file)
+            digest = dedup.content_hash(file)
+            original = dedup.find_originals(step.id, [digest]).get(digest)  # type: ignore[attr-defined]
+            if original is not None:
+                owncloud.delete_file(session.remote_path)
+            else:
+                share_page_url, direct_url = owncloud.share_file(session.remote_path)
+        except OwnCloudError as e:
+            return owncloud_error_response(request, e)
+        if original is not None:
+            photo = original
+            if original.step_id != step.id:  # type: ignore[attr-defined]
+                photo = Photo.objects.create(
+                    step=step, name=session.name, description=session.description, content_hash=digest, **dedup.reused_fields(original),
+                )
+        else:
+            variants = None
+            if settings.PHOTO_VARIANTS_ENABLED:
+                variants = derivatives.create_variants(file, session.original_name)
+            photo = Photo.objects.create(
+                step=step, name=session.name, description=session.description, url=direct_url, content_hash=digest,
+                perceptual_hash=dedup.perceptual_hash(file), **exif.read_metadata(file), **(variants or {}),
+            )
+    session.status = UploadSession.STATUS_COMPLETE
+    # An existing photo returned as is keeps its own upload session (one per photo)
+    session.photo = photo if photo is not original else None
+    session.save(update_fields=['status', 'photo'])
+    if original is not None:
+        return {**photo_dict(photo), 'duplicate_of': original.id}  # type: ignore[attr-defined]
+    near = dedup.near_duplicates(step.trip_id, [photo])  # type: ignore[attr-defined]
+    return {**photo_dict(photo), 'near_duplicates': near.get(photo.id, [])}  # type: ignore[attr-defined]
+
+@api.delete("/uploads/{session_id}", response={204: None})
+def abort_upload(request, session_id: int):
+    session = get_object_or_404(UploadSession, id=session_id)
+    if session.status == UploadSession.STATUS_OPEN:
+        try:
+            owncloud.abort_chunked_upload(session.upload_id)
+        except OwnCloudError as e:
+            return owncloud_error_response(request, e)
+        session.status = UploadSession.STATUS_ABORTED
+        session.save(update_fields=['status'])
+    return 204, None
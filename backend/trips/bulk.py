@@ -0,0 +1,90 @@
+"""Bulk writes of steps and photos: one ownership query and one bulk statement per batch.
+
+bulk_create / bulk_update skip the model signals and save(), so the trip revision and
+statistics, the sync change marks, the payload cache and the map grid are maintained here.
+"""
+from django.conf import settings
+from django.db import transaction
+from . import clustering, stats
+from .cache import invalidate_trip
+from .models import Trip, Step, Photo
+
+STEP_UPDATE_FIELDS = ('name', 'description', 'lat', 'lng', 'started_at', 'ended_at')
+
+
+def check_size(items: list):
+    if not items:
+        raise ValueError("Empty batch")
+    if len(items) > settings.BULK_MAX_ITEMS:
+        raise ValueError(f"At most {settings.BULK_MAX_ITEMS} items per request")
+
+
+def _touch(trip_id: int, photos: bool = False):
+    stats.refresh([trip_id], photos=photos)
+    Trip.objects.filter(id=trip_id).touch()
+    invalidate_trip(trip_id)
+
+
+def create_steps(trip_id: int, items: list[dict]) -> list[int]:
+    """Append steps to a trip in the given order; raises Trip.DoesNotExist for an unknown trip."""
+    check_size(items)
+    with transaction.atomic():
+        first = Trip.objects.reserve_step_orders(trip_id, len(items))
+        steps = Step.objects.bulk_create([
+            Step(trip_id=trip_id, order=first + i, **{k: v for k, v in item.items() if v is not None})
+            for i, item in enumerate(items)
+        ])
+        clustering.add_points([(step.lat, step.lng) for step in steps])
+        _touch(trip_id)
+    return [step.pk for step in steps]
+
+
+def update_steps(trip_id: int, items: list[dict]) -> list[int]:
+    """Apply partial updates ({'id', field: value, ...}) to steps of a trip; raises ValueError
+    when an id does not belong to the trip."""
+    check_size(items)
+    ids = [item['id'] for item in items]
+    if len(ids) != len(set(ids)):
+        raise ValueError("Duplicate step ids")
+    with transaction.atomic():
+        steps = Step.objects.select_for_update().in_bulk(ids)
+        foreign = [step_id for step_id in ids if step_id not in steps or steps[step_id].trip_id != trip_id]  # type: ignore[attr-defined]
+        if foreign:
+            raise ValueError(f"Steps {foreign} do not belong to trip {trip_id}")
+        fields: set[str] = set()
+        moved = []
+        for item in items:
+            step = steps[item['id']]
+            previous = (step.lat, step.lng, step.cover_photo_id)  # type: ignore[attr-defined]
+            for field in STEP_UPDATE_FIELDS:
+                if item.get(field) is not None:
+                    setattr(step, field, item[field])
+                    fields.add(field)
+            if (step.lat, step.lng) != previous[:2]:
+                moved.append((previous, step))
+        if fields:
+            for step in steps.values():
+                step.change_seq = None
+            Step.objects.bulk_update(list(steps.values()), sorted(fields | {'change_seq'}))
+        for (lat, lng, cover_photo_id), _ in moved:
+            clustering.remove_point(lat, lng, cover_photo_id)
+        clustering.add_points([(step.lat, step.lng) for _, step in moved])
+        for _, step in moved:
+            if step.cover_photo_id is not None:  # type: ignore[attr-defined]
+                clustering.set_cover(step.lat, step.lng, step.cover_photo_id)  # type: ignore[attr-defined]
+        _touch(trip_id)
+    return ids
+
+
+def create_photos(trip_id: int, items: list[dict]) -> list[int]:
+    """Create photos ({'step_id', 'name', 'description', 'url'}) on steps of a trip; raises
+    ValueError when a step does not belong to the trip."""
+    check_size(items)
+    step_ids = {item['step_id'] for item in items}
+    owned = set(Step.objects.filter(trip_id=trip_id, id__in=step_ids).values_list('id', flat=True))
+    if step_ids - owned:
+        raise ValueError(f"Steps {sorted(step_ids - owned)} do not belong to trip {trip_id}")
+    with transaction.atomic():
+        photos = Photo.objects.bulk_create([Photo(**item) for item in items])
+        _touch(trip_id, photos=True)
+    return [photo.pk for photo in photos]
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.cache import caches
+from .models import Trip
+from .renderers import dumps
+from .serializers import EXPANDABLE, serialize_trips
+
+# Every (steps, photos) combination a trip can be rendered with, see parse_expand()
+VARIANTS = ((True, True), (True, False), (False, False))
+
+
+def trip_cache():
+    return caches[settings.TRIPS_CACHE_ALIAS]
+
+
+def _key(trip_id: int, steps: bool, photos: bool) -> str:
+    variant = ','.join(name for name, on in zip(EXPANDABLE, (steps, photos)) if on) or 'summary'
+    return f"trips:payload:{trip_id}:{variant}"
+
+
+def render_trips(trips: list[Trip], steps: bool = True, photos: bool = True) -> list[bytes]:
+    """Return the JSON encoded payload of each trip, in the given order.
+
+    `trips` only needs `id`, `revision` and `updated_at` loaded. Entries are stored together
+    with the trip ETag and ignored when it no longer matches, so a missed invalidation can
+    never serve stale data. Only the trips missing from the cache are serialized.
+    """
+    cache = trip_cache()
+    keys = {t.pk: _key(t.pk, steps, photos) for t in trips}
+    cached = cache.get_many(list(keys.values()))
+    payloads: dict[int, bytes] = {}
+    for t in trips:
+        entry = cached.get(keys[t.pk])
+        if entry is not None and entry[0] == t.etag:
+            payloads[t.pk] = entry[1]
+    missing = [t for t in trips if t.pk not in payloads]
+    if missing:
+        etags = {t.pk: t.etag for t in missing}
+        fresh = {}
+        for data in serialize_trips(Trip.objects.filter(id__in=etags), steps=steps, photos=photos):
+            payloads[data['id']] = dumps(data)
+            fresh[keys[data['id']]] = (etags[data['id']], payloads[data['id']])
+        cache.set_many(fresh, timeout=settings.TRIPS_CACHE_TIMEOUT)
+    return [payloads[t.pk] for t in trips if t.pk in payloads]
+
+
+def invalidate_trip(trip_id: int | None):
+    if trip_id is not None:
+        trip_cache().delete_many([_key(trip_id, steps, photos) for steps, photos in VARIANTS])
@@ -0,0 +1,132 @@
+from django.db import transaction
+from django.db.models import Case, F, FloatField, IntegerField, Q, Value, When
+from .geo import tile_xy
+from .models import Step, StepGridCell
+from .serializers import cover_photo_dict
+
+# Grid levels 0..MAX_LEVEL are indexed; a cell at level L is the slippy map tile L/x/y
+MAX_LEVEL = 18
+# Clusters for map zoom z come from level z + CELL_OFFSET (a 256px tile split in 4x4 cells)
+CELL_OFFSET = 2
+# Cells per (level, x, y) OR filter / CASE in add_points(), under SQLite's expression depth limit
+QUERY_CELLS = 200
+
+
+def _cells(lat: float, lng: float) -> list[tuple[int, int, int]]:
+    return [(level, *tile_xy(lat, lng, level)) for level in range(MAX_LEVEL + 1)]
+
+
+def _cells_q(cells) -> Q:
+    q = Q()
+    for level, x, y in cells:
+        q |= Q(level=level, x=x, y=y)
+    return q
+
+
+@transaction.atomic
+def add_point(lat: float, lng: float, cover_photo_id: int | None = None):
+    """Account for one step at (lat, lng) on every level (3 queries)."""
+    cells = _cells(lat, lng)
+    existing = set(StepGridCell.objects.filter(_cells_q(cells)).values_list('level', 'x', 'y'))
+    StepGridCell.objects.bulk_create(
+        [StepGridCell(level=level, x=x, y=y) for level, x, y in cells if (level, x, y) not in existing],
+        ignore_conflicts=True,
+    )
+    # Increment in place so concurrent writers never lose an update
+    StepGridCell.objects.filter(_cells_q(cells)).update(
+        count=F('count') + 1, lat_sum=F('lat_sum') + lat, lng_sum=F('lng_sum') + lng,
+    )
+    if cover_photo_id is not None:
+        set_cover(lat, lng, cover_photo_id)
+
+
+@transaction.atomic
+def add_points(points: list[tuple[float, float]]):
+    """add_point() for many steps at once, a few queries per QUERY_CELLS distinct cells.
+
+    The increments are summed per cell first, then applied with one CASE update per chunk.
+    """
+    deltas: dict[tuple[int, int, int], list] = {}
+    for lat, lng in points:
+        for key in _cells(lat, lng):
+            delta = deltas.setdefault(key, [0, 0.0, 0.0])
+            delta[0] += 1
+            delta[1] += lat
+            delta[2] += lng
+    keys = list(deltas)
+    for start in range(0, len(keys), QUERY_CELLS):
+        chunk = keys[start:start + QUERY_CELLS]
+        existing = set(StepGridCell.objects.filter(_cells_q(chunk)).values_list('level', 'x', 'y'))
+        StepGridCell.objects.bulk_create(
+            [StepGridCell(level=level, x=x, y=y) for level, x, y in chunk if (level, x, y) not in existing],
+            ignore_conflicts=True,
+        )
+
+        def increment(field: str, index: int, output_field):
+            return F(field) + Case(
+                *[When(level=level, x=x, y=y, then=Value(deltas[level, x, y][index])) for level, x, y in chunk],
+                output_field=output_field,
+            )
+        StepGridCell.objects.filter(_cells_q(chunk)).update(
+            count=increment('count', 0, IntegerField()),
+            lat_sum=increment('lat_sum', 1, FloatField()),
+            lng_sum=increment('lng_sum', 2, FloatField()),
+        )
+
+
+@transaction.atomic
+def remove_point(lat: float, lng: float, cover_photo_id: int | None = None):
+    cells = _cells_q(_cells(lat, lng))
+    StepGridCell.objects.filter(cells).update(
+        count=F('count') - 1, lat_sum=F('lat_sum') - lat, lng_sum=F('lng_sum') - lng,
+    )
+    StepGridCell.objects.filter(cells, count__lte=0).delete()
+    remove_cover(lat, lng, cover_photo_id)
+
+
+def remove_cover(lat: float, lng: float, cover_photo_id: int | None):
+    if cover_photo_id is not None:
+        StepGridCell.objects.filter(_cells_q(_cells(lat, lng)), cover_photo_id=cover_photo_id).update(cover_photo=None)
+
+
+def set_cover(lat: float, lng: float, cover_photo_id: int):
+    StepGridCell.objects.filter(_cells_q(_cells(lat, lng)), cover_photo__isnull=True).update(cover_photo=cover_photo_id)
+
+
+@transaction.atomic
+def rebuild():
+    """Recompute the whole grid from the steps table."""
+    StepGridCell.objects.all().delete()
+    cells: dict[tuple[int, int, int], StepGridCell] = {}
+    for lat, lng, cover_photo_id in Step.objects.values_list('lat', 'lng', 'cover_photo_id').iterator():
+        for key in _cells(lat, lng):
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = StepGridCell(level=key[0], x=key[1], y=key[2])
+            cell.count += 1
+            cell.lat_sum += lat
+            cell.lng_sum += lng
+            if cell.cover_photo_id is None:  # type: ignore[attr-defined]
+                cell.cover_photo_id = cover_photo_id  # type: ignore[attr-defined]
+    StepGridCell.objects.bulk_create(cells.values(), batch_size=1000)
+    return len(cells)
+
+
+def clusters(bbox: tuple[float, float, float, float], zoom: int) -> list[dict]:
+    """Clusters (centroid, count, cover photo) of the steps inside the bbox for a map zoom level."""
+    level = max(0, min(zoom + CELL_OFFSET, MAX_LEVEL))
+    min_lng, min_lat, max_lng, max_lat = bbox
+    x0, y0 = tile_xy(max_lat, min_lng, level)
+    x1, y1 = tile_xy(min_lat, max_lng, level)
+    cells = StepGridCell.objects.filter(level=level, y__gte=y0, y__lte=y1, count__gt=0)
+    if x0 <= x1:
+        cells = cells.filter(x__gte=x0, x__lte=x1)
+    else:
+        cells = cells.filter(Q(x__gte=x0) | Q(x__lte=x1))
+    return [{
+        'lat': c.lat_sum / c.count,
+        'lng': c.lng_sum / c.count,
+        'count': c.count,
+        'cover_photo': cover_photo_dict(c.cover_photo),
+    } for c in cells.select_related('cover_photo').order_by('y', 'x')]
+
@@ -0,0 +1,105 @@
+import math
+from django.db.models import Q
+
+
+def parse_bbox(bbox: str) -> tuple[float, float, float, float]:
+    """Parse "minLng,minLat,maxLng,maxLat"; raises ValueError when malformed.
+
+    minLng may be greater than maxLng for a box crossing the antimeridian.
+    """
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(v) for v in bbox.split(','))
+    except ValueError:
+        raise ValueError("bbox must be 'minLng,minLat,maxLng,maxLat'")
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lng <= 180 and -180 <= max_lng <= 180):
+        raise ValueError("bbox out of range (lng in [-180, 180], lat in [-90, 90], minLat <= maxLat)")
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def bbox_q(bbox: tuple[float, float, float, float]) -> Q:
+    """Q filtering rows whose `lat` / `lng` fall inside the box (served by the (lat, lng) index)."""
+    min_lng, min_lat, max_lng, max_lat = bbox
+    q = Q(lat__gte=min_lat, lat__lte=max_lat)
+    if min_lng <= max_lng:
+        return q & Q(lng__gte=min_lng, lng__lte=max_lng)
+    return q & (Q(lng__gte=min_lng) | Q(lng__lte=max_lng))
+
+
+MAX_MERCATOR_LAT = 85.0511287798
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance between two points, in kilometres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def path_length_km(points: list[tuple[float, float]]) -> float:
+    """Great-circle length of a (lat, lng) polyline, in kilometres.
+
+    Same formula as haversine_km(), with each point converted (radians, cosine) once
+    instead of once per leg.
+    """
+    if len(points) < 2:
+        return 0.0
+    phis = [math.radians(lat) for lat, _ in points]
+    lambdas = [math.radians(lng) for _, lng in points]
+    cosines = [math.cos(phi) for phi in phis]
+    total = 0.0
+    for i in range(1, len(points)):
+        a = math.sin((phis[i] - phis[i - 1]) / 2) ** 2 + cosines[i - 1] * cosines[i] * math.sin((lambdas[i] - lambdas[i - 1]) / 2) ** 2
+        total += math.asin(min(1.0, math.sqrt(a)))
+    return 2 * EARTH_RADIUS_KM * total
+
+
+def tile_xy(lat: float, lng: float, zoom: int) -> tuple[int, int]:
+    """Web Mercator (slippy map) tile containing the point at the given zoom level."""
+    n = 1 << zoom
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+# Encoded polylines (https://developers.google.com/maps/documentation/utilities/polylinealgorithm)
+POLYLINE_PRECISION = 1e5
+
+
+def encode_polyline(points: list[tuple[float, float]]) -> str:
+    """Google encoded polyline of (lat, lng) points."""
+    out = []
+    previous = (0, 0)
+    for lat, lng in points:
+        current = (round(lat * POLYLINE_PRECISION), round(lng * POLYLINE_PRECISION))
+        for value in (current[0] - previous[0], current[1] - previous[1]):
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        previous = current
+    return ''.join(out)
+
+
+def decode_polyline(encoded: str) -> list[tuple[float, float]]:
+    """(lat, lng) points of an encoded polyline."""
+    points = []
+    index = lat = lng = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1F) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        points.append((lat / POLYLINE_PRECISION, lng / POLYLINE_PRECISION))
+    return points
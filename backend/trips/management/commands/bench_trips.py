@@ -0,0 +1,57 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ninja.renderers import JSONRenderer
+from trips.api import TripSchema
+from trips.models import Trip, Step, Photo
+from trips.renderers import ORJSONRenderer
+from trips.serializers import serialize_trips
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare the pydantic + json and the plain dict + orjson trip serialization paths on synthetic data (rolled back)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--photos', type=int, default=10_000, help='Total number of photos to generate')
+        parser.add_argument('--trips', type=int, default=20)
+        parser.add_argument('--steps', type=int, default=25, help='Steps per trip')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._populate(options['trips'], options['steps'], options['photos'])
+                for label, func in (('schema + json', self._schema_path), ('dict + orjson', self._dict_path)):
+                    best = min(self._time(func) for _ in range(options['repeat']))
+                    self.stdout.write(f"{label:>14}: {best * 1000:8.1f} ms")
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _time(self, func) -> float:
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+
+    def _populate(self, n_trips: int, n_steps: int, n_photos: int):
+        trips = Trip.objects.bulk_create([Trip(name=f'Bench {i}', description='') for i in range(n_trips)])
+        steps = Step.objects.bulk_create([
+            Step(trip=t, order=j, name=f'Step {j}', description='', lat=j / 10, lng=j / 10)
+            for t in trips for j in range(n_steps)
+        ])
+        Photo.objects.bulk_create([
+            Photo(step=steps[i % len(steps)], name=f'photo {i}', url=f'https://cloud.example.com/s/{i}/download')
+            for i in range(n_photos)
+        ])
+        self.stdout.write(f"{n_trips} trips, {len(steps)} steps, {n_photos} photos")
+
+    def _schema_path(self):
+        trips = [TripSchema(**data) for data in serialize_trips()]
+        return JSONRenderer().render(None, [t.model_dump() for t in trips], response_status=200)  # type: ignore[arg-type]
+
+    def _dict_path(self):
+        return ORJSONRenderer().render(None, serialize_trips(), response_status=200)  # type: ignore[arg-type]
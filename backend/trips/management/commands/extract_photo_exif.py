@@ -0,0 +1,74 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from trips.cache import invalidate_trip
+from trips.models import Photo, Step, Trip
+from trips.services import exif
+from trips.services.owncloud import get_client, OwnCloudError
+
+
+def _metadata(photo: Photo) -> dict | None:
+    # Runs in a worker thread: only the header of the file is downloaded, the database is written by the main thread
+    out = io.BytesIO()
+    try:
+        get_client().download(photo.url, out, max_bytes=exif.HEADER_BYTES)
+    except OwnCloudError as e:
+        exif.logger.warning("Could not download photo %s: %s", photo.pk, e)
+        return None
+    return exif.read_metadata(out)
+
+
+class Command(BaseCommand):
+    help = "Backfill EXIF capture time, GPS position and orientation of existing photos, fetching their headers in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--batch-size', type=int, default=200, help='Photos saved per bulk_update')
+        parser.add_argument('--force', action='store_true', help='Read photos whose metadata was already extracted')
+        parser.add_argument('--derive-steps', action='store_true', help='Replace the time span / position of the updated steps with the ones derived from their photos')
+
+    def handle(self, *args, **options):
+        photos = Photo.objects.filter(status=Photo.STATUS_READY).exclude(url='').select_related('step').order_by('id')
+        if not options['force']:
+            photos = photos.filter(orientation__isnull=True, exif_checked=False)
+        done = total = 0
+        step_ids: set[int] = set()
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            batch: list[Photo] = []
+            for photo in photos.iterator(chunk_size=options['batch_size']):
+                batch.append(photo)
+                if len(batch) >= options['batch_size']:
+                    done += self._process(pool, batch, step_ids)
+                    total += len(batch)
+                    batch = []
+            if batch:
+                done += self._process(pool, batch, step_ids)
+                total += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"Read EXIF data of {done}/{total} photo(s)"))
+        if options['derive_steps']:
+            applied = sum(exif.derive_step(step, apply=True)['applied'] for step in Step.objects.filter(id__in=step_ids))
+            self.stdout.write(self.style.SUCCESS(f"Updated {applied} step(s) from their photos"))
+
+    def _process(self, pool: ThreadPoolExecutor, batch: list[Photo], step_ids: set[int]) -> int:
+        updated, unreadable = [], []
+        for photo, metadata in zip(batch, pool.map(_metadata, batch)):
+            if metadata is None:  # Download failed: tried again on the next run
+                continue
+            if not metadata:
+                unreadable.append(photo.pk)
+                continue
+            for field, value in metadata.items():
+                setattr(photo, field, value)
+            photo.exif_checked = True
+            photo.change_seq = None
+            updated.append(photo)
+        Photo.objects.bulk_update(updated, [*exif.FIELDS, 'exif_checked', 'change_seq'])
+        Photo.objects.filter(id__in=unreadable).update(exif_checked=True)
+        step_ids.update(photo.step_id for photo in updated)  # type: ignore[attr-defined]
+        # bulk_update skips the model signals
+        trip_ids = {photo.step.trip_id for photo in updated}  # type: ignore[attr-defined]
+        Trip.objects.filter(id__in=trip_ids).touch()
+        for trip_id in trip_ids:
+            invalidate_trip(trip_id)
+        self.stdout.write(f"{len(updated)}/{len(batch)} photo(s) processed")
+        return len(updated)
@@ -0,0 +1,64 @@
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from trips.cache import invalidate_trip
+from trips.models import Photo, Trip
+from trips.services import derivatives
+from trips.services.owncloud import get_client, OwnCloudError
+
+
+def _variants(photo: Photo) -> dict | None:
+    # Runs in a worker thread: network and CPU only, the database is written by the main thread
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as f:
+        try:
+            get_client().download(photo.url, f)
+        except OwnCloudError as e:
+            derivatives.logger.warning("Could not download photo %s: %s", photo.pk, e)
+            return None
+        return derivatives.create_variants(f, photo.name)
+
+
+class Command(BaseCommand):
+    help = "Backfill thumbnail / medium variants of existing photos, downloading and processing them in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=100, help='Photos saved per bulk_update')
+        parser.add_argument('--force', action='store_true', help='Regenerate photos that already have variants')
+
+    def handle(self, *args, **options):
+        photos = Photo.objects.filter(status=Photo.STATUS_READY).exclude(url='').select_related('step').order_by('id')
+        if not options['force']:
+            photos = photos.filter(variants={})
+        done = failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            batch: list[Photo] = []
+            for photo in photos.iterator(chunk_size=options['batch_size']):
+                batch.append(photo)
+                if len(batch) >= options['batch_size']:
+                    ok = self._process(pool, batch)
+                    done, failed = done + ok, failed + len(batch) - ok
+                    batch = []
+            if batch:
+                ok = self._process(pool, batch)
+                done, failed = done + ok, failed + len(batch) - ok
+        self.stdout.write(self.style.SUCCESS(f"Generated variants for {done} photo(s), {failed} failed"))
+
+    def _process(self, pool: ThreadPoolExecutor, batch: list[Photo]) -> int:
+        updated = []
+        for photo, fields in zip(batch, pool.map(_variants, batch)):
+            if fields is None:
+                continue
+            for field, value in fields.items():
+                setattr(photo, field, value)
+            updated.append(photo)
+        for photo in updated:
+            photo.change_seq = None
+        Photo.objects.bulk_update(updated, ['width', 'height', 'variants', 'change_seq'])
+        # bulk_update skips the model signals
+        trip_ids = {photo.step.trip_id for photo in updated}  # type: ignore[attr-defined]
+        Trip.objects.filter(id__in=trip_ids).touch()
+        for trip_id in trip_ids:
+            invalidate_trip(trip_id)
+        self.stdout.write(f"{len(updated)}/{len(batch)} photo(s) processed")
+        return len(updated)
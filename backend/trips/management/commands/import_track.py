@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from trips import bulk, tracks
+from trips.models import Trip
+
+
+class Command(BaseCommand):
+    help = "Attach a GPX / GeoJSON track to a trip (stream-parsed, simplified, stored as an encoded polyline)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('trip_id', type=int)
+        parser.add_argument('path', help='.gpx, .json or .geojson file')
+        parser.add_argument('--create-steps', action='store_true', help='Append the detected stops as steps')
+
+    def handle(self, *args, **options):
+        try:
+            trip = Trip.objects.get(id=options['trip_id'])
+        except Trip.DoesNotExist:
+            raise CommandError(f"Trip {options['trip_id']} does not exist")
+        try:
+            with open(options['path'], 'rb') as f:
+                result = tracks.import_track(f, options['path'])
+        except (OSError, tracks.TrackError) as e:
+            raise CommandError(str(e))
+        ids = []
+        try:
+            # The track is only kept along with its steps
+            with transaction.atomic():
+                trip.track = result['track']
+                trip.save(update_fields=['track', 'revision', 'updated_at'])
+                if options['create_steps'] and result['stops']:
+                    ids = bulk.create_steps(trip.id, tracks.stop_steps(result['stops']))  # type: ignore[attr-defined]
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored {result['kept']} of {result['points']} point(s) ({len(result['track'])} bytes), {len(result['stops'])} stop(s) found"
+        ))
+        if ids:
+            self.stdout.write(self.style.SUCCESS(f"Created {len(ids)} step(s)"))
@@ -0,0 +1,57 @@
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from trips.services import ingest, upload_queue
+from .process_uploads import _process
+
+
+class Command(BaseCommand):
+    help = "Create a trip from a folder or zip archive of geotagged photos: steps are built from the photos' EXIF time and GPS position."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Directory or .zip archive of photos')
+        parser.add_argument('--name', help='Trip name (default: the folder / archive name)')
+        parser.add_argument('--description', default='')
+        parser.add_argument('--workers', type=int, default=settings.INGEST_WORKERS, help='Concurrent file reads and uploads')
+        parser.add_argument('--gap-hours', type=float, default=settings.INGEST_STEP_GAP_HOURS, help='Time without photos starting a new step')
+        parser.add_argument('--radius-km', type=float, default=settings.INGEST_STEP_RADIUS_KM, help='Distance from the current step starting a new one')
+        parser.add_argument('--defer', action='store_true', help='Leave the uploads to `manage.py process_uploads`')
+
+    def handle(self, *args, **options):
+        path = options['path'].rstrip(os.sep)
+        name = options['name'] or os.path.splitext(os.path.basename(path))[0]
+        trip_options = {
+            'description': options['description'],
+            'gap': timedelta(hours=options['gap_hours']),
+            'radius_km': options['radius_km'],
+        }
+        try:
+            if os.path.isdir(path):
+                trip = ingest.ingest(name, ingest.directory_sources(path), options['workers'], self.progress, **trip_options)
+            else:
+                with zipfile.ZipFile(path) as archive:
+                    trip = ingest.ingest(name, ingest.archive_sources(archive), options['workers'], self.progress, **trip_options)
+        except (OSError, zipfile.BadZipFile, ingest.IngestError) as e:
+            raise CommandError(str(e))
+        counts = ingest.import_progress(trip.id)  # type: ignore[attr-defined]
+        self.stdout.write(self.style.SUCCESS(
+            f"Created trip {trip.id} with {trip.steps.count()} step(s) and {counts['total']} photo(s)"  # type: ignore[attr-defined]
+        ))
+        if options['defer']:
+            return
+        workers = max(1, options['workers'])
+        done = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while batch := upload_queue.claim(workers * 4, trip_id=trip.id):  # type: ignore[attr-defined]
+                list(pool.map(_process, batch))
+                done += len(batch)
+                self.progress('upload', min(done, counts['total']), counts['total'])
+        counts = ingest.import_progress(trip.id)  # type: ignore[attr-defined]
+        self.stdout.write(self.style.SUCCESS(f"Uploaded {counts['ready']} photo(s), {counts['failed']} failed, {counts['pending']} to retry"))
+
+    def progress(self, stage: str, done: int, total: int):
+        if done == total or done % max(1, total // 20) == 0:
+            self.stdout.write(f"{stage}: {done}/{total}")
@@ -0,0 +1,74 @@
+import asyncio
+import os
+import statistics
+import time
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire concurrent requests at a running server and report throughput and latency. "
+        "Run it against the same app served by a WSGI server (e.g. gunicorn config.wsgi -w 1 --threads 8) "
+        "and by an ASGI one (e.g. uvicorn config.asgi:application --workers 1) to compare how many "
+        "in-flight reads / uploads one worker sustains."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='e.g. http://127.0.0.1:8000/api/trips/1')
+        parser.add_argument('--requests', type=int, default=500, help='Total number of requests')
+        parser.add_argument('--concurrency', type=int, default=100, help='Requests in flight at once')
+        parser.add_argument('--upload', metavar='PATH', help='POST this file as the multipart `file` field (photo upload endpoints)')
+        parser.add_argument('--timeout', type=float, default=120)
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--requests and --concurrency must be positive")
+        payload = None
+        if options['upload']:
+            try:
+                with open(options['upload'], 'rb') as f:
+                    payload = (os.path.basename(options['upload']), f.read())
+            except OSError as e:
+                raise CommandError(str(e))
+        latencies, errors, elapsed = asyncio.run(self._run(options, payload))
+        self.stdout.write(
+            f"{options['requests']} request(s), {options['concurrency']} in flight: {elapsed:.2f} s, "
+            f"{options['requests'] / elapsed:.1f} req/s, {errors} error(s)"
+        )
+        if latencies:
+            latencies.sort()
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            self.stdout.write(
+                f"latency ms: p50 {statistics.median(latencies) * 1000:.0f}, p95 {p95 * 1000:.0f}, max {latencies[-1] * 1000:.0f}"
+            )
+
+    async def _run(self, options, payload) -> tuple[list[float], int, float]:
+        latencies: list[float] = []
+        errors = 0
+        remaining = iter(range(options['requests']))
+        limits = httpx.Limits(max_connections=options['concurrency'], max_keepalive_connections=options['concurrency'])
+
+        async def worker(client: httpx.AsyncClient):
+            nonlocal errors
+            for _ in remaining:
+                start = time.perf_counter()
+                try:
+                    if payload:
+                        resp = await client.post(options['url'], files={'file': payload})
+                    else:
+                        resp = await client.get(options['url'])
+                except httpx.HTTPError as e:
+                    errors += 1
+                    self.stderr.write(f"{type(e).__name__}: {e}")
+                    continue
+                if resp.status_code >= 400:
+                    errors += 1
+                else:
+                    latencies.append(time.perf_counter() - start)
+
+        async with httpx.AsyncClient(timeout=options['timeout'], limits=limits) as client:
+            start = time.perf_counter()
+            await asyncio.gather(*(worker(client) for _ in range(options['concurrency'])))
+            elapsed = time.perf_counter() - start
+        return latencies, errors, elapsed
@@ -0,0 +1,45 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from trips.services import upload_queue
+
+
+def _process(photo_id: int) -> bool:
+    try:
+        return upload_queue.process(photo_id)
+    except Exception as e:
+        # Upload errors are handled by process(); anything else must not stop the other photos
+        # of the batch, nor leave this one `uploading` until it goes stale
+        upload_queue.logger.exception("Processing photo %s failed", photo_id)
+        upload_queue.release(photo_id, e)
+        return False
+    finally:
+        # Each pool thread holds its own database connection
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Push spooled (pending) photos to ownCloud with a pool of worker threads. No broker needed; several processes may run concurrently."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.UPLOAD_WORKERS, help='Concurrent uploads')
+        parser.add_argument('--poll', type=float, default=2.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                released = upload_queue.release_stale()
+                if released:
+                    self.stdout.write(f"Released {released} stale upload(s)")
+                batch = upload_queue.claim(workers)
+                if batch:
+                    results = list(pool.map(_process, batch))
+                    self.stdout.write(f"Uploaded {sum(results)}/{len(batch)} photo(s)")
+                    continue
+                if options['once']:
+                    return
+                time.sleep(options['poll'])
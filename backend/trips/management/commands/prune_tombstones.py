@@ -0,0 +1,30 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from trips import sync
+from trips.models import ChangeCounter, Tombstone
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete old tombstones of deleted trips / steps / photos. Sync tokens older than the "
+        "newest pruned tombstone are then answered with 410 (the client syncs again from 0)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.SYNC_TOMBSTONE_DAYS, help='Keep the tombstones of the last DAYS days')
+
+    def handle(self, *args, **options):
+        sync.sequence()  # tombstones not synced yet get their sequence value
+        old = Tombstone.objects.filter(deleted_at__lt=timezone.now() - timedelta(days=options['days']))
+        with transaction.atomic():
+            horizon = old.aggregate(horizon=Max('change_seq'))['horizon']
+            if horizon is None:
+                self.stdout.write("No tombstone to prune")
+                return
+            ChangeCounter.objects.filter(pk=1, horizon__lt=horizon).update(horizon=horizon)
+            deleted, _ = old.filter(change_seq__lte=horizon).delete()
+        self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} tombstone(s), tokens before {horizon} expire"))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from trips import clustering
+
+
+class Command(BaseCommand):
+    help = "Recompute the step clustering grid (needed after bulk Step writes that skip signals)."
+
+    def handle(self, *args, **options):
+        cells = clustering.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt step grid: {cells} cells"))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0011_alter_step_ended_at_alter_step_order_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='revision',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0012_trip_revision_trip_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='step',
+            index=models.Index(fields=['lat', 'lng'], name='step_lat_lng_idx'),
+        ),
+    ]
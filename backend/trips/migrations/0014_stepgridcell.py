@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0013_step_lat_lng_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StepGridCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.PositiveSmallIntegerField()),
+                ('x', models.PositiveIntegerField()),
+                ('y', models.PositiveIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('lat_sum', models.FloatField(default=0)),
+                ('lng_sum', models.FloatField(default=0)),
+                ('cover_photo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='trips.photo')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('level', 'x', 'y'), name='step_grid_cell_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0014_stepgridcell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('original_name', models.CharField(max_length=255)),
+                ('total_size', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('upload_id', models.CharField(max_length=64, unique=True)),
+                ('remote_path', models.CharField(max_length=500)),
+                ('status', models.CharField(choices=[('open', 'Open'), ('complete', 'Complete'), ('aborted', 'Aborted')], default='open', max_length=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('photo', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upload_session', to='trips.photo')),
+                ('step', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='trips.step')),
+            ],
+        ),
+    ]
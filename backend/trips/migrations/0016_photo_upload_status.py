@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0015_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='spool_path',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('uploading', 'Uploading'), ('ready', 'Ready'), ('failed', 'Failed')], db_index=True, default='ready', max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='photo',
+            name='url',
+            field=models.URLField(blank=True, max_length=500),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:35
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def init_next_step_order(apps, schema_editor):
+    Trip = apps.get_model('trips', 'Trip')
+    Step = apps.get_model('trips', 'Step')
+    last = Step.objects.filter(trip_id=OuterRef('pk')).values('trip_id').annotate(last=Max('order')).values('last')
+    Trip.objects.update(next_step_order=Coalesce(Subquery(last) + 1, 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0019_photo_hashes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='next_step_order',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(init_next_step_order, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0020_trip_next_step_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='track',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:52
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from trips.geo import decode_polyline, path_length_km
+
+
+def init_stats(apps, schema_editor):
+    Trip = apps.get_model('trips', 'Trip')
+    Step = apps.get_model('trips', 'Step')
+    Photo = apps.get_model('trips', 'Photo')
+    counts = Photo.objects.filter(step=OuterRef('pk')).order_by().values('step').annotate(n=Count('id')).values('n')
+    Step.objects.update(photo_count=Coalesce(Subquery(counts), 0))
+    for trip in Trip.objects.iterator():
+        steps = list(Step.objects.filter(trip=trip).order_by('order', 'id').values_list('lat', 'lng', 'started_at', 'ended_at', 'photo_count'))
+        route = [(lat, lng) for lat, lng, _, _, _ in steps]
+        points = route + (decode_polyline(trip.track) if trip.track else [])
+        trip.step_count = len(steps)
+        trip.photo_count = sum(row[4] for row in steps)
+        trip.distance_km = path_length_km(route)
+        if points:
+            trip.min_lat, trip.max_lat = min(p[0] for p in points), max(p[0] for p in points)
+            trip.min_lng, trip.max_lng = min(p[1] for p in points), max(p[1] for p in points)
+        if steps:
+            trip.steps_started_at, trip.steps_ended_at = min(row[2] for row in steps), max(row[3] for row in steps)
+        trip.save(update_fields=[
+            'step_count', 'photo_count', 'distance_km', 'min_lat', 'max_lat', 'min_lng', 'max_lng',
+            'steps_started_at', 'steps_ended_at',
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0021_trip_track'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='step',
+            name='photo_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='distance_km',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='max_lat',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='max_lng',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='min_lat',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='min_lng',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='photo_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='step_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='steps_ended_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='steps_started_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(init_stats, migrations.RunPython.noop),
+    ]
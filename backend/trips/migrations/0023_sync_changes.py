@@ -0,0 +1,52 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:57
+
+from django.db import migrations, models
+
+
+def create_counter(apps, schema_editor):
+    # Existing rows start unsequenced (NULL): the first sync gives them their change
+    apps.get_model('trips', 'ChangeCounter').objects.create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0022_trip_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.PositiveBigIntegerField(default=0)),
+                ('horizon', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('trip', 'Trip'), ('step', 'Step'), ('photo', 'Photo')], max_length=8)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('change_seq', models.PositiveBigIntegerField(db_index=True, default=None, null=True)),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='change_seq',
+            field=models.PositiveBigIntegerField(db_index=True, default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='step',
+            name='change_seq',
+            field=models.PositiveBigIntegerField(db_index=True, default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='change_seq',
+            field=models.PositiveBigIntegerField(db_index=True, default=None, editable=False, null=True),
+        ),
+        migrations.RunPython(create_counter, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:24
+
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+TABLES = ('trips_trip', 'trips_step', 'trips_photo')
+
+# 'simple' configuration: names are places and people in any language, so words are
+# lowercased but not stemmed
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple', coalesce({row}name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce({row}description, '')), 'B')"
+)
+
+
+def create_search_indexes(apps, schema_editor):
+    # The trigger keeps search_vector current on every INSERT / UPDATE, bulk ones included
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "CREATE FUNCTION trips_search_vector_update() RETURNS trigger AS $$ BEGIN "
+        f"NEW.search_vector := {SEARCH_VECTOR.format(row='NEW.')}; RETURN NEW; "
+        "END $$ LANGUAGE plpgsql"
+    )
+    for table in TABLES:
+        schema_editor.execute(
+            f"CREATE TRIGGER {table}_search_vector BEFORE INSERT OR UPDATE OF name, description "
+            f"ON {table} FOR EACH ROW EXECUTE FUNCTION trips_search_vector_update()"
+        )
+        schema_editor.execute(f"UPDATE {table} SET search_vector = {SEARCH_VECTOR.format(row='')}")
+        schema_editor.execute(f"CREATE INDEX {table}_search_idx ON {table} USING gin (search_vector)")
+        # Trigram index: prefix / substring (ILIKE) and similarity (typo) matches on names
+        schema_editor.execute(f"CREATE INDEX {table}_name_trgm_idx ON {table} USING gin (name gin_trgm_ops)")
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table in TABLES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {table}_name_trgm_idx")
+        schema_editor.execute(f"DROP INDEX IF EXISTS {table}_search_idx")
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_search_vector ON {table}")
+    schema_editor.execute("DROP FUNCTION IF EXISTS trips_search_vector_update()")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0023_sync_changes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='photo',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='step',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
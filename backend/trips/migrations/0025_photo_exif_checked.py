@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0024_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='exif_checked',
+            field=models.BooleanField(default=False),
+        ),
+    ]
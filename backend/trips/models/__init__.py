@@ -1,5 +1,8 @@
 from .trip import Trip
 from .step import Step
 from .photo import Photo
+from .grid import StepGridCell
+from .upload import UploadSession
+from .sync import ChangeCounter, Tombstone
 
-__all__ = ["Trip", "Step", "Photo"]
+__all__ = ["Trip", "Step", "Photo", "StepGridCell", "UploadSession", "ChangeCounter", "Tombstone"]
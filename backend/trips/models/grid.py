@@ -0,0 +1,26 @@
+from django.db import models
+
+
+class StepGridCell(models.Model):
+    """Aggregate of the steps falling into one Web Mercator tile at a given level.
+
+    Maintained incrementally on Step writes (trips/clustering.py) and used to answer
+    cluster queries without scanning steps. Rebuild with `manage.py rebuild_step_grid`
+    after bulk writes.
+    """
+    level = models.PositiveSmallIntegerField()
+    x = models.PositiveIntegerField()
+    y = models.PositiveIntegerField()
+    count = models.PositiveIntegerField(default=0)
+    lat_sum = models.FloatField(default=0)
+    lng_sum = models.FloatField(default=0)
+    # Representative photo shown for the cluster (first step cover seen in the cell)
+    cover_photo = models.ForeignKey('trips.Photo', related_name='+', on_delete=models.SET_NULL, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['level', 'x', 'y'], name='step_grid_cell_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.level}/{self.x}/{self.y} ({self.count})"
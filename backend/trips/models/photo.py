@@ -1,12 +1,52 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from .step import Step
+from .sync import ChangeTracked
+
+class Photo(ChangeTracked):
+    STATUS_PENDING = 'pending'
+    STATUS_UPLOADING = 'uploading'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_UPLOADING, 'Uploading'),
+        (STATUS_READY, 'Ready'),
+        (STATUS_FAILED, 'Failed'),
+    ]
 
-class Photo(models.Model):
     step = models.ForeignKey(Step, related_name='photos', on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
     date = models.DateTimeField(auto_now_add=True)
-    url = models.URLField(max_length=500)
+    url = models.URLField(max_length=500, blank=True)
+    # Deferred uploads (services/upload_queue.py): the file waits in spool_path until a worker pushes it
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_READY, db_index=True)
+    spool_path = models.CharField(max_length=500, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    # Original dimensions and resized renditions {"thumbnail"|"medium": {"url", "width", "height"}}
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    variants = models.JSONField(default=dict, blank=True)
+    # EXIF metadata (services/exif.py); `date` stays the upload time. orientation is null until read
+    taken_at = models.DateTimeField(null=True, blank=True)
+    lat = models.FloatField(null=True, blank=True)
+    lng = models.FloatField(null=True, blank=True)
+    orientation = models.PositiveSmallIntegerField(null=True, blank=True)
+    # Set by extract_photo_exif once it has read the file, even one without EXIF data (or not an
+    # image Pillow reads, whose orientation stays null), so that it is not downloaded again
+    exif_checked = models.BooleanField(default=False)
+    # SHA-256 of the file (identical uploads share one remote file) and 64-bit difference hash, both hex
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    perceptual_hash = models.CharField(max_length=16, blank=True)
+    # Full-text index of name + description, written by a database trigger (PostgreSQL only, see trips/search.py)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    @property
+    def thumbnail_url(self) -> str:
+        return self.variants.get('thumbnail', {}).get('url') or self.url
 
     def __str__(self):
         return self.name
@@ -1,8 +1,10 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.utils import timezone
+from .sync import ChangeTracked
 from .trip import Trip
 
-class Step(models.Model):
+class Step(ChangeTracked):
     trip = models.ForeignKey(Trip, related_name='steps', on_delete=models.CASCADE)
     order = models.PositiveIntegerField(editable=True, default=0, help_text="Sequence index within a trip starting at 0")
     description = models.TextField(blank=False, null=False)
@@ -12,16 +14,32 @@ class Step(models.Model):
     lat = models.FloatField(blank=False, null=False)
     lng = models.FloatField(blank=False, null=False)
     cover_photo = models.ForeignKey('trips.Photo', related_name='cover_for_steps', on_delete=models.SET_NULL, null=True, blank=True)
+    # Ready photos of the step, the ones its payload returns (maintained by trips/signals.py and trips/stats.py)
+    photo_count = models.PositiveIntegerField(default=0, editable=False)
+    # Full-text index of name + description, written by a database trigger (PostgreSQL only, see trips/search.py)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Viewport (bounding box) queries, see GET /api/steps?bbox=
+            models.Index(fields=['lat', 'lng'], name='step_lat_lng_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.trip.name})"
 
     def save(self, *args, **kwargs):
         if self._state.adding and self.trip_id is not None:  # type: ignore[attr-defined]
-            # If user set a custom non-zero order, keep it; otherwise append to end if others exist.
-            existing_qs = Step.objects.filter(trip_id=self.trip_id)  # type: ignore[attr-defined]
-            if existing_qs.exists() and self.order == 0:
-                last = existing_qs.order_by('-order').first()
-                if last:
-                    self.order = last.order + 1  # type: ignore[attr-defined]
+            # If user set a custom non-zero order, keep it; otherwise append to the end of the trip
+            if self.order == 0:
+                self.order = Trip.objects.reserve_step_orders(self.trip_id)  # type: ignore[attr-defined]
+            else:
+                Trip.objects.reserve_step_order_at(self.trip_id, self.order)  # type: ignore[attr-defined]
+        elif not self._state.adding and kwargs.get('update_fields') is None:
+            # photo_count is maintained in the database: do not overwrite it with a stale value
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name != 'photo_count' and f.attname not in deferred
+            ]
         super().save(*args, **kwargs)
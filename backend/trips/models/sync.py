@@ -0,0 +1,52 @@
+from django.db import models
+
+
+class ChangeCounter(models.Model):
+    """Global change sequence (a single row), advanced by GET /api/sync only.
+
+    Writers never touch it: a write just clears the row's `change_seq` (NULL = changed, not
+    sequenced yet). Each sync first gives the next sequence value to every committed
+    unsequenced row (trips/sync.py), so writers take no shared lock and a value is only
+    ever handed out to rows that are already committed.
+    """
+    value = models.PositiveBigIntegerField(default=0)
+    # Highest sequence of the pruned tombstones: older sync tokens must start over
+    horizon = models.PositiveBigIntegerField(default=0)
+
+
+class ChangeTracked(models.Model):
+    """Marks the row changed (`change_seq` NULL) on every save(); bulk writes must do it themselves."""
+    change_seq = models.PositiveBigIntegerField(null=True, default=None, db_index=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not update_fields:
+            return super().save(*args, **kwargs)
+        self.change_seq = None
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'change_seq'}
+        super().save(*args, **kwargs)
+
+
+class Tombstone(models.Model):
+    """A deleted Trip / Step / Photo, reported by GET /api/sync until pruned."""
+    KIND_TRIP = 'trip'
+    KIND_STEP = 'step'
+    KIND_PHOTO = 'photo'
+    KIND_CHOICES = [
+        (KIND_TRIP, 'Trip'),
+        (KIND_STEP, 'Step'),
+        (KIND_PHOTO, 'Photo'),
+    ]
+
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    # NULL until sequenced by the next sync, like ChangeTracked.change_seq
+    change_seq = models.PositiveBigIntegerField(null=True, default=None, db_index=True)
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} (#{self.change_seq})"
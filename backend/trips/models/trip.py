@@ -1,13 +1,90 @@
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.utils import timezone
+from .sync import ChangeTracked
 
 
-class Trip(models.Model):
+class TripQuerySet(models.QuerySet):
+    def touch(self, **changes) -> int:
+        """Bump revision / updated_at of the selected trips in a single UPDATE, with `changes`.
+
+        Must be called by any write on a trip's steps or photos that bypasses model signals
+        (queryset.update(), bulk_create(), bulk_update()).
+        """
+        return self.update(revision=models.F('revision') + 1, updated_at=timezone.now(), change_seq=None, **changes)
+
+    def reserve_step_orders(self, trip_id: int, count: int = 1) -> int:
+        """Take `count` consecutive step orders at the end of a trip; returns the first one.
+
+        The counter is incremented in the database, so concurrent inserts never get the same
+        order: the UPDATE locks the trip row until the transaction ends.
+        """
+        with transaction.atomic():
+            self.filter(id=trip_id).update(next_step_order=models.F('next_step_order') + count)
+            return self.filter(id=trip_id).values_list('next_step_order', flat=True).get() - count
+
+    def reserve_step_order_at(self, trip_id: int, order: int):
+        """Move the counter past an explicitly chosen order (conditional UPDATE, race-free)."""
+        self.filter(id=trip_id, next_step_order__lte=order).update(next_step_order=order + 1)
+
+
+# Aggregates of a trip's steps / photos, written by trips/stats.py only
+STATS_FIELDS = (
+    'step_count', 'photo_count', 'min_lat', 'min_lng', 'max_lat', 'max_lng', 'distance_km',
+    'steps_started_at', 'steps_ended_at',
+)
+
+
+class Trip(ChangeTracked):
     name = models.CharField(max_length=255)
     description = models.TextField(blank=False, null=False)
     started_at = models.DateTimeField(auto_now_add=True)
     ended_at = models.DateTimeField(auto_now_add=True)
     # cover_photo added later to avoid circular import; defined after Photo class is declared via string reference
     cover_photo = models.ForeignKey('trips.Photo', related_name='cover_for_trips', on_delete=models.SET_NULL, null=True, blank=True)
+    # Version of the whole trip tree (trip, steps, photos); bumped on every write, used for ETags
+    revision = models.PositiveIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Order given to the next appended step (see TripQuerySet.reserve_step_orders); orders may have gaps
+    next_step_order = models.PositiveIntegerField(default=0, editable=False)
+    # Recorded GPS track (trips/tracks.py), simplified and stored as an encoded polyline
+    track = models.TextField(blank=True, editable=False)
+    # Denormalized statistics (see STATS_FIELDS); bounding box of the steps and the track,
+    # distance along the steps in order, span from the first step start to the last step end
+    step_count = models.PositiveIntegerField(default=0, editable=False)
+    photo_count = models.PositiveIntegerField(default=0, editable=False)
+    min_lat = models.FloatField(null=True, editable=False)
+    min_lng = models.FloatField(null=True, editable=False)
+    max_lat = models.FloatField(null=True, editable=False)
+    max_lng = models.FloatField(null=True, editable=False)
+    distance_km = models.FloatField(default=0, editable=False)
+    steps_started_at = models.DateTimeField(null=True, editable=False)
+    steps_ended_at = models.DateTimeField(null=True, editable=False)
+    # Full-text index of name + description, written by a database trigger (PostgreSQL only, see trips/search.py)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = TripQuerySet.as_manager()
 
     def __str__(self):
         return self.name
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Never write back statistics loaded before a concurrent step / photo write
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in STATS_FIELDS and f.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def bbox(self) -> list[float] | None:
+        """[min_lng, min_lat, max_lng, max_lat] (the order used by ?bbox=), None without steps or track."""
+        if self.min_lat is None:
+            return None
+        return [self.min_lng, self.min_lat, self.max_lng, self.max_lat]  # type: ignore[list-item]
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.pk}-{self.revision}-{int(self.updated_at.timestamp() * 1_000_000)}"'
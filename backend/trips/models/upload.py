@@ -0,0 +1,29 @@
+from django.db import models
+from .step import Step
+
+
+class UploadSession(models.Model):
+    """A resumable (chunked) photo upload, finalized into a Photo once every chunk arrived."""
+    STATUS_OPEN = 'open'
+    STATUS_COMPLETE = 'complete'
+    STATUS_ABORTED = 'aborted'
+    STATUS_CHOICES = [
+        (STATUS_OPEN, 'Open'),
+        (STATUS_COMPLETE, 'Complete'),
+        (STATUS_ABORTED, 'Aborted'),
+    ]
+
+    step = models.ForeignKey(Step, related_name='upload_sessions', on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    description = models.TextField(blank=True, null=True)
+    original_name = models.CharField(max_length=255)
+    total_size = models.PositiveBigIntegerField(null=True, blank=True)
+    # Remote chunk directory id and final WebDAV path (see services/owncloud.py)
+    upload_id = models.CharField(max_length=64, unique=True)
+    remote_path = models.CharField(max_length=500)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_OPEN)
+    photo = models.OneToOneField('trips.Photo', related_name='upload_session', on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Upload {self.original_name} ({self.status})"
@@ -0,0 +1,107 @@
+"""Minimal Mapbox Vector Tile (v2.1) encoder for point and line string layers.
+
+Only what the route tiles need is implemented: features with an id, string / number
+properties and POINT or LINESTRING (one or several lines) geometries already projected to
+tile coordinates.
+See https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+"""
+import struct
+
+EXTENT = 4096
+
+POINT = 1
+LINESTRING = 2
+
+_MOVE_TO = 1
+_LINE_TO = 2
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field: int, wire_type: int) -> bytes:
+    return _varint((field << 3) | wire_type)
+
+
+def _bytes_field(field: int, payload: bytes) -> bytes:
+    return _key(field, 2) + _varint(len(payload)) + payload
+
+
+def _packed(field: int, values: list[int]) -> bytes:
+    return _bytes_field(field, b''.join(_varint(v) for v in values))
+
+
+def _value(value) -> bytes:
+    if isinstance(value, bool):
+        return _key(7, 0) + _varint(int(value))
+    if isinstance(value, int):
+        return _key(6, 0) + _varint(_zigzag(value))  # sint_value
+    if isinstance(value, float):
+        return _key(3, 1) + struct.pack('<d', value)  # double_value
+    return _bytes_field(1, str(value).encode())  # string_value
+
+
+def _geometry(geom_type: int, parts: list[list[tuple[int, int]]]) -> list[int]:
+    commands: list[int] = []
+    cx = cy = 0  # The cursor carries over from one line to the next
+    for points in parts:
+        if geom_type == POINT:
+            commands.append(_MOVE_TO | (len(points) << 3))
+        for i, (x, y) in enumerate(points):
+            if geom_type == LINESTRING and i == 0:
+                commands.append(_MOVE_TO | (1 << 3))
+            elif geom_type == LINESTRING and i == 1:
+                commands.append(_LINE_TO | ((len(points) - 1) << 3))
+            commands += [_zigzag(x - cx), _zigzag(y - cy)]
+            cx, cy = x, y
+    return commands
+
+
+def encode_layer(name: str, features: list[dict], extent: int = EXTENT) -> bytes:
+    """Encode one layer; each feature is {'id', 'type', 'points', 'properties'}.
+
+    A LINESTRING feature may have 'lines' (a list of point lists) instead of 'points'.
+    """
+    keys: dict[str, int] = {}
+    values: dict[tuple[type, object], int] = {}
+    body = bytearray()
+    for feature in features:
+        parts = feature['lines'] if 'lines' in feature else [feature['points']]
+        if feature['type'] == LINESTRING:
+            parts = [points for points in parts if len(points) > 1]
+        if not any(parts):
+            continue
+        tags: list[int] = []
+        for k, v in feature.get('properties', {}).items():
+            if v is None:
+                continue
+            tags.append(keys.setdefault(k, len(keys)))
+            tags.append(values.setdefault((type(v), v), len(values)))
+        encoded = b''
+        if feature.get('id') is not None:
+            encoded += _key(1, 0) + _varint(feature['id'])
+        encoded += _packed(2, tags) + _key(3, 0) + _varint(feature['type'])
+        encoded += _packed(4, _geometry(feature['type'], parts))
+        body += _bytes_field(2, encoded)
+    layer = _key(15, 0) + _varint(2) + _bytes_field(1, name.encode()) + bytes(body)
+    layer += b''.join(_bytes_field(3, k.encode()) for k in keys)
+    layer += b''.join(_bytes_field(4, _value(v)) for (_, v) in values)
+    layer += _key(5, 0) + _varint(extent)
+    return _bytes_field(3, layer)
+
+
+def encode_tile(layers: dict[str, list[dict]]) -> bytes:
+    return b''.join(encode_layer(name, features) for name, features in layers.items() if features)
@@ -0,0 +1,39 @@
+"""Bulk step reordering: one bulk_update per request instead of one save() per step."""
+from django.db import transaction
+from . import stats
+from .cache import invalidate_trip
+from .models import Trip, Step
+
+
+def reorder_steps(trip_id: int, step_ids: list[int]) -> list[Step]:
+    """Give the steps of a trip the orders 0..n-1 following `step_ids`.
+
+    `step_ids` must list every step of the trip exactly once; raises ValueError otherwise.
+    The trip row is locked for the transaction, so concurrent inserts wait and then append
+    after the new ordering.
+    """
+    with transaction.atomic():
+        Trip.objects.select_for_update().filter(id=trip_id).values_list('id').get()
+        steps = {step.pk: step for step in Step.objects.filter(trip_id=trip_id).only('id', 'trip_id', 'order')}
+        if len(step_ids) != len(set(step_ids)) or set(step_ids) != set(steps):
+            raise ValueError("step_ids must list every step of the trip exactly once")
+        ordered = [steps[step_id] for step_id in step_ids]
+        for order, step in enumerate(ordered):
+            step.order = order
+        save_orders(ordered)
+        Trip.objects.filter(id=trip_id).update(next_step_order=len(ordered))
+    return ordered
+
+
+def save_orders(steps: list[Step]):
+    """Write the `order` of steps (of any trips) with one bulk_update."""
+    for step in steps:
+        step.change_seq = None
+    Step.objects.bulk_update(steps, ['order', 'change_seq'])
+    # bulk_update skips the model signals
+    trip_ids = {step.trip_id for step in steps}  # type: ignore[attr-defined]
+    stats.refresh(trip_ids)  # the route distance follows the order
+    Trip.objects.filter(id__in=trip_ids).touch()
+    for trip_id in trip_ids:
+        Trip.objects.reserve_step_order_at(trip_id, max(s.order for s in steps if s.trip_id == trip_id))  # type: ignore[attr-defined]
+        invalidate_trip(trip_id)
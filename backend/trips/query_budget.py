@@ -0,0 +1,136 @@
+"""Per-request query count / database time, checked against per-endpoint budgets.
+
+Every database connection gets an execute wrapper (installed when it connects) that reports
+to the recorder of the current request, held in a context variable: queries issued from
+sync_to_async threads by async views are counted as well.
+
+QueryBudgetMiddleware records each request and logs the endpoints that exceed their budget
+(API_QUERY_BUDGETS[operation name], else API_QUERY_BUDGET_DEFAULT). The operation name is the
+view function's name: GET /trips and POST /trips have their own budgets, although Django
+resolves both to one URL name. With API_QUERY_BUDGET_STRICT
+(enabled by the test suite) a breach raises QueryBudgetExceeded, failing the test.
+"""
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.decorators import sync_and_async_middleware
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryUsage:
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+_usage: ContextVar[QueryUsage | None] = ContextVar('query_usage', default=None)
+
+
+def _record(execute, sql, params, many, context):
+    usage = _usage.get()
+    if usage is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        usage.queries += 1
+        usage.seconds += time.perf_counter() - start
+
+
+@receiver(connection_created)
+def install_recorder(sender, connection, **kwargs):
+    # connection_created fires again on every reconnection of the same wrapper
+    if _record not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record)
+
+
+@contextmanager
+def measure() -> Iterator[QueryUsage]:
+    """Count the queries (and their time) run inside the block, in any thread it awaits.
+
+    Blocks nest: an enclosing measure() also counts the queries of the inner ones.
+    """
+    usage = QueryUsage()
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+        outer = _usage.get()
+        if outer is not None:
+            outer.queries += usage.queries
+            outer.seconds += usage.seconds
+
+
+@functools.cache
+def _operation_names() -> dict[tuple[str, str], str]:
+    """(method, URL name) -> operation name, for every API endpoint.
+
+    All the operations of a path share one view, which Django resolves to the URL name of
+    the first one.
+    """
+    from .api import api
+    names = {}
+    for _, router in api._routers:
+        for path_view in router.path_operations.values():
+            first = path_view.operations[0]
+            url_name = getattr(first, 'url_name', '') or api.get_operation_url_name(first, router=router)
+            for operation in path_view.operations:
+                for method in operation.methods:
+                    names[method, url_name] = getattr(operation, 'url_name', '') or api.get_operation_url_name(operation, router=router)
+    return names
+
+
+def operation_name(request) -> str:
+    match = request.resolver_match
+    return _operation_names().get((request.method, match.url_name), match.url_name or match.route)
+
+
+def budget(name: str) -> int:
+    return settings.API_QUERY_BUDGETS.get(name, settings.API_QUERY_BUDGET_DEFAULT)
+
+
+def check(request, response, usage: QueryUsage):
+    match = request.resolver_match
+    if match is None or match.app_name != 'ninja':  # API endpoints only
+        return
+    name = operation_name(request)
+    limit = budget(name)
+    if settings.API_QUERY_BUDGET_HEADERS:
+        response['Server-Timing'] = f'db;desc="{usage.queries} queries";dur={usage.seconds * 1000:.1f}'
+    if usage.queries <= limit:
+        return
+    message = f"{request.method} {request.path} ({name}) ran {usage.queries} queries (budget {limit}) in {usage.seconds * 1000:.1f} ms"
+    if settings.API_QUERY_BUDGET_STRICT:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+@sync_and_async_middleware
+def QueryBudgetMiddleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            with measure() as usage:
+                response = await get_response(request)
+            check(request, response, usage)
+            return response
+    else:
+        def middleware(request):
+            with measure() as usage:
+                response = get_response(request)
+            check(request, response, usage)
+            return response
+    return middleware
@@ -0,0 +1,20 @@
+import orjson
+from ninja.renderers import BaseRenderer
+from ninja.responses import NinjaJSONEncoder
+
+
+class ORJSONRenderer(BaseRenderer):
+    """JSON renderer backed by orjson.
+
+    orjson natively encodes dicts, lists, datetimes, UUIDs and dataclasses; anything else
+    (pydantic models, URLs, Decimals...) falls back to ninja's encoder.
+    """
+    media_type = "application/json"
+    _fallback = NinjaJSONEncoder()
+
+    def render(self, request, data, *, response_status: int) -> bytes:
+        return dumps(data)
+
+
+def dumps(data) -> bytes:
+    return orjson.dumps(data, default=ORJSONRenderer._fallback.default)
@@ -0,0 +1,221 @@
+import hashlib
+import math
+from django.conf import settings
+from .cache import trip_cache
+from .geo import MAX_MERCATOR_LAT, bbox_q, decode_polyline
+from .models import Trip, Step
+from .serializers import cover_photo_from_values
+from . import clustering, mvt
+
+MAX_ZOOM = 22
+# Simplification tolerance in screen pixels (of a 256px tile) at the requested zoom
+TOLERANCE_PX = 1.0
+# Tile units kept around a tile when clipping routes, so that lines join across tile edges
+TILE_BUFFER = 64
+
+
+def douglas_peucker(points: list[tuple[float, float]], tolerance: float) -> list[tuple[float, float]]:
+    """Simplify a polyline, keeping the vertices further than `tolerance` from the simplified line.
+
+    Iterative (explicit stack) so long tracks cannot hit the recursion limit.
+    """
+    if len(points) < 3 or tolerance <= 0:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = points[first], points[last]
+        dx, dy = x2 - x1, y2 - y1
+        norm = math.hypot(dx, dy)
+        max_dist, index = -1.0, first
+        for i in range(first + 1, last):
+            px, py = points[i]
+            if norm:
+                dist = abs(dy * px - dx * py + x2 * y1 - y2 * x1) / norm
+            else:
+                dist = math.hypot(px - x1, py - y1)
+            if dist > max_dist:
+                max_dist, index = dist, i
+        if max_dist > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [p for p, k in zip(points, keep) if k]
+
+
+def tolerance_for_zoom(zoom: int) -> float:
+    """Simplification tolerance in degrees matching TOLERANCE_PX at the given zoom."""
+    return 360.0 / (256 * (1 << zoom)) * TOLERANCE_PX
+
+
+def route_points(trip: Trip, zoom: int) -> list[tuple[float, float]]:
+    """(lng, lat) route of a trip simplified for `zoom`, cached per trip version.
+
+    The recorded GPS track when the trip has one (see tracks.py), else the line through its
+    steps in order. `trip` only needs `id`, `revision` and `updated_at` loaded.
+    """
+    cache = trip_cache()
+    key = f"trips:route:{trip.pk}:{zoom}"
+    entry = cache.get(key)
+    if entry is not None and entry[0] == trip.etag:
+        return entry[1]
+    track = Trip.objects.filter(pk=trip.pk).values_list('track', flat=True).first()
+    if track:
+        points = [(lng, lat) for lat, lng in decode_polyline(track)]
+    else:
+        points = list(Step.objects.filter(trip_id=trip.pk).order_by('order', 'id').values_list('lng', 'lat'))
+    points = douglas_peucker(points, tolerance_for_zoom(zoom))
+    cache.set(key, (trip.etag, points), timeout=settings.TRIPS_CACHE_TIMEOUT)
+    return points
+
+
+def route_geojson(trip: Trip, zoom: int) -> dict:
+    """FeatureCollection with the simplified route LineString and one Point per step."""
+    features = []
+    points = route_points(trip, zoom)
+    if len(points) > 1:
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'LineString', 'coordinates': points},
+            'properties': {'trip_id': trip.pk},
+        })
+    steps = Step.objects.filter(trip_id=trip.pk).order_by('order', 'id').values(
+        'id', 'name', 'order', 'lat', 'lng', 'cover_photo_id', 'cover_photo__url', 'cover_photo__variants',
+    )
+    for s in steps:
+        cover = cover_photo_from_values(s)
+        features.append({
+            'type': 'Feature',
+            'id': s['id'],
+            'geometry': {'type': 'Point', 'coordinates': [s['lng'], s['lat']]},
+            'properties': {
+                'id': s['id'], 'trip_id': trip.pk, 'name': s['name'], 'order': s['order'],
+                'cover_url': cover and cover['url'], 'cover_thumbnail_url': cover and cover['thumbnail_url'],
+            },
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def tile_bbox(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    """(minLng, minLat, maxLng, maxLat) of a slippy map tile."""
+    n = 1 << z
+
+    def lat(ty: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+
+def _projector(z: int, x: int, y: int):
+    n = 1 << z
+
+    def project(lng: float, lat: float) -> tuple[int, int]:
+        lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+        px = ((lng + 180.0) / 360.0 * n - x) * mvt.EXTENT
+        py = ((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n - y) * mvt.EXTENT
+        return round(px), round(py)
+    return project
+
+
+def clip_line(points: list[tuple[int, int]], low: int, high: int) -> list[list[tuple[int, int]]]:
+    """Parts of a projected polyline inside the square [low, high]² (Liang-Barsky per segment)."""
+    lines: list[list[tuple[int, int]]] = []
+    current: list[tuple[int, int]] = []
+    for (x1, y1), (x2, y2) in zip(points, points[1:]):
+        dx, dy = x2 - x1, y2 - y1
+        t0, t1 = 0.0, 1.0
+        for p, q in ((-dx, x1 - low), (dx, high - x1), (-dy, y1 - low), (dy, high - y1)):
+            if p == 0:
+                if q < 0:  # Parallel to this edge, outside of it
+                    t0, t1 = 1.0, 0.0
+            elif p < 0:
+                t0 = max(t0, q / p)
+            else:
+                t1 = min(t1, q / p)
+        if t0 > t1:
+            if current:
+                lines.append(current)
+                current = []
+            continue
+        if t0 > 0 or not current:  # Enters the square
+            if current:
+                lines.append(current)
+            current = [(round(x1 + t0 * dx), round(y1 + t0 * dy))]
+        current.append((round(x1 + t1 * dx), round(y1 + t1 * dy)))
+        if t1 < 1:  # Leaves it
+            lines.append(current)
+            current = []
+    if current:
+        lines.append(current)
+    return [line for line in lines if len(line) > 1]
+
+
+def _tile_steps(box: tuple[float, float, float, float], z: int, project) -> tuple[list[dict], list[dict]]:
+    """(steps, clusters) features of a tile: its steps, or when it has more than
+    TILE_MAX_STEPS of them, the step clusters of the grid (see clustering.py)."""
+    rows = list(Step.objects.filter(bbox_q(box)).order_by('id').values(
+        'id', 'trip_id', 'name', 'order', 'lat', 'lng', 'cover_photo_id', 'cover_photo__url', 'cover_photo__variants',
+    )[:settings.TILE_MAX_STEPS + 1])
+    if len(rows) > settings.TILE_MAX_STEPS:
+        clusters = []
+        for c in clustering.clusters(box, z):
+            point = project(c['lng'], c['lat'])
+            if not (0 <= point[0] <= mvt.EXTENT and 0 <= point[1] <= mvt.EXTENT):
+                continue  # Grid cells of the levels past MAX_LEVEL are larger than the tile
+            cover = c['cover_photo']
+            clusters.append({
+                'type': mvt.POINT,
+                'points': [point],
+                'properties': {
+                    'count': c['count'],
+                    'cover_url': cover and cover['url'], 'cover_thumbnail_url': cover and cover['thumbnail_url'],
+                },
+            })
+        return [], clusters
+    steps = []
+    for s in rows:
+        cover = cover_photo_from_values(s)
+        steps.append({
+            'id': s['id'],
+            'type': mvt.POINT,
+            'points': [project(s['lng'], s['lat'])],
+            'properties': {
+                'id': s['id'], 'trip_id': s['trip_id'], 'name': s['name'], 'order': s['order'],
+                'cover_url': cover and cover['url'], 'cover_thumbnail_url': cover and cover['thumbnail_url'],
+            },
+        })
+    return steps, []
+
+
+def render_tile(z: int, x: int, y: int) -> bytes:
+    """Vector tile with a `routes` layer (simplified trip lines, clipped to the tile) and a
+    `steps` layer (points), or a `clusters` layer instead of `steps` for crowded tiles."""
+    min_lng, min_lat, max_lng, max_lat = box = tile_bbox(z, x, y)
+    # Trips whose extent (steps and track, Trip.bbox) intersects the tile: they hold all of its
+    # content, so their versions are the version of the tile
+    trips = list(Trip.objects.filter(
+        min_lat__lte=max_lat, max_lat__gte=min_lat, min_lng__lte=max_lng, max_lng__gte=min_lng,
+    ).only('id', 'name', 'revision', 'updated_at').order_by('id'))
+    version = hashlib.sha1(''.join(trip.etag for trip in trips).encode()).hexdigest()
+    cache = trip_cache()
+    key = f"trips:tile:{z}/{x}/{y}"
+    entry = cache.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    project = _projector(z, x, y)
+    routes = []
+    for trip in trips:
+        # Only the parts of the route over the tile (and its buffer) are encoded
+        lines = clip_line([project(lng, lat) for lng, lat in route_points(trip, z)], -TILE_BUFFER, mvt.EXTENT + TILE_BUFFER)
+        if lines:
+            routes.append({
+                'id': trip.pk,
+                'type': mvt.LINESTRING,
+                'lines': lines,
+                'properties': {'trip_id': trip.pk, 'name': trip.name},
+            })
+    steps, clusters = _tile_steps(box, z, project) if trips else ([], [])
+    tile = mvt.encode_tile({'routes': routes, 'steps': steps, 'clusters': clusters})
+    cache.set(key, (version, tile), timeout=settings.TRIPS_CACHE_TIMEOUT)
+    return tile
@@ -0,0 +1,69 @@
+"""Search (GET /api/search) across trips, steps and ready photos, by name and description.
+
+On PostgreSQL every word of the query is matched as a prefix against `search_vector`
+(maintained by a trigger, GIN-indexed; see migration 0024), and names similar to the whole
+query are matched through the trigram index, which catches typos. Matches are ranked by
+ts_rank (name words weigh more than description words) plus the trigram similarity of the
+name. Other databases (SQLite, with DB_ENGINE=sqlite) fall back to case-insensitive substring
+matching, ranked by how well the name matches.
+
+The three models are searched in one UNION query, ordered by rank and paginated with
+OFFSET / LIMIT.
+"""
+import re
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db import connection
+from django.db.models import Case, F, FloatField, IntegerField, Q, QuerySet, Value, When
+from .models import Trip, Step, Photo
+
+WORD = re.compile(r'\w+')
+
+
+def words(q: str) -> list[str]:
+    return WORD.findall(q)
+
+
+def _postgres_matches(queryset: QuerySet, q: str) -> QuerySet:
+    # Raw tsquery built from \w+ words only, so user input cannot inject operators
+    query = SearchQuery(' & '.join(f'{word}:*' for word in words(q)), search_type='raw', config='simple')
+    return queryset.filter(Q(search_vector=query) | Q(name__trigram_similar=q)).annotate(
+        score=SearchRank(F('search_vector'), query) + TrigramSimilarity('name', q),
+    )
+
+
+def _fallback_matches(queryset: QuerySet, q: str) -> QuerySet:
+    for word in words(q):
+        queryset = queryset.filter(Q(name__icontains=word) | Q(description__icontains=word))
+    return queryset.annotate(score=Case(
+        When(name__iexact=q, then=Value(1.0)),
+        When(name__istartswith=q, then=Value(0.75)),
+        When(name__icontains=q, then=Value(0.5)),
+        default=Value(0.25),
+        output_field=FloatField(),
+    ))
+
+
+def search(q: str, limit: int, offset: int = 0) -> tuple[list[dict], bool]:
+    """One page of results ({'type', 'id', 'trip_id', 'step_id', 'name', 'rank'}), best first,
+    and whether more follow. Raises ValueError when `q` has no word."""
+    if not words(q):
+        raise ValueError("q must contain at least one word")
+    matches = _postgres_matches if connection.vendor == 'postgresql' else _fallback_matches
+    no_step = Value(None, output_field=IntegerField())
+    sources = [
+        matches(Trip.objects.all(), q).values(
+            kind=Value('trip'), ref=F('id'), trip_ref=F('id'), step_ref=no_step, title=F('name'), rank=F('score'),
+        ),
+        matches(Step.objects.all(), q).values(
+            kind=Value('step'), ref=F('id'), trip_ref=F('trip_id'), step_ref=F('id'), title=F('name'), rank=F('score'),
+        ),
+        matches(Photo.objects.filter(status=Photo.STATUS_READY), q).values(
+            kind=Value('photo'), ref=F('id'), trip_ref=F('step__trip_id'), step_ref=F('step_id'), title=F('name'), rank=F('score'),
+        ),
+    ]
+    rows = list(sources[0].union(*sources[1:], all=True).order_by('-rank', 'kind', 'ref')[offset:offset + limit + 1])
+    results = [
+        {'type': row['kind'], 'id': row['ref'], 'trip_id': row['trip_ref'], 'step_id': row['step_ref'], 'name': row['title'], 'rank': row['rank']}
+        for row in rows[:limit]
+    ]
+    return results, len(rows) > limit
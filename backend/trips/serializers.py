@@ -0,0 +1,112 @@
+from django.db.models import Prefetch, QuerySet
+from .models import Trip, Step, Photo
+
+
+EXPANDABLE = ('steps', 'photos')
+
+
+def trip_tree_queryset(queryset: QuerySet | None = None, steps: bool = True, photos: bool = True) -> QuerySet:
+    """Return trips with their whole step/photo tree loaded in a fixed number of queries.
+
+    Steps are prefetched already ordered by `order` so callers must iterate `trip.steps.all()`
+    (never `.order_by()` / `.filter()` on it, which would discard the prefetch cache).
+    Levels that are not requested (`steps` / `photos`) are not fetched at all. Photos still
+    waiting for their deferred upload (not `ready`) are left out.
+    """
+    if queryset is None:
+        queryset = Trip.objects.all()
+    queryset = queryset.select_related('cover_photo')
+    if steps:
+        queryset = queryset.prefetch_related(
+            Prefetch('steps', queryset=Step.objects.select_related('cover_photo').order_by('order', 'id')),
+        )
+        if photos:
+            queryset = queryset.prefetch_related(Prefetch('steps__photos', queryset=Photo.objects.filter(status=Photo.STATUS_READY).order_by('id')))
+    return queryset
+
+
+def parse_expand(expand: str | None) -> set[str]:
+    """Parse a comma separated `expand` parameter; raises ValueError on unknown names.
+
+    `photos` implies `steps` since photos are only reachable through a step.
+    """
+    names = {e.strip() for e in (expand or '').split(',') if e.strip()}
+    unknown = names - set(EXPANDABLE)
+    if unknown:
+        raise ValueError(f"Unknown expand value(s): {', '.join(sorted(unknown))}. Allowed: {', '.join(EXPANDABLE)}")
+    if 'photos' in names:
+        names.add('steps')
+    return names
+
+
+def cover_photo_dict(photo: Photo | None) -> dict | None:
+    if photo is None:
+        return None
+    return {'id': photo.id, 'url': photo.url, 'thumbnail_url': photo.thumbnail_url}  # type: ignore[attr-defined]
+
+
+def cover_photo_from_values(row: dict, prefix: str = 'cover_photo') -> dict | None:
+    """cover_photo_dict() for `.values()` rows holding `<prefix>_id`, `<prefix>__url` and `<prefix>__variants`."""
+    if not row[f'{prefix}_id']:
+        return None
+    thumbnail = (row[f'{prefix}__variants'] or {}).get('thumbnail', {}).get('url')
+    return {'id': row[f'{prefix}_id'], 'url': row[f'{prefix}__url'], 'thumbnail_url': thumbnail or row[f'{prefix}__url']}
+
+
+def photo_dict(photo: Photo) -> dict:
+    return {
+        'id': photo.id,  # type: ignore[attr-defined]
+        'name': photo.name,
+        'description': photo.description,
+        'date': photo.date.isoformat(),
+        'url': photo.url,
+        'width': photo.width,
+        'height': photo.height,
+        'variants': photo.variants,
+        'taken_at': photo.taken_at.isoformat() if photo.taken_at else None,
+        'lat': photo.lat,
+        'lng': photo.lng,
+        'orientation': photo.orientation,
+    }
+
+
+def step_dict(step: Step, photos: bool = True) -> dict:
+    data = {
+        'id': step.id,  # type: ignore[attr-defined]
+        'name': step.name,
+        'lat': step.lat,
+        'lng': step.lng,
+        'description': step.description,
+        'order': step.order,
+        'cover_photo': cover_photo_dict(step.cover_photo),
+        'started_at': step.started_at.isoformat() if step.started_at else None,
+        'ended_at': step.ended_at.isoformat() if step.ended_at else None,
+        'photo_count': step.photo_count,
+        'photos': [],
+    }
+    if photos:
+        data['photos'] = [photo_dict(p) for p in step.photos.all()]  # type: ignore[attr-defined]
+    return data
+
+
+def trip_dict(trip: Trip, steps: bool = True, photos: bool = True) -> dict:
+    data = {
+        'id': trip.id,  # type: ignore[attr-defined]
+        'name': trip.name,
+        'cover_photo': cover_photo_dict(trip.cover_photo),
+        'step_count': trip.step_count,
+        'photo_count': trip.photo_count,
+        'bbox': trip.bbox,
+        'distance_km': trip.distance_km,
+        'steps_started_at': trip.steps_started_at.isoformat() if trip.steps_started_at else None,
+        'steps_ended_at': trip.steps_ended_at.isoformat() if trip.steps_ended_at else None,
+        'steps': [],
+    }
+    if steps:
+        data['steps'] = [step_dict(s, photos=photos) for s in trip.steps.all()]  # type: ignore[attr-defined]
+    return data
+
+
+def serialize_trips(queryset: QuerySet | None = None, steps: bool = True, photos: bool = True) -> list[dict]:
+    """Serialize trips (optionally with nested steps and photos) to plain dicts in a single pass."""
+    return [trip_dict(t, steps=steps, photos=photos) for t in trip_tree_queryset(queryset, steps=steps, photos=photos)]
@@ -0,0 +1,86 @@
+"""Duplicate detection of uploaded photos.
+
+Exact copies are found by SHA-256 (Photo.content_hash): their remote file, share and
+variants are reused instead of being uploaded again. Visually similar photos (re-encoded,
+resized) are flagged with a 64-bit difference hash (Photo.perceptual_hash) when
+PHOTO_PERCEPTUAL_HASH_ENABLED is set.
+"""
+import hashlib
+import logging
+from django.conf import settings
+from PIL import Image
+from ..models import Photo
+
+logger = logging.getLogger(__name__)
+
+# Photo fields describing the file itself, copied to a photo reusing another one's upload
+REUSED_FIELDS = ('url', 'width', 'height', 'variants', 'taken_at', 'lat', 'lng', 'orientation', 'perceptual_hash')
+
+
+def content_hash(file) -> str:
+    """SHA-256 (hex) of an uploaded file, as computed by the upload handlers when available."""
+    digest = getattr(file, 'sha256', None)
+    if digest:
+        return digest
+    sha256 = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(1024 * 1024), b''):
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+def perceptual_hash(source) -> str:
+    """Difference hash (dHash) of an image, '' when disabled or not an image."""
+    if not settings.PHOTO_PERCEPTUAL_HASH_ENABLED:
+        return ''
+    try:
+        source.seek(0)
+        with Image.open(source) as image:
+            image.draft('L', (64, 64))
+            pixels = list(image.convert('L').resize((9, 8), Image.Resampling.BILINEAR).getdata())
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        logger.info("Could not compute perceptual hash: %s", e)
+        return ''
+    finally:
+        source.seek(0)
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+
+def hamming(a: str, b: str) -> int:
+    return (int(a, 16) ^ int(b, 16)).bit_count()
+
+
+def find_originals(step_id: int, digests) -> dict[str, Photo]:
+    """Ready photos with the given content hashes, preferring one of step `step_id`."""
+    originals: dict[str, Photo] = {}
+    for photo in Photo.objects.filter(content_hash__in=set(digests), status=Photo.STATUS_READY).exclude(url='').order_by('id'):
+        if photo.content_hash not in originals or (photo.step_id == step_id and originals[photo.content_hash].step_id != step_id):  # type: ignore[attr-defined]
+            originals[photo.content_hash] = photo
+    return originals
+
+
+def reused_fields(original: Photo) -> dict:
+    return {field: getattr(original, field) for field in REUSED_FIELDS}
+
+
+def near_duplicates(trip_id: int, photos: list[Photo]) -> dict[int, list[int]]:
+    """Ids of the other photos of the trip looking like each of `photos` (exact copies excluded)."""
+    hashed = [photo for photo in photos if photo.perceptual_hash]
+    if not hashed:
+        return {}
+    candidates = list(
+        Photo.objects.filter(step__trip_id=trip_id).exclude(perceptual_hash='').values_list('id', 'content_hash', 'perceptual_hash')
+    )
+    return {
+        photo.pk: [
+            other_id for other_id, other_content, other_hash in candidates
+            if other_id != photo.pk and (not photo.content_hash or other_content != photo.content_hash)
+            and hamming(photo.perceptual_hash, other_hash) <= settings.PHOTO_NEAR_DUPLICATE_DISTANCE
+        ]
+        for photo in hashed
+    }
@@ -0,0 +1,86 @@
+"""Resized variants (thumbnail, medium) of uploaded photos, generated with Pillow.
+
+The original stays the `full` variant (Photo.url); smaller renditions are uploaded next to it
+and recorded in Photo.variants as {name: {"url", "width", "height"}}.
+"""
+import io
+import logging
+import os
+from PIL import Image, ImageOps
+from django.conf import settings
+from ..models import Photo
+from .owncloud import upload_file, OwnCloudError
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels of each generated variant
+VARIANT_SIZES = {
+    'thumbnail': 256,
+    'medium': 1280,
+}
+
+
+def render_variants(source) -> tuple[int, int, dict[str, tuple[bytes, int, int]]]:
+    """Return (width, height, {variant: (encoded bytes, width, height)}) for an image file.
+
+    JPEGs are decoded with draft() at the smallest scale still larger than the biggest
+    variant, which skips most of the decoding work for camera-sized images.
+    """
+    with Image.open(source) as image:
+        width, height = image.size
+        if image.getexif().get(0x0112, 1) in (5, 6, 7, 8):  # EXIF orientation rotated by 90 degrees
+            width, height = height, width
+        largest = max(VARIANT_SIZES.values())
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB')
+        fmt = settings.PHOTO_VARIANT_FORMAT
+        if fmt == 'JPEG' and image.mode == 'RGBA':
+            image = image.convert('RGB')
+        variants = {}
+        for name, size in sorted(VARIANT_SIZES.items(), key=lambda item: -item[1]):
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+            out = io.BytesIO()
+            resized.save(out, fmt, quality=settings.PHOTO_VARIANT_QUALITY)
+            variants[name] = (out.getvalue(), resized.width, resized.height)
+            # Downscale the next (smaller) variant from this one
+            image = resized
+    return width, height, variants
+
+
+def create_variants(source, original_name: str) -> dict | None:
+    """Render and upload the variants of an image file; returns the Photo field values to store.
+
+    Touches no database, so it can run in worker threads. Errors are logged and reported with
+    None: a photo without variants is still usable (clients fall back to the full size URL)
+    and can be backfilled later with `manage.py generate_photo_variants`.
+    """
+    try:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        width, height, rendered = render_variants(source)
+        stem = os.path.splitext(original_name)[0]
+        ext = '.webp' if settings.PHOTO_VARIANT_FORMAT == 'WEBP' else '.jpg'
+        variants = {}
+        for name, (data, w, h) in rendered.items():
+            _, url = upload_file(data, f"{stem}_{name}{ext}")
+            variants[name] = {'url': url, 'width': w, 'height': h}
+    except (OSError, OwnCloudError, Image.DecompressionBombError) as e:
+        logger.warning("Could not generate variants of %s: %s", original_name, e)
+        return None
+    return {'width': width, 'height': height, 'variants': variants}
+
+
+def generate(photo: Photo, source, original_name: str | None = None) -> bool:
+    """create_variants() for an existing photo, saved on it; no-op when PHOTO_VARIANTS_ENABLED is off."""
+    if not settings.PHOTO_VARIANTS_ENABLED:
+        return False
+    fields = create_variants(source, original_name or photo.name)
+    if fields is None:
+        return False
+    for field, value in fields.items():
+        setattr(photo, field, value)
+    photo.save(update_fields=list(fields))
+    return True
@@ -0,0 +1,130 @@
+"""EXIF metadata of uploaded photos: capture time, GPS position and orientation.
+
+Image.open() only parses the file header, so reading EXIF never decodes pixel data and
+works on the first HEADER_BYTES of a file (enough for the APP1 segment of a JPEG, which
+is limited to 64 KiB), e.g. fetched with an HTTP Range request.
+"""
+import logging
+import statistics
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db.models import Max, Min
+from django.utils import timezone
+from PIL import Image
+from ..geo import haversine_km
+from ..models import Photo, Step
+
+logger = logging.getLogger(__name__)
+
+HEADER_BYTES = 128 * 1024
+
+# Formats whose EXIF block sits in the header (PNG may store it after the image data)
+HEADER_EXIF_FORMATS = ('JPEG', 'MPO', 'TIFF', 'WEBP')
+
+_ORIENTATION = 0x0112
+_DATETIME = 0x0132
+_EXIF_IFD = 0x8769
+_GPS_IFD = 0x8825
+_DATETIME_ORIGINAL = 0x9003
+_OFFSET_TIME_ORIGINAL = 0x9011
+_GPS_LAT_REF, _GPS_LAT, _GPS_LNG_REF, _GPS_LNG = 1, 2, 3, 4
+
+FIELDS = ('taken_at', 'lat', 'lng', 'orientation')
+
+
+def _parse_datetime(value, offset) -> datetime | None:
+    try:
+        taken_at = datetime.strptime(str(value).strip('\x00 '), '%Y:%m:%d %H:%M:%S')
+    except ValueError:  # missing or "0000:00:00 00:00:00"
+        return None
+    try:
+        sign = -1 if str(offset).startswith('-') else 1
+        hours, minutes = str(offset).strip('+-\x00 ').split(':')
+        offset = dt_timezone(sign * timedelta(hours=int(hours), minutes=int(minutes)))
+        return taken_at.replace(tzinfo=offset).astimezone(dt_timezone.utc)
+    except ValueError:
+        # No offset recorded: the camera clock is assumed to be in TIME_ZONE
+        return timezone.make_aware(taken_at)
+
+
+def _parse_coordinate(dms, ref) -> float | None:
+    try:
+        degrees, minutes, seconds = (float(v) for v in dms)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    value = degrees + minutes / 60 + seconds / 3600
+    if value != value:  # NaN from a zero denominator
+        return None
+    return -value if str(ref).upper().startswith(('S', 'W')) else value
+
+
+def read_metadata(source) -> dict:
+    """Photo field values (taken_at, lat, lng, orientation) read from an image file.
+
+    Returns {} when the file is not an image Pillow understands; fields missing from the
+    EXIF data are None, except orientation which defaults to 1 (upright) for any image.
+    """
+    try:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        with Image.open(source) as image:
+            exif = image.getexif() if image.format in HEADER_EXIF_FORMATS else Image.Exif()
+            exif_ifd = exif.get_ifd(_EXIF_IFD)
+            gps = exif.get_ifd(_GPS_IFD)
+    except (OSError, SyntaxError, ValueError) as e:
+        logger.info("Could not read EXIF data: %s", e)
+        return {}
+    finally:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+    lat = _parse_coordinate(gps.get(_GPS_LAT), gps.get(_GPS_LAT_REF))
+    lng = _parse_coordinate(gps.get(_GPS_LNG), gps.get(_GPS_LNG_REF))
+    if lat is None or lng is None or not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        lat = lng = None
+    orientation = exif.get(_ORIENTATION, 1)
+    return {
+        'taken_at': _parse_datetime(exif_ifd.get(_DATETIME_ORIGINAL) or exif.get(_DATETIME), exif_ifd.get(_OFFSET_TIME_ORIGINAL)),
+        'lat': lat,
+        'lng': lng,
+        'orientation': orientation if orientation in range(1, 9) else 1,
+    }
+
+
+def derive_step(step: Step, apply: bool = False) -> dict:
+    """Compare a step with the capture times / positions of its ready photos.
+
+    The derived position is the median of the geotagged photos (robust to a stray photo),
+    the derived span runs from the first to the last capture time. `issues` lists where the
+    step disagrees with its photos (further than PHOTO_EXIF_STEP_TOLERANCE_KM, or photos taken
+    outside its span). With `apply`, the derived values replace the step's own.
+    """
+    photos = Photo.objects.filter(step=step, status=Photo.STATUS_READY)
+    span = photos.aggregate(first=Min('taken_at'), last=Max('taken_at'))
+    located = list(photos.filter(lat__isnull=False, lng__isnull=False).values_list('lat', 'lng'))
+    derived = {
+        'started_at': span['first'],
+        'ended_at': span['last'],
+        'lat': statistics.median(lat for lat, _ in located) if located else None,
+        'lng': statistics.median(lng for _, lng in located) if located else None,
+    }
+    issues = []
+    if located:
+        distance = haversine_km(step.lat, step.lng, derived['lat'], derived['lng'])
+        if distance > settings.PHOTO_EXIF_STEP_TOLERANCE_KM:
+            issues.append(f"Step is {distance:.1f} km away from where its photos were taken")
+    if span['first'] and span['first'] < step.started_at:
+        issues.append(f"Photos taken before the step starts ({span['first'].isoformat()})")
+    if span['last'] and span['last'] > step.ended_at:
+        issues.append(f"Photos taken after the step ends ({span['last'].isoformat()})")
+    changed = [field for field, value in derived.items() if value is not None and getattr(step, field) != value]
+    if apply and changed:
+        for field in changed:
+            setattr(step, field, derived[field])
+        step.save(update_fields=changed)
+    return {
+        **derived,
+        'photos': photos.count(),
+        'located': len(located),
+        'issues': issues,
+        'applied': apply and bool(changed),
+    }
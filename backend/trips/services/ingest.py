@@ -0,0 +1,204 @@
+"""Build a trip automatically from a folder or zip archive of geotagged photos.
+
+1. Every image is copied to UPLOAD_SPOOL_DIR by a pool of threads, hashed on the way,
+   and its EXIF capture time / GPS position is read from the spooled header.
+2. A time-ordered sweep groups the photos into steps: a new step starts when the gap
+   since the previous photo exceeds INGEST_STEP_GAP_HOURS, or when the photo lies further
+   than INGEST_STEP_RADIUS_KM from the current step (O(n log n), no pairwise distances).
+3. The Trip, its Steps and its pending Photos are inserted with bulk_create; the photos
+   are pushed to ownCloud by the upload queue (services/upload_queue.py), in parallel.
+"""
+import hashlib
+import logging
+import os
+import statistics
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Callable, Iterable
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from .. import clustering, stats
+from ..cache import invalidate_trip
+from ..geo import haversine_km
+from ..models import Trip, Step, Photo
+from . import exif
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.tif', '.tiff', '.heic')
+
+# progress(stage, done, total)
+Progress = Callable[[str, int, int], None]
+
+
+class IngestError(Exception):
+    pass
+
+
+def _is_image(name: str) -> bool:
+    base = os.path.basename(name)
+    return not base.startswith('.') and os.path.splitext(base)[1].lower() in IMAGE_EXTENSIONS
+
+
+def directory_sources(path: str) -> list[tuple[str, Callable]]:
+    """(name, opener) of the images below a directory, in path order."""
+    sources = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if _is_image(name):
+                full = os.path.join(root, name)
+                sources.append((os.path.relpath(full, path), lambda full=full: open(full, 'rb')))
+    return sources
+
+
+def archive_sources(archive: zipfile.ZipFile) -> list[tuple[str, Callable]]:
+    """(name, opener) of the images of a zip archive; its members can be read from several threads."""
+    return [
+        (info.filename, lambda info=info: archive.open(info))
+        for info in archive.infolist() if not info.is_dir() and _is_image(info.filename)
+    ]
+
+
+def _spool(source: tuple[str, Callable]) -> dict | None:
+    name, opener = source
+    path = os.path.join(settings.UPLOAD_SPOOL_DIR, f"{uuid.uuid4().hex}{os.path.splitext(name)[1].lower()}")
+    sha256 = hashlib.sha256()
+    try:
+        with opener() as src, open(path, 'wb') as out:
+            for chunk in iter(lambda: src.read(1024 * 1024), b''):
+                sha256.update(chunk)
+                out.write(chunk)
+        with open(path, 'rb') as f:
+            metadata = exif.read_metadata(f)
+    except (OSError, zipfile.BadZipFile) as e:
+        logger.warning("Could not read %s: %s", name, e)
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+    return {'name': os.path.basename(name), 'spool_path': path, 'content_hash': sha256.hexdigest(), **metadata}
+
+
+def spool_sources(sources: list[tuple[str, Callable]], workers: int | None = None, progress: Progress | None = None) -> list[dict]:
+    """Copy the images to the spool directory in parallel, with their hash and EXIF metadata."""
+    workers = workers or settings.INGEST_WORKERS
+    os.makedirs(settings.UPLOAD_SPOOL_DIR, exist_ok=True)
+    spooled = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for done, item in enumerate(pool.map(_spool, sources), 1):
+            if item is not None:
+                spooled.append(item)
+            if progress:
+                progress('read', done, len(sources))
+    return spooled
+
+
+def group_photos(photos: Iterable[dict], gap: timedelta, radius_km: float) -> list[list[dict]]:
+    """Split photos into steps with a sweep in capture time order.
+
+    Photos without a capture time come last (by name) and are grouped by position only;
+    photos without a position join the step they fall in time-wise. A group with no
+    geotagged photo is merged into the previous one (the next one for the first group).
+    """
+    ordered = sorted(photos, key=lambda p: (p.get('taken_at') is None, p.get('taken_at') or timezone.now(), p['name']))
+    groups: list[dict] = []
+    for photo in ordered:
+        current = groups[-1] if groups else None
+        taken_at, lat, lng = photo.get('taken_at'), photo.get('lat'), photo.get('lng')
+        fits = current is not None
+        if fits and taken_at and current['last'] and taken_at - current['last'] > gap:
+            fits = False
+        if fits and lat is not None and current['located']:
+            centroid = (current['lat_sum'] / current['located'], current['lng_sum'] / current['located'])
+            fits = haversine_km(centroid[0], centroid[1], lat, lng) <= radius_km
+        if not fits:
+            current = {'photos': [], 'last': None, 'located': 0, 'lat_sum': 0.0, 'lng_sum': 0.0}
+            groups.append(current)
+        current['photos'].append(photo)
+        current['last'] = taken_at or current['last']
+        if lat is not None:
+            current['located'] += 1
+            current['lat_sum'] += lat
+            current['lng_sum'] += lng
+    merged: list[list[dict]] = []
+    orphans: list[dict] = []
+    for group in groups:
+        if not group['located']:
+            if merged:
+                merged[-1].extend(group['photos'])
+            else:
+                orphans.extend(group['photos'])
+            continue
+        merged.append(orphans + group['photos'])
+        orphans = []
+    return merged
+
+
+def _step(trip: Trip, order: int, photos: list[dict]) -> Step:
+    located = [p for p in photos if p.get('lat') is not None]
+    times = [p['taken_at'] for p in photos if p.get('taken_at')]
+    now = timezone.now()
+    started_at, ended_at = (min(times), max(times)) if times else (now, now)
+    return Step(
+        trip=trip, order=order, name=f"Step {order + 1}",
+        description=f"{len(photos)} photo(s), {started_at:%Y-%m-%d}" if times else f"{len(photos)} photo(s)",
+        lat=statistics.median(p['lat'] for p in located), lng=statistics.median(p['lng'] for p in located),
+        started_at=started_at, ended_at=ended_at,
+    )
+
+
+def create_trip(name: str, photos: list[dict], description: str = '', gap: timedelta | None = None, radius_km: float | None = None) -> Trip:
+    """Create the trip, its steps and pending photos (one bulk insert each) from spooled photos."""
+    if gap is None:
+        gap = timedelta(hours=settings.INGEST_STEP_GAP_HOURS)
+    if radius_km is None:
+        radius_km = settings.INGEST_STEP_RADIUS_KM
+    groups = group_photos(photos, gap, radius_km)
+    if not groups:
+        raise IngestError("No geotagged photo found")
+    with transaction.atomic():
+        trip = Trip.objects.create(name=name, description=description, next_step_order=len(groups))
+        steps = Step.objects.bulk_create([_step(trip, order, group) for order, group in enumerate(groups)])
+        Photo.objects.bulk_create([
+            Photo(step=step, status=Photo.STATUS_PENDING, **photo)
+            for step, group in zip(steps, groups) for photo in group
+        ])
+        # bulk_create skips the model signals: account for the new steps on the map grid
+        clustering.add_points([(step.lat, step.lng) for step in steps])
+        stats.refresh([trip.id], photos=True)  # type: ignore[attr-defined]
+    invalidate_trip(trip.id)  # type: ignore[attr-defined]
+    return trip
+
+
+def discard(photos: list[dict]):
+    """Remove spooled files that will not be imported."""
+    for photo in photos:
+        try:
+            os.remove(photo['spool_path'])
+        except OSError:
+            pass
+
+
+def ingest(name: str, sources: list[tuple[str, Callable]], workers: int | None = None, progress: Progress | None = None, **options) -> Trip:
+    """Spool the sources and create the trip; its photos are left pending for the upload queue."""
+    if not sources:
+        raise IngestError("No image found")
+    photos = spool_sources(sources, workers=workers, progress=progress)
+    try:
+        return create_trip(name, photos, **options)
+    except Exception:
+        discard(photos)
+        raise
+
+
+def import_progress(trip_id: int) -> dict:
+    """Photos of a trip per upload status."""
+    counts = dict.fromkeys((Photo.STATUS_PENDING, Photo.STATUS_UPLOADING, Photo.STATUS_READY, Photo.STATUS_FAILED), 0)
+    rows = Photo.objects.filter(step__trip_id=trip_id).values_list('status').annotate(count=Count('id')).order_by()
+    for status, count in rows:
+        counts[status] = count
+    return {**counts, 'total': sum(counts.values())}
@@ -1,9 +1,18 @@
+import asyncio
 import mimetypes
 import os
+import threading
+import time
 import uuid
-from typing import Tuple
+import weakref
+import xml.etree.ElementTree as ET
+from typing import AsyncIterator, BinaryIO, Iterable, Tuple, Union
+import httpx
 import requests
+from asgiref.sync import sync_to_async
+from requests.adapters import HTTPAdapter
 from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 
 class OwnCloudError(Exception):
     pass
@@ -14,74 +23,50 @@ def _check_config():
         raise OwnCloudError("OwnCloud settings incomplete. Set OWNCLOUD_BASE_URL, OWNCLOUD_USERNAME, OWNCLOUD_PASSWORD.")
 
 
-def upload_file(file_bytes: bytes, original_name: str) -> Tuple[str, str]:
-    """Upload a file to ownCloud/Nextcloud and return a tuple of (share_page_url, direct_download_url).
+FileData = Union[bytes, BinaryIO, Iterable[bytes]]
 
-    share_page_url: Standard public share page (e.g. https://cloud.example.com/s/<token>)
-    direct_download_url: A URL intended for direct file download (share_page_url + '/download').
-    If share creation or parsing fails, both values may fall back to the WebDAV URL (non-public).
+
+class SizedReader:
+    """Expose a readable stream of known length (e.g. a Django request body) to requests.
+
+    requests only sends a Content-Length for streams whose size it can determine; without
+    one it falls back to chunked transfer encoding.
     """
-    _check_config()
-    base = settings.OWNCLOUD_BASE_URL
-    webdav_url = f"{base}/remote.php/dav/files/{settings.OWNCLOUD_USERNAME}"
-    # Ensure path
-    remote_dir = settings.OWNCLOUD_UPLOAD_ROOT.strip('/')
-    # Generate unique filename preserving extension
-    ext = os.path.splitext(original_name)[1]
-    remote_name = f"{uuid.uuid4().hex}{ext}"
-    remote_path = f"{remote_dir}/{remote_name}" if remote_dir else remote_name
+    def __init__(self, stream, length: int):
+        self.stream = stream
+        self.length = length
 
-    # Create intermediate directories is optional; Nextcloud auto-creates only final? We can try MKCOL for each segment.
-    session = requests.Session()
-    session.auth = (settings.OWNCLOUD_USERNAME, settings.OWNCLOUD_PASSWORD)
+    def __len__(self):
+        return self.length
 
-    # Ensure directory path exists
-    if remote_dir:
-        segments = remote_dir.split('/')
-        current = ''
-        for seg in segments:
-            current = f"{current}/{seg}" if current else seg
-            mkcol_url = f"{webdav_url}/{current}"
-            resp = session.request('MKCOL', mkcol_url)
-            if resp.status_code in (201, 405):  # 201 Created, 405 Already exists
-                pass
-            elif resp.status_code == 409:
-                # parent missing - continue attempts
-                continue
-            else:
-                # Some servers return 207 multi-status; ignore success patterns
-                if resp.status_code not in (200, 207):
-                    raise OwnCloudError(f"Failed to ensure directory {current}: {resp.status_code} {resp.text}")
+    def read(self, size: int = -1) -> bytes:
+        return self.stream.read(size)
 
-    mime_type, _ = mimetypes.guess_type(original_name)
-    headers = {}
-    if mime_type:
-        headers['Content-Type'] = mime_type
 
-    put_url = f"{webdav_url}/{remote_path}"
-    put_resp = session.put(put_url, data=file_bytes, headers=headers)
-    if put_resp.status_code not in (200,201,204):
-        raise OwnCloudError(f"Upload failed: {put_resp.status_code} {put_resp.text}")
+def new_remote_path(original_name: str) -> str:
+    """Unique path below OWNCLOUD_UPLOAD_ROOT, preserving the file extension."""
+    remote_dir = settings.OWNCLOUD_UPLOAD_ROOT.strip('/')
+    ext = os.path.splitext(original_name)[1]
+    remote_name = f"{uuid.uuid4().hex}{ext}"
+    return f"{remote_dir}/{remote_name}" if remote_dir else remote_name
 
-    # Create share via OCS API
-    share_api = f"{base}/ocs/v2.php/apps/files_sharing/api/v1/shares"
-    data = {
+
+def share_form(remote_path: str) -> dict:
+    """OCS API form fields sharing `remote_path` as configured."""
+    return {
         'path': f"/{remote_path}",
         'shareType': 3 if settings.OWNCLOUD_SHARE_PUBLIC else 0,  # 3 public link
         'permissions': settings.OWNCLOUD_SHARE_PERMISSIONS,
     }
-    headers = { 'OCS-APIRequest': 'true' }
-    share_resp = session.post(share_api, data=data, headers=headers)
-    if share_resp.status_code not in (200,201):
-        # fallback – no share created
-        return (put_url, put_url)
 
+
+def share_urls(body: str, fallback: str) -> Tuple[str, str]:
+    """(share_page_url, direct_download_url) from an OCS share answer, `fallback` twice if unparseable."""
     share_page_url: str | None = None
     token: str | None = None
     # Try proper XML parsing
     try:
-        import xml.etree.ElementTree as ET
-        root = ET.fromstring(share_resp.text)
+        root = ET.fromstring(body)
         # Nextcloud wraps in <ocs><data><element>...</element></data></ocs>
         for elem in root.iter():
             tag = elem.tag.lower()
@@ -91,15 +76,477 @@ def upload_file(file_bytes: bytes, original_name: str) -> Tuple[str, str]:
                 token = elem.text.strip()
     except Exception:
         # Fallback to naive extraction
-        if 'url' in share_resp.text:
-            start = share_resp.text.find('<url>')
-            end = share_resp.text.find('</url>')
+        if 'url' in body:
+            start = body.find('<url>')
+            end = body.find('</url>')
             if start != -1 and end != -1:
-                share_page_url = share_resp.text[start+5:end].strip()
+                share_page_url = body[start+5:end].strip()
 
     if not share_page_url:
         # Could not parse – return WebDAV path
-        return (put_url, put_url)
+        return (fallback, fallback)
 
     direct_download = share_page_url.rstrip('/') + '/download'
     return (share_page_url, direct_download)
+
+
+# Chunked uploads (Nextcloud chunking v2):
+#   MKCOL  uploads/<user>/<upload_id>            (Destination: final WebDAV URL)
+#   PUT    uploads/<user>/<upload_id>/<1..10000> (one per chunk, any order, retried freely)
+#   MOVE   uploads/<user>/<upload_id>/.file      (assembles the chunks at the destination)
+# https://docs.nextcloud.com/server/latest/developer_manual/client_apis/WebDAV/chunking.html
+
+MAX_CHUNKS = 10000
+
+
+class KnownDirs:
+    """Remote directories known to exist, shared by every client of a server in the process."""
+    def __init__(self):
+        self._dirs: set[str] = set()
+        self._lock = threading.Lock()
+
+    def __contains__(self, remote_dir: str) -> bool:
+        return remote_dir in self._dirs
+
+    def add(self, remote_dir: str):
+        with self._lock:
+            self._dirs.add(remote_dir)
+
+    def forget(self, remote_dir: str):
+        """Drop a directory (and its parents), e.g. after it was deleted remotely."""
+        with self._lock:
+            while remote_dir:
+                self._dirs.discard(remote_dir)
+                remote_dir = os.path.dirname(remote_dir)
+
+
+_known_dirs: dict[tuple[str, str], KnownDirs] = {}
+_known_dirs_lock = threading.Lock()
+
+
+def known_dirs(base_url: str, username: str) -> KnownDirs:
+    with _known_dirs_lock:
+        return _known_dirs.setdefault((base_url, username), KnownDirs())
+
+
+class OwnCloudClient:
+    """Long-lived ownCloud/Nextcloud client.
+
+    Keeps a keep-alive connection pool (OWNCLOUD_POOL_SIZE) with connect / read timeouts,
+    retries 5xx answers and connection errors of idempotent requests with exponential backoff
+    when the request body can be replayed, and remembers the directories it already created so a steady
+    state upload is one PUT plus one share call. Use get_client() to share one per process.
+    """
+    RETRY_STATUSES = (500, 502, 503, 504)
+    # Methods safe to send again: a repeated POST (share creation) or MOVE is not
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'PROPFIND', 'MKCOL', 'DELETE')
+
+    def __init__(self, base_url: str, username: str, password: str):
+        self.base_url = base_url
+        self.username = username
+        self.webdav_url = f"{base_url}/remote.php/dav/files/{username}"
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.OWNCLOUD_POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.timeout = (settings.OWNCLOUD_CONNECT_TIMEOUT, settings.OWNCLOUD_READ_TIMEOUT)
+        self.retries = settings.OWNCLOUD_RETRIES
+        self.backoff = settings.OWNCLOUD_RETRY_BACKOFF
+        self.known_dirs = known_dirs(base_url, username)
+
+    def request(self, method: str, url: str, data=None, **kwargs) -> requests.Response:
+        """Send a request, retrying 5xx / connection errors of idempotent methods when `data`
+        can be replayed.
+
+        bytes and seekable file objects are rewound before each attempt; iterators cannot be
+        and are sent once.
+        """
+        start = data.tell() if hasattr(data, 'seek') and hasattr(data, 'tell') else None
+        replayable = data is None or isinstance(data, bytes) or start is not None
+        attempts = self.retries + 1 if replayable and method in self.IDEMPOTENT_METHODS else 1
+        for attempt in range(attempts):
+            if start is not None:
+                data.seek(start)  # type: ignore[union-attr]
+            try:
+                resp = self.session.request(method, url, data=data, timeout=self.timeout, **kwargs)
+            except requests.ConnectionError as e:
+                if attempt + 1 >= attempts:
+                    raise OwnCloudError(f"{method} {url} failed: {e}") from e
+            except requests.Timeout as e:
+                raise OwnCloudError(f"{method} {url} timed out") from e
+            else:
+                if resp.status_code not in self.RETRY_STATUSES or attempt + 1 >= attempts:
+                    return resp
+            time.sleep(self.backoff * (2 ** attempt))
+        raise AssertionError("unreachable")
+
+    def _uploads_url(self, upload_id: str) -> str:
+        return f"{self.base_url}/remote.php/dav/uploads/{self.username}/{upload_id}"
+
+    def ensure_dir(self, remote_dir: str):
+        # Create intermediate directories is optional; Nextcloud auto-creates only final? We can try MKCOL for each segment.
+        if not remote_dir or remote_dir in self.known_dirs:
+            return
+        segments = remote_dir.split('/')
+        current = ''
+        for seg in segments:
+            current = f"{current}/{seg}" if current else seg
+            if current in self.known_dirs:
+                continue
+            mkcol_url = f"{self.webdav_url}/{current}"
+            resp = self.request('MKCOL', mkcol_url)
+            if resp.status_code in (201, 405):  # 201 Created, 405 Already exists
+                self.known_dirs.add(current)
+            elif resp.status_code == 409:
+                # parent missing - continue attempts
+                continue
+            else:
+                # Some servers return 207 multi-status; ignore success patterns
+                if resp.status_code not in (200, 207):
+                    raise OwnCloudError(f"Failed to ensure directory {current}: {resp.status_code} {resp.text}")
+        self.known_dirs.add(remote_dir)
+
+    def forget_dir(self, remote_dir: str):
+        """Drop a directory (and its parents) from the known set, e.g. after it was deleted remotely."""
+        self.known_dirs.forget(remote_dir)
+
+    def upload(self, file_data: FileData, original_name: str) -> Tuple[str, str]:
+        remote_path = new_remote_path(original_name)
+        remote_dir = os.path.dirname(remote_path)
+        self.ensure_dir(remote_dir)
+
+        mime_type, _ = mimetypes.guess_type(original_name)
+        headers = {}
+        if mime_type:
+            headers['Content-Type'] = mime_type
+
+        put_url = f"{self.webdav_url}/{remote_path}"
+        start = file_data.tell() if hasattr(file_data, 'seek') else None
+        put_resp = self.request('PUT', put_url, data=file_data, headers=headers)
+        if put_resp.status_code in (404, 409) and remote_dir:
+            # Cached directory vanished on the server: recreate it once and retry if we can
+            self.forget_dir(remote_dir)
+            self.ensure_dir(remote_dir)
+            if start is not None:
+                file_data.seek(start)  # type: ignore[union-attr]
+            if isinstance(file_data, bytes) or start is not None:
+                put_resp = self.request('PUT', put_url, data=file_data, headers=headers)
+        if put_resp.status_code not in (200,201,204):
+            raise OwnCloudError(f"Upload failed: {put_resp.status_code} {put_resp.text}")
+        return self.share(remote_path)
+
+    def share(self, remote_path: str) -> Tuple[str, str]:
+        """Create a share for an uploaded file and return (share_page_url, direct_download_url)."""
+        put_url = f"{self.webdav_url}/{remote_path}"
+        # Create share via OCS API
+        share_api = f"{self.base_url}/ocs/v2.php/apps/files_sharing/api/v1/shares"
+        headers = { 'OCS-APIRequest': 'true' }
+        share_resp = self.request('POST', share_api, data=share_form(remote_path), headers=headers)
+        if share_resp.status_code not in (200,201):
+            # fallback – no share created
+            return (put_url, put_url)
+
+        return share_urls(share_resp.text, put_url)
+
+    def download(self, url: str, out: BinaryIO, chunk_size: int = 1024 * 1024, max_bytes: int | None = None):
+        """Stream a file (e.g. a share download URL) into `out`.
+
+        With `max_bytes` only the start of the file is fetched (Range request, and the
+        transfer is cut short should the server ignore the range).
+        """
+        headers = {'Range': f"bytes=0-{max_bytes - 1}"} if max_bytes else {}
+        received = 0
+        try:
+            with self.session.get(url, stream=True, timeout=self.timeout, headers=headers) as resp:
+                if resp.status_code not in (200, 206):
+                    raise OwnCloudError(f"Download failed: {resp.status_code} {url}")
+                for chunk in resp.iter_content(min(chunk_size, max_bytes or chunk_size)):
+                    if max_bytes:
+                        chunk = chunk[:max_bytes - received]
+                    out.write(chunk)
+                    received += len(chunk)
+                    if max_bytes and received >= max_bytes:
+                        break
+        except requests.RequestException as e:
+            raise OwnCloudError(f"Download failed: {e}") from e
+
+    def start_chunked_upload(self, remote_path: str) -> str:
+        upload_id = f"cartopic-{uuid.uuid4().hex}"
+        resp = self.request('MKCOL', self._uploads_url(upload_id), headers={'Destination': f"{self.webdav_url}/{remote_path}"})
+        if resp.status_code not in (200, 201):
+            raise OwnCloudError(f"Failed to start chunked upload: {resp.status_code} {resp.text}")
+        return upload_id
+
+    def upload_chunk(self, upload_id: str, remote_path: str, number: int, chunk_data: FileData):
+        if not 1 <= number <= MAX_CHUNKS:
+            raise OwnCloudError(f"Chunk number must be between 1 and {MAX_CHUNKS}")
+        resp = self.request(
+            'PUT', f"{self._uploads_url(upload_id)}/{number:05d}", data=chunk_data,
+            headers={'Destination': f"{self.webdav_url}/{remote_path}"},
+        )
+        if resp.status_code not in (200, 201, 204):
+            raise OwnCloudError(f"Chunk upload failed: {resp.status_code} {resp.text}")
+
+    def list_chunks(self, upload_id: str) -> dict[int, int]:
+        resp = self.request('PROPFIND', self._uploads_url(upload_id), headers={'Depth': '1'})
+        if resp.status_code == 404:
+            raise OwnCloudError("Upload session not found")
+        if resp.status_code != 207:
+            raise OwnCloudError(f"Failed to list chunks: {resp.status_code} {resp.text}")
+        chunks: dict[int, int] = {}
+        for response in ET.fromstring(resp.content).iter('{DAV:}response'):
+            href = response.findtext('{DAV:}href') or ''
+            name = href.rstrip('/').rsplit('/', 1)[-1]
+            if name.isdigit():
+                chunks[int(name)] = int(response.findtext('.//{DAV:}getcontentlength') or 0)
+        return chunks
+
+    def delete(self, remote_path: str):
+        resp = self.request('DELETE', f"{self.webdav_url}/{remote_path}")
+        if resp.status_code not in (200, 204, 404):
+            raise OwnCloudError(f"Delete failed: {resp.status_code} {resp.text}")
+
+    def assemble_chunked_upload(self, upload_id: str, remote_path: str, total_size: int | None = None):
+        self.ensure_dir(os.path.dirname(remote_path))
+        headers = {'Destination': f"{self.webdav_url}/{remote_path}"}
+        if total_size is not None:
+            headers['OC-Total-Length'] = str(total_size)
+        resp = self.request('MOVE', f"{self._uploads_url(upload_id)}/.file", headers=headers)
+        if resp.status_code not in (200, 201, 204):
+            raise OwnCloudError(f"Chunk assembly failed: {resp.status_code} {resp.text}")
+
+    def abort_chunked_upload(self, upload_id: str):
+        resp = self.request('DELETE', self._uploads_url(upload_id))
+        if resp.status_code not in (200, 204, 404):
+            raise OwnCloudError(f"Failed to abort chunked upload: {resp.status_code} {resp.text}")
+
+
+class AsyncOwnCloudClient:
+    """asyncio counterpart of OwnCloudClient for the upload path of async views.
+
+    Requests go through one httpx.AsyncClient whose pool holds up to OWNCLOUD_ASYNC_POOL_SIZE
+    connections, so a single ASGI worker keeps that many uploads in flight while waiting on
+    the network instead of parking a thread per upload. Same timeouts and retries as the
+    blocking client, whose directory cache it shares. An httpx client belongs to the event
+    loop it was first used on: get_async_client() keeps one per running loop, closed with it.
+    Only worth it on a long-lived loop (ASGI): see upload_from_view().
+    """
+    RETRY_STATUSES = OwnCloudClient.RETRY_STATUSES
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, base_url: str, username: str, password: str):
+        self.base_url = base_url
+        self.webdav_url = f"{base_url}/remote.php/dav/files/{username}"
+        self.client = httpx.AsyncClient(
+            auth=(username, password),
+            timeout=httpx.Timeout(settings.OWNCLOUD_READ_TIMEOUT, connect=settings.OWNCLOUD_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=settings.OWNCLOUD_ASYNC_POOL_SIZE,
+                max_keepalive_connections=settings.OWNCLOUD_ASYNC_POOL_SIZE,
+            ),
+        )
+        self.retries = settings.OWNCLOUD_RETRIES
+        self.backoff = settings.OWNCLOUD_RETRY_BACKOFF
+        self.known_dirs = known_dirs(base_url, username)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def _stream(self, file) -> AsyncIterator[bytes]:
+        # Disk reads happen in a thread, never on the event loop
+        while chunk := await asyncio.to_thread(file.read, self.CHUNK_SIZE):
+            yield chunk
+
+    async def request(self, method: str, url: str, content=None, **kwargs) -> httpx.Response:
+        """Send a request, retrying 5xx / connection errors of idempotent methods; `content` is
+        bytes or a seekable file.
+
+        Files are streamed block by block with their Content-Length, rewound before each attempt.
+        """
+        start = content.tell() if content is not None and not isinstance(content, bytes) else None
+        if start is not None:
+            size = getattr(content, 'size', None)
+            if size is None:
+                size = os.fstat(content.fileno()).st_size  # type: ignore[union-attr]
+            kwargs['headers'] = {**kwargs.get('headers', {}), 'Content-Length': str(size - start)}
+        retries = self.retries if method in OwnCloudClient.IDEMPOTENT_METHODS else 0
+        for attempt in range(retries + 1):
+            body = content
+            if start is not None:
+                content.seek(start)  # type: ignore[union-attr]
+                body = self._stream(content)
+            try:
+                resp = await self.client.request(method, url, content=body, **kwargs)
+            except httpx.TimeoutException as e:
+                raise OwnCloudError(f"{method} {url} timed out") from e
+            except httpx.TransportError as e:
+                if attempt >= retries:
+                    raise OwnCloudError(f"{method} {url} failed: {e}") from e
+            else:
+                if resp.status_code not in self.RETRY_STATUSES or attempt >= retries:
+                    return resp
+            await asyncio.sleep(self.backoff * (2 ** attempt))
+        raise AssertionError("unreachable")
+
+    async def ensure_dir(self, remote_dir: str):
+        if not remote_dir or remote_dir in self.known_dirs:
+            return
+        current = ''
+        for seg in remote_dir.split('/'):
+            current = f"{current}/{seg}" if current else seg
+            if current in self.known_dirs:
+                continue
+            resp = await self.request('MKCOL', f"{self.webdav_url}/{current}")
+            if resp.status_code in (201, 405):  # 201 Created, 405 Already exists
+                self.known_dirs.add(current)
+            elif resp.status_code not in (200, 207, 409):
+                raise OwnCloudError(f"Failed to ensure directory {current}: {resp.status_code} {resp.text}")
+        self.known_dirs.add(remote_dir)
+
+    def forget_dir(self, remote_dir: str):
+        self.known_dirs.forget(remote_dir)
+
+    async def upload(self, file_data: bytes | BinaryIO, original_name: str) -> Tuple[str, str]:
+        remote_path = new_remote_path(original_name)
+        remote_dir = os.path.dirname(remote_path)
+        await self.ensure_dir(remote_dir)
+
+        mime_type, _ = mimetypes.guess_type(original_name)
+        headers = {'Content-Type': mime_type} if mime_type else {}
+
+        put_url = f"{self.webdav_url}/{remote_path}"
+        start = None if isinstance(file_data, bytes) else file_data.tell()
+        put_resp = await self.request('PUT', put_url, content=file_data, headers=headers)
+        if put_resp.status_code in (404, 409) and remote_dir:
+            # Cached directory vanished on the server: recreate it once and retry from the start
+            self.forget_dir(remote_dir)
+            await self.ensure_dir(remote_dir)
+            if start is not None:
+                file_data.seek(start)  # type: ignore[union-attr]
+            put_resp = await self.request('PUT', put_url, content=file_data, headers=headers)
+        if put_resp.status_code not in (200,201,204):
+            raise OwnCloudError(f"Upload failed: {put_resp.status_code} {put_resp.text}")
+        return await self.share(remote_path)
+
+    async def share(self, remote_path: str) -> Tuple[str, str]:
+        put_url = f"{self.webdav_url}/{remote_path}"
+        share_api = f"{self.base_url}/ocs/v2.php/apps/files_sharing/api/v1/shares"
+        share_resp = await self.request('POST', share_api, data=share_form(remote_path), headers={'OCS-APIRequest': 'true'})
+        if share_resp.status_code not in (200,201):
+            return (put_url, put_url)
+        return share_urls(share_resp.text, put_url)
+
+
+_clients: dict[tuple[str, str, str], OwnCloudClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client() -> OwnCloudClient:
+    """Process-wide client for the configured server (one connection pool per process)."""
+    _check_config()
+    key = (settings.OWNCLOUD_BASE_URL, settings.OWNCLOUD_USERNAME, settings.OWNCLOUD_PASSWORD)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = OwnCloudClient(*key)
+    return client
+
+
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[tuple[str, str, str], tuple]]" = weakref.WeakKeyDictionary()
+
+
+async def _close_with_loop(client: AsyncOwnCloudClient):
+    # Kept suspended for the life of the loop: asyncio.run() (ASGI servers, asgiref) finalizes
+    # the loop's pending async generators before closing it, which closes the connections
+    try:
+        yield
+    finally:
+        await client.aclose()
+
+
+async def get_async_client() -> AsyncOwnCloudClient:
+    """Client for the configured server shared by the coroutines of the running event loop."""
+    _check_config()
+    key = (settings.OWNCLOUD_BASE_URL, settings.OWNCLOUD_USERNAME, settings.OWNCLOUD_PASSWORD)
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if key not in clients:
+        client = AsyncOwnCloudClient(*key)
+        closer = _close_with_loop(client)
+        await closer.__anext__()
+        clients[key] = (client, closer)
+    return clients[key][0]
+
+
+def upload_file(file_data: FileData, original_name: str) -> Tuple[str, str]:
+    """Upload a file to ownCloud/Nextcloud and return a tuple of (share_page_url, direct_download_url).
+
+    file_data may be bytes, a file-like object or an iterator of byte chunks. File-like objects
+    (e.g. Django's UploadedFile) and iterators are streamed to WebDAV block by block instead of
+    being loaded in memory; a file-like object with a known size is sent with a Content-Length,
+    an iterator with chunked transfer encoding.
+
+    share_page_url: Standard public share page (e.g. https://cloud.example.com/s/<token>)
+    direct_download_url: A URL intended for direct file download (share_page_url + '/download').
+    If share creation or parsing fails, both values may fall back to the WebDAV URL (non-public).
+    """
+    return get_client().upload(file_data, original_name)
+
+
+async def aupload_file(file_data: bytes | BinaryIO, original_name: str) -> Tuple[str, str]:
+    """Asynchronous upload_file() for bytes or a seekable file (e.g. an UploadedFile)."""
+    client = await get_async_client()
+    return await client.upload(file_data, original_name)
+
+
+async def upload_from_view(request, file_data: bytes | BinaryIO, original_name: str) -> Tuple[str, str]:
+    """upload_file() for async views.
+
+    Under ASGI the server's event loop lives as long as the worker, and so do its async
+    client's pool and connections. Under WSGI every async view runs on a throwaway loop: the
+    pooled blocking client is used instead, from a thread.
+    """
+    if isinstance(request, ASGIRequest):
+        return await aupload_file(file_data, original_name)
+    return await sync_to_async(upload_file, thread_sensitive=False)(file_data, original_name)
+
+
+def start_chunked_upload(remote_path: str) -> str:
+    """Open a remote chunk upload directory and return its id."""
+    return get_client().start_chunked_upload(remote_path)
+
+
+def upload_chunk(upload_id: str, remote_path: str, number: int, chunk_data: FileData):
+    """Store chunk `number` (1..MAX_CHUNKS); re-sending a chunk overwrites it."""
+    get_client().upload_chunk(upload_id, remote_path, number, chunk_data)
+
+
+def list_chunks(upload_id: str) -> dict[int, int]:
+    """Return {chunk number: size in bytes} of the chunks received so far."""
+    return get_client().list_chunks(upload_id)
+
+
+def assemble_chunked_upload(upload_id: str, remote_path: str, total_size: int | None = None):
+    """Assemble the chunks into the file at remote_path (not shared yet, see share_file())."""
+    get_client().assemble_chunked_upload(upload_id, remote_path, total_size)
+
+
+def download_file(remote_path: str, out: BinaryIO):
+    """Stream the file at remote_path into `out`."""
+    client = get_client()
+    client.download(f"{client.webdav_url}/{remote_path}", out)
+
+
+def share_file(remote_path: str) -> Tuple[str, str]:
+    """Share the file at remote_path and return (share_page_url, direct_download_url)."""
+    return get_client().share(remote_path)
+
+
+def delete_file(remote_path: str):
+    get_client().delete(remote_path)
+
+
+def abort_chunked_upload(upload_id: str):
+    get_client().abort_chunked_upload(upload_id)
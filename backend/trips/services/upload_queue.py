@@ -0,0 +1,142 @@
+"""Deferred photo uploads: spool locally, push to ownCloud from a worker.
+
+The request thread only writes the file to UPLOAD_SPOOL_DIR and creates a `pending` Photo.
+`manage.py process_uploads` claims pending photos (one UPDATE skipping the rows other workers
+are claiming, so any number of worker processes can run without a broker), uploads and shares
+them, and flips them to `ready` with their final URL, or back to `pending` / `failed` on error.
+"""
+import logging
+import os
+import shutil
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+from ..models import Photo, Step
+from . import dedup, derivatives, exif
+from .owncloud import upload_file, OwnCloudError
+
+logger = logging.getLogger(__name__)
+
+
+def spool_photo(step: Step, file, name: str, description: str | None) -> Photo:
+    """Store an UploadedFile in the spool directory and create its pending Photo.
+
+    A file already queued or uploaded to the same step returns that photo instead.
+    """
+    digest = dedup.content_hash(file)
+    existing = Photo.objects.filter(step=step, content_hash=digest).exclude(status=Photo.STATUS_FAILED).order_by('id').first()
+    if existing is not None:
+        return existing
+    os.makedirs(settings.UPLOAD_SPOOL_DIR, exist_ok=True)
+    ext = os.path.splitext(file.name)[1]
+    path = os.path.join(settings.UPLOAD_SPOOL_DIR, f"{uuid.uuid4().hex}{ext}")
+    if hasattr(file, 'temporary_file_path'):
+        # Large upload already on disk: move it instead of copying
+        shutil.move(file.temporary_file_path(), path)
+    else:
+        with open(path, 'wb') as out:
+            for chunk in file.chunks():
+                out.write(chunk)
+    with open(path, 'rb') as f:
+        metadata = exif.read_metadata(f)
+    return Photo.objects.create(
+        step=step, name=name, description=description, status=Photo.STATUS_PENDING, spool_path=path,
+        content_hash=digest, **metadata,
+    )
+
+
+def release_stale(older_than: timedelta | None = None) -> int:
+    """Put back photos claimed by a worker that died before finishing them."""
+    if older_than is None:
+        older_than = timedelta(seconds=settings.UPLOAD_CLAIM_TIMEOUT)
+    return Photo.objects.filter(
+        status=Photo.STATUS_UPLOADING, claimed_at__lt=timezone.now() - older_than,
+    ).update(status=Photo.STATUS_PENDING, claimed_at=None)
+
+
+def claim(limit: int, trip_id: int | None = None) -> list[int]:
+    """Atomically take up to `limit` pending photos (of one trip only, if given) for this worker.
+
+    A single UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED) RETURNING id: rows being
+    claimed by another worker are skipped rather than waited for.
+    """
+    pending = Photo.objects.filter(status=Photo.STATUS_PENDING)
+    if trip_id is not None:
+        pending = pending.filter(step__trip_id=trip_id)
+    pending = pending.select_for_update(skip_locked=True, of=('self',)).order_by('id').values('id')[:limit]
+    with transaction.atomic(), connection.cursor() as cursor:
+        subquery, params = pending.query.sql_with_params()
+        cursor.execute(
+            f"UPDATE {connection.ops.quote_name(Photo._meta.db_table)} SET status = %s, claimed_at = %s"
+            f" WHERE id IN ({subquery}) RETURNING id",
+            [Photo.STATUS_UPLOADING, timezone.now(), *params],
+        )
+        return sorted(photo_id for photo_id, in cursor.fetchall())
+
+
+def release(photo_id: int, error: Exception):
+    """Give back a claimed photo whose processing crashed: pending again, or failed once it
+    has used its UPLOAD_MAX_ATTEMPTS."""
+    Photo.objects.filter(id=photo_id, status=Photo.STATUS_UPLOADING).update(
+        attempts=F('attempts') + 1,
+        error=str(error),
+        claimed_at=None,
+        status=Case(
+            When(attempts__gte=settings.UPLOAD_MAX_ATTEMPTS - 1, then=Value(Photo.STATUS_FAILED)),
+            default=Value(Photo.STATUS_PENDING),
+        ),
+    )
+
+
+def process(photo_id: int) -> bool:
+    """Upload one claimed photo; returns True once it is ready.
+
+    When the same content was uploaded meanwhile, its remote file is reused instead.
+    """
+    photo = Photo.objects.get(id=photo_id)
+    original = None
+    if photo.content_hash:
+        original = dedup.find_originals(photo.step_id, [photo.content_hash]).get(photo.content_hash)  # type: ignore[attr-defined]
+    if original is not None:
+        for field, value in dedup.reused_fields(original).items():
+            setattr(photo, field, value)
+        photo.status = Photo.STATUS_READY
+        photo.claimed_at = None
+        photo.save(update_fields=[*dedup.REUSED_FIELDS, 'status', 'claimed_at'])
+        _discard_spool(photo)
+        return True
+    try:
+        with open(photo.spool_path, 'rb') as f:
+            # The spooled name keeps the original extension (used for the remote name / MIME type)
+            share_page_url, direct_url = upload_file(f, os.path.basename(photo.spool_path))
+    except (OSError, OwnCloudError) as e:
+        photo.attempts += 1
+        photo.error = str(e)
+        # A missing spool file will not come back, ownCloud errors are retried
+        failed = isinstance(e, OSError) or photo.attempts >= settings.UPLOAD_MAX_ATTEMPTS
+        photo.status = Photo.STATUS_FAILED if failed else Photo.STATUS_PENDING
+        photo.claimed_at = None
+        photo.save(update_fields=['attempts', 'error', 'status', 'claimed_at'])
+        logger.warning("Upload of photo %s failed (attempt %s): %s", photo_id, photo.attempts, e)
+        return False
+    photo.url = direct_url
+    photo.status = Photo.STATUS_READY
+    photo.error = ''
+    photo.claimed_at = None
+    with open(photo.spool_path, 'rb') as f:
+        photo.perceptual_hash = dedup.perceptual_hash(f)
+        photo.save(update_fields=['url', 'status', 'error', 'claimed_at', 'perceptual_hash'])
+        derivatives.generate(photo, f, os.path.basename(photo.spool_path))
+    _discard_spool(photo)
+    return True
+
+
+def _discard_spool(photo: Photo):
+    try:
+        os.remove(photo.spool_path)
+    except OSError:
+        pass
+    Photo.objects.filter(id=photo.pk).update(spool_path='')
@@ -0,0 +1,154 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from . import clustering, stats
+from .cache import invalidate_trip
+from .models import Trip, Step, Photo, Tombstone
+
+
+@receiver(pre_save, sender=Trip)
+def bump_trip_revision(sender, instance: Trip, **kwargs):
+    if not instance._state.adding:
+        instance.revision += 1
+
+
+@receiver(post_save, sender=Trip)
+@receiver(post_delete, sender=Trip)
+def invalidate_trip_cache(sender, instance: Trip, **kwargs):
+    invalidate_trip(instance.pk)
+
+
+@receiver(post_delete, sender=Trip)
+@receiver(post_delete, sender=Step)
+@receiver(post_delete, sender=Photo)
+def record_tombstone(sender, instance, **kwargs):
+    # Reported by GET /api/sync to clients that synced the object before
+    Tombstone.objects.create(kind=sender._meta.model_name, object_id=instance.pk)
+
+
+@receiver(post_save, sender=Trip)
+def refresh_trip_extent(sender, instance: Trip, created: bool, update_fields=None, **kwargs):
+    # The bounding box covers the recorded track too
+    if not created and (update_fields is None or 'track' in update_fields):
+        stats.refresh([instance.pk])
+
+
+def _update_trip_for_step(trip_id: int | None, step_id: int, old: dict | None, new: dict | None, alone: bool = True):
+    if trip_id is None:
+        return
+    changes = stats.step_changed(trip_id, step_id, old, new) if alone else None
+    if changes is None:
+        stats.refresh([trip_id])
+        changes = {}
+    Trip.objects.filter(id=trip_id).touch(**changes)
+    invalidate_trip(trip_id)
+
+
+@receiver(post_save, sender=Step)
+def touch_trip_for_step(sender, instance: Step, created: bool, **kwargs):
+    new = {field: getattr(instance, field) for field in stats.STEP_FIELDS}
+    previous = getattr(instance, '_stats_previous', None)
+    if created:
+        _update_trip_for_step(instance.trip_id, instance.pk, None, new)  # type: ignore[attr-defined]
+    elif previous is None:
+        # Nothing the statistics depend on was written
+        _update_trip_for_step(instance.trip_id, instance.pk, new, new)  # type: ignore[attr-defined]
+    else:
+        # photo_count is not written by Step.save(): keep the value of the database
+        new['photo_count'] = previous['photo_count']
+        if previous['trip_id'] == instance.trip_id:  # type: ignore[attr-defined]
+            _update_trip_for_step(instance.trip_id, instance.pk, previous, new)  # type: ignore[attr-defined]
+        else:
+            _update_trip_for_step(previous['trip_id'], instance.pk, previous, None)
+            _update_trip_for_step(instance.trip_id, instance.pk, None, new)  # type: ignore[attr-defined]
+
+
+@receiver(post_delete, sender=Step)
+def untouch_trip_for_step(sender, instance: Step, origin=None, **kwargs):
+    if isinstance(origin, Trip) or getattr(origin, 'model', None) is Trip:
+        return  # deleted with its trip
+    # The photos of the step were deleted (and uncounted) before it. Steps deleted together
+    # are all gone before the first signal: their trip is recomputed instead.
+    old = {field: getattr(instance, field) for field in stats.STEP_FIELDS} | {'photo_count': 0}
+    _update_trip_for_step(instance.trip_id, instance.pk, old, None, alone=origin is instance)  # type: ignore[attr-defined]
+
+
+@receiver(pre_save, sender=Photo)
+def remember_photo_step(sender, instance: Photo, update_fields=None, **kwargs):
+    instance._previous = None  # type: ignore[attr-defined]
+    if instance._state.adding or (update_fields is not None and not {'step', 'step_id', 'status'} & set(update_fields)):
+        return
+    instance._previous = Photo.objects.filter(pk=instance.pk).values_list('step_id', 'status').first()  # type: ignore[attr-defined]
+
+
+def _count_photo(step_id: int | None, delta: int):
+    """Move the photo counts of a step and of its trip by `delta` (and touch the trip)."""
+    trip_id = Step.objects.filter(id=step_id).values_list('trip_id', flat=True).first()
+    if delta:
+        Step.objects.filter(id=step_id).update(photo_count=F('photo_count') + delta, change_seq=None)
+        Trip.objects.filter(id=trip_id).touch(photo_count=F('photo_count') + delta)
+    else:
+        Trip.objects.filter(id=trip_id).touch()
+    invalidate_trip(trip_id)
+
+
+# Only ready photos are counted (see trips/stats.py)
+@receiver(post_save, sender=Photo)
+def touch_trip_for_photo(sender, instance: Photo, created: bool, **kwargs):
+    ready = instance.status == Photo.STATUS_READY
+    previous = getattr(instance, '_previous', None)
+    if created or previous is None:
+        _count_photo(instance.step_id, int(ready and created))  # type: ignore[attr-defined]
+        return
+    previous_step_id, previous_status = previous
+    was_ready = previous_status == Photo.STATUS_READY
+    if previous_step_id != instance.step_id:  # type: ignore[attr-defined]
+        _count_photo(previous_step_id, -int(was_ready))
+        _count_photo(instance.step_id, int(ready))  # type: ignore[attr-defined]
+    else:
+        _count_photo(instance.step_id, int(ready) - int(was_ready))  # type: ignore[attr-defined]
+
+
+@receiver(post_delete, sender=Photo)
+def uncount_photo(sender, instance: Photo, **kwargs):
+    _count_photo(instance.step_id, -int(instance.status == Photo.STATUS_READY))  # type: ignore[attr-defined]
+
+
+GRID_FIELDS = ('lat', 'lng', 'cover_photo', 'cover_photo_id')
+
+
+@receiver(pre_save, sender=Step)
+def remember_step_position(sender, instance: Step, update_fields=None, **kwargs):
+    instance._grid_previous = None  # type: ignore[attr-defined]
+    instance._stats_previous = None  # type: ignore[attr-defined]
+    watched = {*GRID_FIELDS, *stats.STEP_FIELDS, 'trip', 'trip_id'}
+    if instance._state.adding or (update_fields is not None and not set(update_fields) & watched):
+        return
+    previous = Step.objects.filter(pk=instance.pk).values('cover_photo_id', 'trip_id', *stats.STEP_FIELDS).first()
+    if previous is not None:
+        instance._grid_previous = (previous['lat'], previous['lng'], previous['cover_photo_id'])  # type: ignore[attr-defined]
+        instance._stats_previous = previous  # type: ignore[attr-defined]
+
+
+@receiver(post_save, sender=Step)
+def update_step_grid(sender, instance: Step, created: bool, **kwargs):
+    cover_photo_id = instance.cover_photo_id  # type: ignore[attr-defined]
+    if created:
+        clustering.add_point(instance.lat, instance.lng, cover_photo_id)
+        return
+    previous = getattr(instance, '_grid_previous', None)
+    if previous is None:
+        return
+    lat, lng, previous_cover_id = previous
+    if (lat, lng) != (instance.lat, instance.lng):
+        clustering.remove_point(lat, lng, previous_cover_id)
+        clustering.add_point(instance.lat, instance.lng, cover_photo_id)
+    elif previous_cover_id != cover_photo_id:
+        clustering.remove_cover(lat, lng, previous_cover_id)
+        if cover_photo_id is not None:
+            clustering.set_cover(lat, lng, cover_photo_id)
+
+
+@receiver(post_delete, sender=Step)
+def remove_step_from_grid(sender, instance: Step, **kwargs):
+    clustering.remove_point(instance.lat, instance.lng, instance.cover_photo_id)  # type: ignore[attr-defined]
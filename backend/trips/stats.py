@@ -0,0 +1,135 @@
+"""Denormalized trip / step statistics (Trip.STATS_FIELDS, Step.photo_count).
+
+Counts move incrementally with each photo and step written through the ORM
+(trips/signals.py): step_changed() derives the new statistics of a trip from the one step
+that changed and its neighbours on the route. refresh() recomputes a trip's aggregates from
+all of its steps in a fixed number of queries; bulk writes, which skip the signals, call it
+themselves. Only ready photos are counted, the ones the trip payload returns.
+"""
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+from .geo import decode_polyline, haversine_km, path_length_km
+from .models import Trip, Step, Photo
+from .models.trip import STATS_FIELDS
+
+
+def _empty() -> dict:
+    return {
+        'step_count': 0, 'photo_count': 0, 'min_lat': None, 'min_lng': None, 'max_lat': None, 'max_lng': None,
+        'distance_km': 0.0, 'steps_started_at': None, 'steps_ended_at': None,
+    }
+
+
+def _extend(stats: dict, points: list[tuple[float, float]]):
+    """Grow the bounding box of `stats` to cover `points`."""
+    lats = [lat for lat, _ in points]
+    lngs = [lng for _, lng in points]
+    if stats['min_lat'] is not None:
+        lats += [stats['min_lat'], stats['max_lat']]
+        lngs += [stats['min_lng'], stats['max_lng']]
+    if lats:
+        stats.update(min_lat=min(lats), max_lat=max(lats), min_lng=min(lngs), max_lng=max(lngs))
+
+
+def compute(trip_ids) -> dict[int, dict]:
+    """Statistics of trips from their steps (one query) and their tracks (one query)."""
+    stats = {trip_id: _empty() for trip_id in trip_ids}
+    rows: dict[int, list[tuple]] = {trip_id: [] for trip_id in stats}
+    for row in Step.objects.filter(trip_id__in=stats).order_by('trip_id', 'order', 'id').values_list(
+        'trip_id', 'lat', 'lng', 'started_at', 'ended_at', 'photo_count',
+    ):
+        rows[row[0]].append(row)
+    for trip_id, steps in rows.items():
+        if not steps:
+            continue
+        points = [(lat, lng) for _, lat, lng, _, _, _ in steps]
+        trip = stats[trip_id]
+        trip['step_count'] = len(steps)
+        trip['photo_count'] = sum(row[5] for row in steps)
+        trip['distance_km'] = path_length_km(points)
+        trip['steps_started_at'] = min(row[3] for row in steps)
+        trip['steps_ended_at'] = max(row[4] for row in steps)
+        _extend(trip, points)
+    for trip_id, track in Trip.objects.filter(id__in=stats).exclude(track='').values_list('id', 'track'):
+        _extend(stats[trip_id], decode_polyline(track))
+    return stats
+
+
+def refresh(trip_ids, photos: bool = False):
+    """Recompute the statistics of trips; with `photos`, recount their steps' photos first."""
+    trip_ids = {trip_id for trip_id in trip_ids if trip_id is not None}
+    if not trip_ids:
+        return
+    if photos:
+        counts = Photo.objects.filter(step=OuterRef('pk'), status=Photo.STATUS_READY).order_by().values('step').annotate(n=Count('id')).values('n')
+        Step.objects.filter(trip_id__in=trip_ids).update(photo_count=Coalesce(Subquery(counts), 0), change_seq=None)
+    trips = [Trip(id=trip_id, **values) for trip_id, values in compute(trip_ids).items()]
+    Trip.objects.bulk_update(trips, STATS_FIELDS)
+
+
+# Step values the statistics depend on (see step_changed())
+STEP_FIELDS = ('order', 'lat', 'lng', 'started_at', 'ended_at', 'photo_count')
+
+# Trip statistic -> (step value, side of the bound: min or max)
+_BOUNDS = {
+    'min_lat': ('lat', Least), 'max_lat': ('lat', Greatest),
+    'min_lng': ('lng', Least), 'max_lng': ('lng', Greatest),
+    'steps_started_at': ('started_at', Least), 'steps_ended_at': ('ended_at', Greatest),
+}
+
+
+def _legs_km(trip_id: int, step_id: int, values: dict) -> float:
+    """Length the route of a trip gains with a step at `values` between its neighbours (two queries)."""
+    order = values['order']
+    steps = Step.objects.filter(trip_id=trip_id).exclude(id=step_id).values_list('lat', 'lng')
+    before = steps.filter(Q(order__lt=order) | Q(order=order, id__lt=step_id)).order_by('-order', '-id').first()
+    after = steps.filter(Q(order__gt=order) | Q(order=order, id__gt=step_id)).order_by('order', 'id').first()
+    point = (values['lat'], values['lng'])
+    legs = 0.0
+    if before is not None:
+        legs += haversine_km(*before, *point)
+    if after is not None:
+        legs += haversine_km(*point, *after)
+    if before is not None and after is not None:
+        legs -= haversine_km(*before, *after)
+    return legs
+
+
+def step_changed(trip_id: int, step_id: int, old: dict | None, new: dict | None) -> dict | None:
+    """Changes of the statistics of a trip when one of its steps goes from `old` to `new`.
+
+    `old` / `new` hold the STEP_FIELDS of the step before / after the write, None when the step
+    was not / is no longer in the trip. The result is meant for TripQuerySet.touch(); it is None
+    when the step held a bound of the bounding box or time span and left it, in which case the
+    trip needs a refresh().
+    """
+    if old is not None and new is not None and all(old[f] == new[f] for f in STEP_FIELDS):
+        return {}
+    if old is not None:
+        current = Trip.objects.filter(id=trip_id).values(*_BOUNDS).first()
+        if current is None:
+            return {}
+        for field, (value, bound) in _BOUNDS.items():
+            if old[value] != current[field] or (new is not None and new[value] == old[value]):
+                continue
+            if new is None or (new[value] > old[value] if bound is Least else new[value] < old[value]):
+                return None
+    changes = {}
+    count = (new is not None) - (old is not None)
+    if count:
+        changes['step_count'] = F('step_count') + count
+    photos = (new['photo_count'] if new is not None else 0) - (old['photo_count'] if old is not None else 0)
+    if photos:
+        changes['photo_count'] = F('photo_count') + photos
+    distance = 0.0
+    moved = old is None or new is None or any(old[f] != new[f] for f in ('order', 'lat', 'lng'))
+    if old is not None and moved:
+        distance -= _legs_km(trip_id, step_id, old)
+    if new is not None:
+        if moved:
+            distance += _legs_km(trip_id, step_id, new)
+        for field, (value, bound) in _BOUNDS.items():
+            changes[field] = Coalesce(bound(F(field), Value(new[value])), Value(new[value]))
+    if distance:
+        changes['distance_km'] = F('distance_km') + distance
+    return changes
@@ -0,0 +1,92 @@
+"""Delta sync (GET /api/sync): the trips, steps and photos written since a token, and the deletions.
+
+Every Trip / Step / Photo write clears the row's `change_seq` and every delete leaves a
+Tombstone without one (models/sync.py). A sync first gives the next value of the global
+change sequence to all the committed rows without one (rows still locked by a running
+write are skipped, and sequenced by a later sync), so a sequence value only ever covers
+committed rows: the counter is a committed high-water mark. A sync token is such a value:
+changes(since) returns the rows sequenced after it, and the token to pass next time.
+
+Writers never wait for each other or for a sync; concurrent syncs take turns on the counter.
+
+This is why GET /api/sync writes. A value taken at write time would make writers queue on
+the counter for the length of their transactions; without that lock, a sync could return
+token N while a writer holding N-1 has yet to commit, and that change would never be
+reported. Only the reader knows which rows are committed. The writes are bookkeeping that
+no response shows: NULL change_seq values and the counter move forward, and nothing else is
+written (no revision, updated_at or cache change). A sync with nothing pending writes
+nothing, and repeating a request with the same token returns the same changes, so the
+endpoint stays safe to retry and to prefetch.
+"""
+from django.conf import settings
+from django.db import transaction
+from .models import Trip, Step, Photo, ChangeCounter, Tombstone
+from .serializers import photo_dict, step_dict, trip_dict
+
+
+class TokenExpired(Exception):
+    """The token predates pruned tombstones (or this database): the client must sync from 0."""
+
+
+def sequence() -> tuple[int, int]:
+    """Sequence the committed changes, SYNC_PAGE_MAX rows per value at most (so that pages
+    can be cut between them); returns the counter's (value, horizon)."""
+    with transaction.atomic():
+        counter, _ = ChangeCounter.objects.select_for_update().get_or_create(pk=1)
+        seq = counter.value
+        for model in (Trip, Step, Photo, Tombstone):
+            pending = list(
+                model.objects.filter(change_seq__isnull=True).select_for_update(skip_locked=True)
+                .order_by('id').values_list('id', flat=True)
+            )
+            for start in range(0, len(pending), settings.SYNC_PAGE_MAX):
+                seq += 1
+                model.objects.filter(id__in=pending[start:start + settings.SYNC_PAGE_MAX]).update(change_seq=seq)
+        if seq != counter.value:
+            ChangeCounter.objects.filter(pk=1).update(value=seq)
+            counter.value = seq
+    return counter.value, counter.horizon
+
+
+def _seqs(queryset, since: int, head: int, limit: int) -> list[int]:
+    return list(
+        queryset.filter(change_seq__gt=since, change_seq__lte=head)
+        .order_by('change_seq').values_list('change_seq', flat=True)[:limit + 1]
+    )
+
+
+def changes(since: int, limit: int | None = None) -> dict:
+    """Rows changed after `since` (at least `limit` of them when there are more: rows sharing
+    a sequence value, up to SYNC_PAGE_MAX, are never split across pages) and the next token.
+
+    since=0 is a full sync: every row, without tombstones. Raises TokenExpired.
+    """
+    limit = limit or settings.SYNC_PAGE_MAX
+    head, horizon = sequence()
+    if since > head or 0 < since < horizon:
+        raise TokenExpired(f"Token {since} has expired, sync again from 0")
+    ready_photos = Photo.objects.filter(status=Photo.STATUS_READY)
+    sources = [Trip.objects.all(), Step.objects.all(), ready_photos]
+    if since:
+        sources.append(Tombstone.objects.all())
+    found = [_seqs(queryset, since, head, limit) for queryset in sources]
+    seqs = sorted(seq for table in found for seq in table)
+    upper = head
+    if len(seqs) > limit and (seqs[-1] > seqs[limit - 1] or any(len(table) > limit for table in found)):
+        upper = seqs[limit - 1]
+    window = {'change_seq__gt': since, 'change_seq__lte': upper}
+    trips = Trip.objects.select_related('cover_photo').filter(**window).order_by('id')
+    steps = Step.objects.select_related('cover_photo').filter(**window).order_by('id')
+    photos = ready_photos.filter(**window).order_by('id')
+    deleted = {'trips': [], 'steps': [], 'photos': []}
+    if since:
+        for kind, object_id in Tombstone.objects.filter(**window).order_by('id').values_list('kind', 'object_id'):
+            deleted[f'{kind}s'].append(object_id)
+    return {
+        'token': upper,
+        'more': upper < head,
+        'trips': [trip_dict(trip, steps=False) for trip in trips],
+        'steps': [{**step_dict(step, photos=False), 'trip_id': step.trip_id} for step in steps],  # type: ignore[attr-defined]
+        'photos': [{**photo_dict(photo), 'step_id': photo.step_id} for photo in photos],  # type: ignore[attr-defined]
+        'deleted': deleted,
+    }
@@ -1,3 +1,1565 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from unittest import mock
+import mapbox_vector_tile
+import orjson
+from asgiref.sync import async_to_sync, sync_to_async
+from PIL import Image
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+from . import clustering, geo, mvt, query_budget, routes, search, stats
+from .cache import trip_cache
+from .geo import tile_xy
+from .models import Trip, Step, Photo, StepGridCell, ChangeCounter, Tombstone
+from .ordering import save_orders
+from .services import owncloud, upload_queue
+
+
+def dms(value: float) -> tuple[float, float, float]:
+    value = abs(value)
+    return float(int(value)), float(int(value * 60 % 60)), round(value * 3600 % 60, 2)
+
+
+def jpeg_bytes(width=2000, height=1000, taken_at=None, offset=None, lat=None, lng=None) -> bytes:
+    exif = Image.Exif()
+    if taken_at:
+        exif[0x8769] = {0x9003: taken_at, **({0x9011: offset} if offset else {})}
+    if lat is not None:
+        exif[0x8825] = {1: 'N' if lat >= 0 else 'S', 2: dms(lat), 3: 'E' if lng >= 0 else 'W', 4: dms(lng)}
+    out = BytesIO()
+    Image.new('RGB', (width, height), (200, 120, 40)).save(out, 'JPEG', exif=exif)
+    return out.getvalue()
+
+
+def make_trip(name='Trip', steps=2, photos=2):
+    trip = Trip.objects.create(name=name, description='')
+    for i in range(steps):
+        step = Step.objects.create(trip=trip, name=f'{name} step {i}', description='', lat=48.0 + i, lng=2.0 + i)
+        for j in range(photos):
+            photo = Photo.objects.create(step=step, name=f'photo {j}', url=f'https://cloud.example.com/s/{step.id}-{j}/download')  # type: ignore[attr-defined]
+            if j == 0:
+                step.cover_photo = photo
+                step.save(update_fields=['cover_photo'])
+    return trip
+
+
+class FakeOwnCloud(BaseHTTPRequestHandler):
+    """Local WebDAV / OCS stand-in: stores PUT bodies in `files` and shares every path.
+
+    Also implements Nextcloud chunking v2 on /remote.php/dav/uploads/ (`uploads` holds the chunks).
+    """
+    files: dict[str, bytes] = {}
+    uploads: dict[str, dict[str, bytes]] = {}
+    requests: list[tuple[str, str]] = []
+    # Number of upcoming PUT requests answered with 503
+    fail_next = 0
+    # Number of upcoming file PUT requests answered with 409 (parent directory deleted meanwhile)
+    conflict_next = 0
+    # Number of upcoming share (POST) requests answered with 503
+    share_fail_next = 0
+    # Body size of every PUT request
+    put_sizes: list[int] = []
+    # Seconds each PUT takes to answer (a slow link)
+    latency = 0.0
+    UPLOADS = '/remote.php/dav/uploads/'
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self) -> bytes:
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            data = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if not size:
+                    self.rfile.readline()
+                    return data
+                data += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _reply(self, status: int, body: bytes = b''):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _upload_dir(self) -> str:
+        return '/'.join(self.path.split('/')[:6])
+
+    def do_MKCOL(self):
+        self.requests.append(('MKCOL', self.path))
+        if self.path.startswith(self.UPLOADS):
+            self.uploads[self.path] = {}
+            return self._reply(201)
+        self._reply(405)
+
+    def do_PUT(self):
+        self.requests.append(('PUT', self.path))
+        time.sleep(self.latency)
+        body = self._body()
+        self.put_sizes.append(len(body))
+        if FakeOwnCloud.fail_next:
+            FakeOwnCloud.fail_next -= 1
+            return self._reply(503)
+        if self.path.startswith(self.UPLOADS):
+            if self._upload_dir() not in self.uploads:
+                return self._reply(404)
+            self.uploads[self._upload_dir()][self.path.rsplit('/', 1)[1]] = body
+            return self._reply(201)
+        if FakeOwnCloud.conflict_next:
+            FakeOwnCloud.conflict_next -= 1
+            return self._reply(409)
+        self.files[self.path] = body
+        self._reply(201)
+
+    def do_GET(self):
+        self.requests.append(('GET', self.path))
+        if self.path not in self.files:
+            return self._reply(404)
+        data = self.files[self.path]
+        if self.headers.get('Range', '').startswith('bytes=0-'):
+            end = int(self.headers['Range'][len('bytes=0-'):])
+            return self._reply(206, data[:end + 1])
+        self._reply(200, data)
+
+    def do_PROPFIND(self):
+        self.requests.append(('PROPFIND', self.path))
+        chunks = self.uploads.get(self.path)
+        if chunks is None:
+            return self._reply(404)
+        entries = ''.join(
+            f'<d:response><d:href>{self.path}/{name}</d:href><d:propstat><d:prop>'
+            f'<d:getcontentlength>{len(data)}</d:getcontentlength></d:prop></d:propstat></d:response>'
+            for name, data in chunks.items()
+        )
+        self._reply(207, f'<d:multistatus xmlns:d="DAV:"><d:response><d:href>{self.path}/</d:href></d:response>{entries}</d:multistatus>'.encode())
+
+    def do_MOVE(self):
+        self.requests.append(('MOVE', self.path))
+        chunks = self.uploads.pop(self._upload_dir(), None)
+        if chunks is None:
+            return self._reply(404)
+        destination = '/' + self.headers['Destination'].split('/', 3)[3]
+        self.files[destination] = b''.join(chunks[name] for name in sorted(chunks, key=int))
+        self._reply(201)
+
+    def do_DELETE(self):
+        self.requests.append(('DELETE', self.path))
+        found = self.uploads.pop(self.path, None) is not None or self.files.pop(self.path, None) is not None
+        self._reply(204 if found else 404)
+
+    def do_POST(self):
+        self.requests.append(('POST', self.path))
+        self._body()
+        if FakeOwnCloud.share_fail_next:
+            FakeOwnCloud.share_fail_next -= 1
+            return self._reply(503)
+        base = f'http://{self.server.server_address[0]}:{self.server.server_address[1]}'
+        token = f'token{len(self.requests)}'
+        self._reply(200, f'<ocs><data><token>{token}</token><url>{base}/s/{token}</url></data></ocs>'.encode())
+
+
+class FakeOwnCloudServer(ThreadingHTTPServer):
+    # Room for bursts of concurrent connections (the default backlog of 5 drops some)
+    request_queue_size = 64
+
+
+class OwnCloudMixin:
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeOwnCloudServer(('127.0.0.1', 0), FakeOwnCloud)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        host, port = cls.server.server_address[:2]
+        cls.settings_override = override_settings(
+            OWNCLOUD_BASE_URL=f'http://{host}:{port}', OWNCLOUD_USERNAME='user', OWNCLOUD_PASSWORD='secret',
+            PHOTO_VARIANTS_ENABLED=False, API_QUERY_BUDGET_STRICT=True,
+        )
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        FakeOwnCloud.files.clear()
+        FakeOwnCloud.uploads.clear()
+        FakeOwnCloud.requests.clear()
+        FakeOwnCloud.fail_next = 0
+        FakeOwnCloud.conflict_next = 0
+        FakeOwnCloud.share_fail_next = 0
+        FakeOwnCloud.put_sizes.clear()
+        FakeOwnCloud.latency = 0.0
+        # Fresh client per test: no pooled connection or known directory leaks between tests
+        owncloud._clients.clear()
+        owncloud._known_dirs.clear()
+
+
+class OwnCloudTestCase(OwnCloudMixin, TestCase):
+    pass
+
+
+@override_settings(API_QUERY_BUDGET_STRICT=True)
+class TripsTestCase(TestCase):
+    def setUp(self):
+        # Row ids are reused between tests once transactions are rolled back
+        trip_cache().clear()
+
+
+class ListTripsTests(TripsTestCase):
+    def test_steps_are_ordered_and_nested(self):
+        trip = make_trip(steps=3, photos=1)
+        response = self.client.get('/api/trips')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['id'], trip.id)  # type: ignore[attr-defined]
+        self.assertEqual([s['order'] for s in data[0]['steps']], [0, 1, 2])
+        self.assertEqual(len(data[0]['steps'][0]['photos']), 1)
+        self.assertIsNotNone(data[0]['steps'][0]['cover_photo'])
+
+    def test_query_count_is_flat(self):
+        make_trip('A')
+        with CaptureQueriesContext(connection) as small:
+            self.client.get('/api/trips')
+        for i in range(5):
+            make_trip(f'B{i}', steps=4, photos=3)
+        with CaptureQueriesContext(connection) as large:
+            self.client.get('/api/trips')
+        self.assertEqual(len(small), len(large))
+        # trip versions + trips, steps and photos of the cache misses
+        self.assertLessEqual(len(large), 4)
+
+    def test_cursor_pagination(self):
+        ids = [make_trip(f'T{i}', steps=1, photos=0).id for i in range(5)]  # type: ignore[attr-defined]
+        seen = []
+        cursor = None
+        while True:
+            url = '/api/trips?limit=2' + (f'&cursor={cursor}' if cursor else '')
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [t['id'] for t in response.json()]
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor:
+                break
+        self.assertEqual(seen, ids)
+
+    def test_expand(self):
+        make_trip(steps=2, photos=2)
+        summary = self.client.get('/api/trips?expand=').json()[0]
+        self.assertEqual(summary['steps'], [])
+        steps_only = self.client.get('/api/trips?expand=steps').json()[0]
+        self.assertEqual(len(steps_only['steps']), 2)
+        self.assertEqual(steps_only['steps'][0]['photos'], [])
+        self.assertEqual(self.client.get('/api/trips?expand=bogus').status_code, 400)
+
+
+class TripDetailTests(TripsTestCase):
+    def test_conditional_get(self):
+        trip = make_trip(steps=1, photos=1)
+        url = f'/api/trips/{trip.id}'  # type: ignore[attr-defined]
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['steps']), 1)
+        etag = response.headers['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(len(queries), 1)
+
+    def test_etag_changes_on_nested_writes(self):
+        trip = make_trip(steps=1, photos=1)
+        url = f'/api/trips/{trip.id}'  # type: ignore[attr-defined]
+        etag = self.client.get(url).headers['ETag']
+        step = trip.steps.first()  # type: ignore[attr-defined]
+        Photo.objects.create(step=step, name='new', url='https://cloud.example.com/s/new/download')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(len(response.json()['steps'][0]['photos']), 2)
+
+    def test_missing_trip(self):
+        self.assertEqual(self.client.get('/api/trips/999').status_code, 404)
+
+
+class QueryBudgetTests(TripsTestCase):
+    def test_counts_queries_of_async_views(self):
+        trip = make_trip(steps=2, photos=2)
+        with query_budget.measure() as usage:
+            self.client.get(f'/api/trips/{trip.id}')  # type: ignore[attr-defined]
+        self.assertGreater(usage.queries, 1)
+        with override_settings(API_QUERY_BUDGETS={'get_trip': 0}):
+            with self.assertRaises(query_budget.QueryBudgetExceeded):
+                self.client.get(f'/api/trips/{trip.id}')  # type: ignore[attr-defined]
+
+    def test_methods_of_a_path_have_their_own_budgets(self):
+        with override_settings(API_QUERY_BUDGETS={'list_trips': 0}):
+            response = self.client.post('/api/trips', {'id': 0, 'name': 'T', 'steps': []}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        with override_settings(API_QUERY_BUDGETS={'create_trip': 0}):
+            with self.assertRaisesMessage(query_budget.QueryBudgetExceeded, 'POST /api/trips (create_trip)'):
+                self.client.post('/api/trips', {'id': 0, 'name': 'T', 'steps': []}, content_type='application/json')
+
+    @override_settings(API_QUERY_BUDGET_STRICT=False, API_QUERY_BUDGET_HEADERS=True, API_QUERY_BUDGETS={'photo_status': 0})
+    def test_breach_is_logged(self):
+        photo = Photo.objects.create(step=make_trip(steps=1, photos=0).steps.first(), name='p', url='u')  # type: ignore[attr-defined]
+        with self.assertLogs('trips.query_budget', 'WARNING') as logs:
+            response = self.client.get(f'/api/photos/{photo.id}/status')  # type: ignore[attr-defined]
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('(photo_status) ran 1 queries (budget 0)', logs.output[0])
+        self.assertIn('desc="1 queries"', response.headers['Server-Timing'])
+
+
+class TripCacheTests(TripsTestCase):
+    def test_cached_payload_skips_serialization(self):
+        make_trip(steps=2, photos=2)
+        first = self.client.get('/api/trips').json()
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get('/api/trips').json()
+        self.assertEqual(first, second)
+        self.assertEqual(len(queries), 1)
+
+    def test_writes_invalidate(self):
+        trip = make_trip(steps=1, photos=1)
+        self.client.get('/api/trips')
+        step = trip.steps.first()  # type: ignore[attr-defined]
+        step.name = 'Renamed'
+        step.save()
+        self.assertEqual(self.client.get('/api/trips').json()[0]['steps'][0]['name'], 'Renamed')
+        step.photos.first().delete()
+        self.assertEqual(self.client.get('/api/trips').json()[0]['steps'][0]['photos'], [])
+        trip.name = 'Other'
+        trip.save()
+        self.assertEqual(self.client.get(f'/api/trips/{trip.id}').json()['name'], 'Other')  # type: ignore[attr-defined]
+
+    def test_stale_entry_is_ignored(self):
+        trip = make_trip(steps=1, photos=0)
+        self.client.get('/api/trips')
+        # Bulk writes skip signals; touch() alone must be enough for readers to see them
+        Step.objects.filter(trip=trip).update(name='Bulk')
+        Trip.objects.filter(id=trip.id).touch()  # type: ignore[attr-defined]
+        self.assertEqual(self.client.get('/api/trips').json()[0]['steps'][0]['name'], 'Bulk')
+
+
+class StepsBboxTests(TripsTestCase):
+    def test_only_visible_steps(self):
+        trip = make_trip(steps=3, photos=1)  # steps at (48, 2), (49, 3), (50, 4)
+        response = self.client.get('/api/steps?bbox=1.5,47.5,3.5,49.5')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([s['order'] for s in data], [0, 1])
+        self.assertEqual(data[0]['trip_id'], trip.id)  # type: ignore[attr-defined]
+        self.assertIsNotNone(data[0]['cover_photo'])
+
+    def test_antimeridian_and_validation(self):
+        trip = Trip.objects.create(name='Pacific', description='')
+        Step.objects.create(trip=trip, name='Fiji', description='', lat=-17.7, lng=178.0)
+        Step.objects.create(trip=trip, name='Samoa', description='', lat=-13.8, lng=-172.1)
+        Step.objects.create(trip=trip, name='Paris', description='', lat=48.8, lng=2.3)
+        data = self.client.get('/api/steps?bbox=170,-20,-170,-10').json()
+        self.assertEqual({s['name'] for s in data}, {'Fiji', 'Samoa'})
+        self.assertEqual(self.client.get('/api/steps?bbox=1,2,3').status_code, 400)
+
+
+class ClusterTests(TripsTestCase):
+    def grid_totals(self):
+        totals = {}
+        for level, count in StepGridCell.objects.values_list('level', 'count'):
+            totals[level] = totals.get(level, 0) + count
+        return totals
+
+    def test_zoomed_out_clusters(self):
+        make_trip(steps=3, photos=1)  # steps at (48, 2), (49, 3), (50, 4)
+        data = self.client.get('/api/clusters?bbox=-180,-85,180,85&zoom=0').json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['count'], 3)
+        self.assertAlmostEqual(data[0]['lat'], 49.0)
+        self.assertIsNotNone(data[0]['cover_photo'])
+        data = self.client.get('/api/clusters?bbox=-180,-85,180,85&zoom=10').json()
+        self.assertEqual(sorted(c['count'] for c in data), [1, 1, 1])
+        self.assertEqual(self.grid_totals(), {level: 3 for level in range(clustering.MAX_LEVEL + 1)})
+
+    def test_incremental_updates_match_rebuild(self):
+        trip = make_trip(steps=3, photos=1)
+        step = trip.steps.first()  # type: ignore[attr-defined]
+        step.lat, step.lng = -33.9, 18.4
+        step.save()
+        trip.steps.last().delete()  # type: ignore[attr-defined]
+        incremental = set(StepGridCell.objects.values_list('level', 'x', 'y', 'count'))
+        clustering.rebuild()
+        self.assertEqual(incremental, set(StepGridCell.objects.values_list('level', 'x', 'y', 'count')))
+        data = self.client.get('/api/clusters?bbox=10,-40,30,-30&zoom=3').json()
+        self.assertEqual([c['count'] for c in data], [1])
+
+
+class RouteTests(TripsTestCase):
+    def test_douglas_peucker(self):
+        line = [(0.0, 0.0), (1.0, 0.01), (2.0, 0.0), (3.0, 5.0), (4.0, 6.0)]
+        self.assertEqual(routes.douglas_peucker(line, 0.1), [(0.0, 0.0), (2.0, 0.0), (3.0, 5.0), (4.0, 6.0)])
+        self.assertEqual(routes.douglas_peucker(line, 10), [(0.0, 0.0), (4.0, 6.0)])
+
+    def test_route_geojson_is_simplified_per_zoom(self):
+        trip = Trip.objects.create(name='Line', description='')
+        for i in range(5):
+            Step.objects.create(trip=trip, name=f'S{i}', description='', lat=10.0 + i * 0.01, lng=20.0 + (0.001 if i % 2 else 0))
+        url = f'/api/trips/{trip.id}/route'  # type: ignore[attr-defined]
+        full = self.client.get(url).json()
+        self.assertEqual(len(full['features'][0]['geometry']['coordinates']), 5)
+        self.assertEqual(len(full['features']), 6)
+        response = self.client.get(url + '?zoom=3')
+        self.assertEqual(len(response.json()['features'][0]['geometry']['coordinates']), 2)
+        self.assertEqual(self.client.get(url + '?zoom=3', HTTP_IF_NONE_MATCH=response.headers['ETag']).status_code, 304)
+
+    def decode_tile(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        return response, mapbox_vector_tile.decode(response.content, default_options={'y_coord_down': True})
+
+    def test_vector_tile(self):
+        trip = make_trip(steps=3, photos=1)  # steps at (48, 2), (49, 3), (50, 4)
+        middle = trip.steps.get(order=1)  # type: ignore[attr-defined]
+        x, y = tile_xy(49.0, 3.0, 8)
+        url = f'/api/tiles/8/{x}/{y}.mvt'
+        response, tile = self.decode_tile(url)
+        self.assertEqual(set(tile), {'routes', 'steps'})
+        # Only the step over the tile, and the part of the route crossing it
+        self.assertEqual([f['properties']['id'] for f in tile['steps']['features']], [middle.id])  # type: ignore[attr-defined]
+        self.assertEqual(tile['steps']['features'][0]['properties']['cover_url'], middle.cover_photo.url)
+        [route] = tile['routes']['features']
+        self.assertEqual((route['id'], route['properties']['name']), (trip.id, trip.name))  # type: ignore[attr-defined]
+        coordinates = route['geometry']['coordinates']
+        points = [point for line in coordinates for point in line] if route['geometry']['type'] == 'MultiLineString' else coordinates
+        low, high = -routes.TILE_BUFFER, mvt.EXTENT + routes.TILE_BUFFER
+        self.assertTrue(all(low <= px <= high and low <= py <= high for px, py in points), points)
+        # Both ends of the route are far outside: the line is cut at the edges of the buffer
+        self.assertTrue(all({low, high} & {px, py} for px, py in (points[0], points[-1])), points)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).content, response.content)
+        self.assertEqual(len(queries), 1)
+        middle.name = 'Renamed'
+        middle.save()
+        self.assertEqual(self.decode_tile(url)[1]['steps']['features'][0]['properties']['name'], 'Renamed')
+        # Unrelated trips elsewhere leave the tile (and its cache entry) alone
+        Step.objects.create(trip=make_trip('Far', steps=0, photos=0), name='Far', description='', lat=-30.0, lng=150.0)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.client.get('/api/tiles/1/2/0.mvt').status_code, 400)
+
+    @override_settings(TILE_MAX_STEPS=2)
+    def test_crowded_tile_has_clusters(self):
+        make_trip(steps=3, photos=1)
+        _, tile = self.decode_tile('/api/tiles/0/0/0.mvt')
+        self.assertEqual(set(tile), {'routes', 'clusters'})
+        self.assertEqual(sum(f['properties']['count'] for f in tile['clusters']['features']), 3)
+        self.assertTrue(all(f['properties']['cover_url'] for f in tile['clusters']['features']))
+        x, y = tile_xy(49.0, 3.0, 8)
+        _, tile = self.decode_tile(f'/api/tiles/8/{x}/{y}.mvt')
+        self.assertEqual(len(tile['steps']['features']), 1)
+
+    def test_routes_are_clipped_to_the_tile(self):
+        self.assertEqual(routes.clip_line([(-1000, 100), (5000, 100)], -64, 4160), [[(-64, 100), (4160, 100)]])
+        # Leaves the tile and comes back: two lines
+        self.assertEqual(
+            routes.clip_line([(0, 0), (100, 0), (100, 9000), (200, 9000), (200, 100), (300, 100)], -64, 4160),
+            [[(0, 0), (100, 0), (100, 4160)], [(200, 4160), (200, 100), (300, 100)]],
+        )
+        self.assertEqual(routes.clip_line([(-500, -500), (-100, -5000)], -64, 4160), [])
+        # A long route crossing a high zoom tile without a step in it: just the crossing segment
+        trip = Trip.objects.create(name='Long', description='')
+        for i in range(50):
+            Step.objects.create(trip=trip, name=f'S{i}', description='', lat=45.0 + i % 2 * 0.01, lng=i * 0.1)
+        x, y = tile_xy(45.005, 2.55, 14)
+        tile = routes.render_tile(14, x, y)
+        self.assertIn(b'routes', tile)
+        self.assertNotIn(b'steps', tile)
+        whole = mvt.encode_layer('routes', [{'id': 1, 'type': mvt.LINESTRING, 'points': [(i * 100, i % 2) for i in range(50)]}])
+        self.assertLess(len(tile), len(whole) / 2)
+
+
+class StreamingReader:
+    """File-like object failing on whole-file reads."""
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def read(self, size=-1):
+        assert size is not None and size > 0, 'read() of the whole file'
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return chunk
+
+
+class UploadTests(OwnCloudTestCase):
+    def test_steady_state_upload_is_put_and_share(self):
+        owncloud.upload_file(b'first', 'a.jpg')
+        FakeOwnCloud.requests.clear()
+        owncloud.upload_file(b'second', 'b.jpg')
+        self.assertEqual([method for method, _ in FakeOwnCloud.requests], ['PUT', 'POST'])
+
+    @override_settings(OWNCLOUD_RETRY_BACKOFF=0)
+    def test_retries_server_errors(self):
+        FakeOwnCloud.fail_next = 2
+        owncloud.upload_file(b'data', 'a.jpg')
+        self.assertEqual(list(FakeOwnCloud.files.values()), [b'data'])
+
+    def test_put_retried_after_vanished_directory_sends_the_whole_file(self):
+        data = b'x' * 5000
+        FakeOwnCloud.conflict_next = 1
+        owncloud.upload_file(BytesIO(data), 'a.jpg')
+        self.assertEqual(FakeOwnCloud.put_sizes, [5000, 5000])
+        self.assertEqual(list(FakeOwnCloud.files.values()), [data])
+
+    @override_settings(OWNCLOUD_RETRY_BACKOFF=0)
+    def test_share_creation_is_not_retried(self):
+        FakeOwnCloud.share_fail_next = 1
+        share_url, direct_url = owncloud.upload_file(b'data', 'a.jpg')
+        self.assertEqual([method for method, _ in FakeOwnCloud.requests].count('POST'), 1)
+        self.assertEqual(share_url, direct_url)  # No share: the WebDAV URL is used
+
+    def test_streams_file_objects_and_iterators(self):
+        data = bytes(range(256)) * 4096  # 1 MiB
+        share_url, direct_url = owncloud.upload_file(StreamingReader(data), 'a.jpg')
+        self.assertTrue(direct_url.endswith('/download'))
+        self.assertEqual(list(FakeOwnCloud.files.values()), [data])
+        FakeOwnCloud.files.clear()
+        owncloud.upload_file(iter([data[:1000], data[1000:]]), 'b.jpg')
+        self.assertEqual(list(FakeOwnCloud.files.values()), [data])
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_upload_endpoint(self):
+        step = make_trip(steps=1, photos=0).steps.first()  # type: ignore[attr-defined]
+        content = b'\xff\xd8' + b'x' * 4096
+        response = self.client.post(
+            f'/api/trips/{step.trip_id}/steps/{step.id}/photos/upload',
+            {'file': SimpleUploadedFile('big.jpg', content, content_type='image/jpeg'), 'description': 'd'},
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(list(FakeOwnCloud.files.values()), [content])
+        photo = Photo.objects.get(id=response.json()['id'])
+        self.assertEqual(photo.name, 'big.jpg')
+        self.assertTrue(photo.url.endswith('/download'))
+
+    @override_settings(OWNCLOUD_RETRY_BACKOFF=0)
+    def test_async_client_streams_and_retries(self):
+        data = bytes(range(256)) * 4096 + b'tail'
+        FakeOwnCloud.fail_next = 1
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            f.seek(0)
+            share_url, direct_url = async_to_sync(owncloud.aupload_file)(f, 'a.jpg')
+        self.assertTrue(direct_url.endswith('/download'))
+        self.assertEqual(list(FakeOwnCloud.files.values()), [data])
+        self.assertEqual([method for method, _ in FakeOwnCloud.requests], ['MKCOL', 'MKCOL', 'PUT', 'PUT', 'POST'])
+
+    def test_async_put_retried_after_vanished_directory_sends_the_whole_file(self):
+        data = b'x' * 5000
+        FakeOwnCloud.conflict_next = 1
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            f.seek(0)
+            async_to_sync(owncloud.aupload_file)(f, 'a.jpg')
+        self.assertEqual(FakeOwnCloud.put_sizes, [5000, 5000])
+        self.assertEqual(list(FakeOwnCloud.files.values()), [data])
+
+    @override_settings(OWNCLOUD_RETRY_BACKOFF=0)
+    def test_async_share_creation_is_not_retried(self):
+        FakeOwnCloud.share_fail_next = 1
+        async_to_sync(owncloud.aupload_file)(b'data', 'a.jpg')
+        self.assertEqual([method for method, _ in FakeOwnCloud.requests].count('POST'), 1)
+
+    def test_async_client_shares_directories_and_closes_with_its_loop(self):
+        owncloud.upload_file(b'first', 'a.jpg')
+        FakeOwnCloud.requests.clear()
+
+        async def upload():
+            await owncloud.aupload_file(b'second', 'b.jpg')
+            return await owncloud.get_async_client()
+
+        client = async_to_sync(upload)()
+        self.assertEqual([method for method, _ in FakeOwnCloud.requests], ['PUT', 'POST'])
+        self.assertTrue(client.client.is_closed)
+
+    def test_wsgi_uploads_use_the_pooled_client(self):
+        """Async views served by WSGI run on a new event loop per request: no per-request client."""
+        step = make_trip(steps=1, photos=0).steps.first()  # type: ignore[attr-defined]
+        url = f'/api/trips/{step.trip_id}/steps/{step.id}/photos/upload'
+        self.client.post(url, {'file': SimpleUploadedFile('a.jpg', b'first', content_type='image/jpeg')})
+        FakeOwnCloud.requests.clear()
+        response = self.client.post(url, {'file': SimpleUploadedFile('b.jpg', b'second', content_type='image/jpeg')})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([method for method, _ in FakeOwnCloud.requests], ['PUT', 'POST'])
+
+    async def test_async_uploads_overlap(self):
+        """Uploads served by the async view wait on ownCloud concurrently, not one after the other."""
+        FakeOwnCloud.latency = 0.3
+        trip = await sync_to_async(make_trip)(steps=1, photos=0)
+        step = await trip.steps.afirst()
+        url = f'/api/trips/{trip.id}/steps/{step.id}/photos/upload'
+
+        async def post(i):
+            return await self.async_client.post(url, {'file': SimpleUploadedFile(f'{i}.jpg', bytes([i]) * 100, content_type='image/jpeg')})
+
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(post(i) for i in range(8)))
+        elapsed = time.perf_counter() - start
+        self.assertEqual([r.status_code for r in responses], [200] * 8)
+        self.assertEqual(await step.photos.acount(), 8)
+        self.assertLess(elapsed, 8 * FakeOwnCloud.latency / 2)
+
+
+class ChunkedUploadTests(OwnCloudTestCase):
+    def test_resumable_upload(self):
+        step = make_trip(steps=1, photos=0).steps.first()  # type: ignore[attr-defined]
+        content = bytes(range(256)) * 100
+        parts = [content[:10000], content[10000:20000], content[20000:]]
+        response = self.client.post(
+            f'/api/trips/{step.trip_id}/steps/{step.id}/uploads',
+            {'filename': 'hike.jpg', 'description': 'summit', 'size': len(content)}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        url = f"/api/uploads/{response.json()['id']}"
+        # Chunks may arrive out of order and be re-sent after a dropped connection
+        for number in (3, 1, 3):
+            response = self.client.put(f'{url}/chunks/{number}', parts[number - 1], content_type='application/octet-stream')
+            self.assertEqual(response.status_code, 204, response.content)
+        status = self.client.get(url).json()
+        self.assertEqual(status['chunks'], [1, 3])
+        self.assertEqual(status['received'], len(parts[0]) + len(parts[2]))
+        self.client.put(f'{url}/chunks/2', parts[1], content_type='application/octet-stream')
+        response = self.client.post(f'{url}/complete')
+        self.assertEqual(response.status_code, 200, response.content)
+        photo = Photo.objects.get(id=response.json()['id'])
+        self.assertEqual((photo.name, photo.description, photo.step_id), ('hike.jpg', 'summit', step.id))  # type: ignore[attr-defined]
+        self.assertEqual(list(FakeOwnCloud.files.values()), [content])
+        self.assertEqual(self.client.get(url).json()['status'], 'complete')
+        self.assertEqual(self.client.put(f'{url}/chunks/1', b'x', content_type='application/octet-stream').status_code, 409)
+
+    def chunked_upload(self, step, content: bytes, filename='photo.jpg'):
+        response = self.client.post(
+            f'/api/trips/{step.trip_id}/steps/{step.id}/uploads', {'filename': filename, 'size': len(content)}, content_type='application/json',
+        )
+        url = f"/api/uploads/{response.json()['id']}"
+        middle = len(content) // 2
+        for number, part in ((2, content[middle:]), (1, content[:middle])):
+            self.client.put(f'{url}/chunks/{number}', part, content_type='application/octet-stream')
+        response = self.client.post(f'{url}/complete')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_processed_like_single_uploads(self):
+        trip = make_trip(steps=2, photos=0)
+        step, other_step = trip.steps.order_by('order')  # type: ignore[attr-defined]
+        content = jpeg_bytes(taken_at='2024:05:01 10:00:00', lat=45.5, lng=6.25)
+        first = self.chunked_upload(step, content)
+        photo = Photo.objects.get(id=first['id'])
+        self.assertEqual(photo.content_hash, hashlib.sha256(content).hexdigest())
+        self.assertEqual((photo.lat, photo.lng, photo.taken_at is not None), (45.5, 6.25, True))
+        # The same file again, on the same step: the existing photo; on another: the same remote file
+        again = self.chunked_upload(step, content, 'copy.jpg')
+        self.assertEqual((again['id'], again['duplicate_of']), (first['id'], first['id']))
+        moved = self.chunked_upload(other_step, content, 'copy.jpg')
+        self.assertEqual(moved['duplicate_of'], first['id'])
+        self.assertEqual(Photo.objects.get(id=moved['id']).url, photo.url)
+        # The copies assembled on ownCloud were deleted
+        self.assertEqual(list(FakeOwnCloud.files.values()), [content])
+        self.assertEqual(Step.objects.get(id=step.id).photo_count, 1)  # type: ignore[attr-defined]
+
+    def test_abort(self):
+        step = make_trip(steps=1, photos=0).steps.first()  # type: ignore[attr-defined]
+        response = self.client.post(
+            f'/api/trips/{step.trip_id}/steps/{step.id}/uploads', {'filename': 'a.jpg'}, content_type='application/json',
+        )
+        url = f"/api/uploads/{response.json()['id']}"
+        self.client.put(f'{url}/chunks/1', b'data', content_type='application/octet-stream')
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(FakeOwnCloud.uploads, {})
+        self.assertEqual(self.client.post(f'{url}/complete').status_code, 409)
+
+
+class DeferredUploadTests(OwnCloudTestCase):
+    def setUp(self):
+        super().setUp()
+        self.spool = tempfile.TemporaryDirectory()
+        self.addCleanup(self.spool.cleanup)
+        spool_settings = override_settings(UPLOAD_SPOOL_DIR=self.spool.name, OWNCLOUD_RETRY_BACKOFF=0)
+        spool_settings.enable()
+        self.addCleanup(spool_settings.disable)
+
+    def post(self, step, content=b'jpeg'):
+        return self.client.post(
+            f'/api/trips/{step.trip_id}/steps/{step.id}/photos/upload-async',
+            {'file': SimpleUploadedFile('img.jpg', content, content_type='image/jpeg')},
+        )
+
+    def test_accept_then_process(self):
+        step = make_trip(steps=1, photos=0).steps.first()  # type: ignore[attr-defined]
+        response = self.post(step)
+        self.assertEqual(response.status_code, 202, response.content)
+        photo_id = response.json()['id']
+        self.assertEqual(response.json()['status'], 'pending')
+        self.assertEqual(FakeOwnCloud.files, {})
+        self.assertEqual(self.client.get('/api/trips').json()[0]['steps'][0]['photos'], [])
+
+        self.assertEqual(upload_queue.claim(10), [photo_id])
+        self.assertEqual(upload_queue.claim(10), [])
+        self.assertTrue(upload_queue.process(photo_id))
+        status = self.client.get(f'/api/photos/{photo_id}/status').json()
+        self.assertEqual(status['status'], 'ready')
+        self.assertTrue(status['url'].endswith('/download'))
+        self.assertEqual(list(FakeOwnCloud.files.values()), [b'jpeg'])
+        self.assertEqual(os.listdir(self.spool.name), [])
+        self.assertEqual(len(self.client.get('/api/trips').json()[0]['steps'][0]['photos']), 1)
+
+    @override_settings(UPLOAD_MAX_ATTEMPTS=2)
+    def test_failures_are_retried_then_marked_failed(self):
+        step = make_trip(steps=1, photos=0).steps.first()  # type: ignore[attr-defined]
+        photo_id = self.post(step).json()['id']
+        FakeOwnCloud.fail_next = 100
+        for expected in ('pending', 'failed'):
+            upload_queue.claim(1)
+            with self.assertLogs('trips.services.upload_queue', 'WARNING'):
+                self.assertFalse(upload_queue.process(photo_id))
+            self.assertEqual(Photo.objects.get(id=photo_id).status, expected)
+
+
+class ProcessUploadsCommandTests(OwnCloudMixin, TransactionTestCase):
+    def test_worker_pool_drains_queue(self):
+        with tempfile.TemporaryDirectory() as spool, override_settings(UPLOAD_SPOOL_DIR=spool):
+            step = make_trip(steps=1, photos=0).steps.first()  # type: ignore[attr-defined]
+            for i in range(5):
+                upload_queue.spool_photo(step, SimpleUploadedFile(f'{i}.jpg', b'x' * i), f'{i}.jpg', None)
+            call_command('process_uploads', '--once', '--workers', '3', stdout=open(os.devnull, 'w'))
+        self.assertEqual(set(Photo.objects.values_list('status', flat=True)), {'ready'})
+        self.assertEqual(len(FakeOwnCloud.files), 5)
+
+    def test_crash_of_one_photo_is_retried(self):
+        upload = upload_queue.upload_file
+        calls = []
+
+        def crash_once(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise RuntimeError('boom')
+            return upload(*args)
+
+        with tempfile.TemporaryDirectory() as spool, override_settings(UPLOAD_SPOOL_DIR=spool), \
+                mock.patch.object(upload_queue, 'upload_file', crash_once):
+            step = make_trip(steps=1, photos=0).steps.first()  # type: ignore[attr-defined]
+            for i in range(3):
+                upload_queue.spool_photo(step, SimpleUploadedFile(f'{i}.jpg', b'x' * i), f'{i}.jpg', None)
+            with self.assertLogs('trips.services.upload_queue', 'ERROR'):
+                call_command('process_uploads', '--once', '--workers', '3', stdout=open(os.devnull, 'w'))
+        self.assertEqual(set(Photo.objects.values_list('status', flat=True)), {'ready'})
+        self.assertEqual(sorted(Photo.objects.values_list('attempts', flat=True)), [0, 0, 1])
+        self.assertEqual(len(FakeOwnCloud.files), 3)
+
+
+class BatchUploadTests(OwnCloudTestCase):
+    @override_settings(OWNCLOUD_RETRIES=0)
+    def test_partial_failure(self):
+        step = make_trip(steps=1, photos=0).steps.first()  # type: ignore[attr-defined]
+        FakeOwnCloud.fail_next = 1
+        files = [SimpleUploadedFile(f'{i}.jpg', bytes([i]) * 10, content_type='image/jpeg') for i in range(4)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f'/api/trips/{step.trip_id}/steps/{step.id}/photos/batch', {'files': files})
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        self.assertEqual((data['created'], data['failed']), (3, 1))
+        self.assertEqual([r['filename'] for r in data['results']], ['0.jpg', '1.jpg', '2.jpg', '3.jpg'])
+        self.assertEqual(sum(not r['ok'] for r in data['results']), 1)
+        self.assertEqual(step.photos.count(), 3)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('INSERT')]), 1)
+        self.assertEqual(len(self.client.get(f'/api/trips/{step.trip_id}').json()['steps'][0]['photos']), 3)
+
+
+class PhotoVariantTests(OwnCloudTestCase):
+    def setUp(self):
+        super().setUp()
+        variants_enabled = override_settings(PHOTO_VARIANTS_ENABLED=True)
+        variants_enabled.enable()
+        self.addCleanup(variants_enabled.disable)
+
+    def test_variants_generated_on_upload(self):
+        step = make_trip(steps=1, photos=0).steps.first()  # type: ignore[attr-defined]
+        response = self.client.post(
+            f'/api/trips/{step.trip_id}/steps/{step.id}/photos/upload',
+            {'file': SimpleUploadedFile('wide.jpg', jpeg_bytes(), content_type='image/jpeg')},
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        self.assertEqual((data['width'], data['height']), (2000, 1000))
+        self.assertEqual({k: (v['width'], v['height']) for k, v in data['variants'].items()}, {
+            'thumbnail': (256, 128), 'medium': (1280, 640),
+        })
+        self.assertEqual(len(FakeOwnCloud.files), 3)
+        sizes = sorted(Image.open(BytesIO(data)).size for path, data in FakeOwnCloud.files.items() if path.endswith('.webp'))
+        self.assertEqual(sizes, [(256, 128), (1280, 640)])
+        photos = self.client.get(f'/api/trips/{step.trip_id}').json()['steps'][0]['photos']
+        self.assertEqual(photos[0]['variants']['thumbnail']['url'], data['variants']['thumbnail']['url'])
+
+    def test_backfill_command(self):
+        step = make_trip(steps=1, photos=0).steps.first()  # type: ignore[attr-defined]
+        base = owncloud.get_client().webdav_url
+        FakeOwnCloud.files['/remote.php/dav/files/user/old.jpg'] = jpeg_bytes(600, 900)
+        photo = Photo.objects.create(step=step, name='old.jpg', url=f'{base}/old.jpg')
+        broken = Photo.objects.create(step=step, name='gone.jpg', url=f'{base}/gone.jpg')
+        with self.assertLogs('trips.services.derivatives', 'WARNING'):
+            call_command('generate_photo_variants', '--workers', '2', stdout=open(os.devnull, 'w'))
+        photo.refresh_from_db()
+        broken.refresh_from_db()
+        self.assertEqual((photo.width, photo.height), (600, 900))
+        self.assertEqual(photo.variants['thumbnail']['height'], 256)
+        self.assertEqual(broken.variants, {})
+
+
+class PhotoExifTests(OwnCloudTestCase):
+    def upload(self, step, data: bytes, name='photo.jpg'):
+        return self.client.post(
+            f'/api/trips/{step.trip_id}/steps/{step.id}/photos/upload',
+            {'file': SimpleUploadedFile(name, data, content_type='image/jpeg')},
+        )
+
+    def test_upload_reads_exif(self):
+        step = make_trip(steps=1, photos=0).steps.first()  # type: ignore[attr-defined]
+        response = self.upload(step, jpeg_bytes(300, 200, taken_at='2024:05:01 10:30:00', offset='+02:00', lat=-33.8679, lng=151.21))
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        self.assertEqual(data['taken_at'], '2024-05-01T08:30:00+00:00')
+        self.assertAlmostEqual(data['lat'], -33.8679, places=3)
+        self.assertAlmostEqual(data['lng'], 151.21, places=3)
+        self.assertEqual(data['orientation'], 1)
+
+    def test_upload_without_exif(self):
+        step = make_trip(steps=1, photos=0).steps.first()  # type: ignore[attr-defined]
+        data = self.upload(step, b'not an image', name='notes.txt').json()
+        self.assertEqual((data['taken_at'], data['lat'], data['orientation']), (None, None, None))
+        data = self.upload(step, jpeg_bytes(30, 20, taken_at='2024:05:01 10:30:00')).json()
+        self.assertEqual(data['taken_at'], '2024-05-01T10:30:00+00:00')  # no offset: TIME_ZONE
+        self.assertIsNone(data['lat'])
+
+    def test_derive_step(self):
+        step = make_trip(steps=1, photos=0).steps.first()  # type: ignore[attr-defined]
+        noon = datetime(2024, 5, 2, 12, tzinfo=dt_timezone.utc)
+        Step.objects.filter(id=step.id).update(lat=48.85, lng=2.35, started_at=noon, ended_at=noon)
+        step.refresh_from_db()
+        for day, lat in ((1, 45.76), (3, 45.77), (2, 45.75)):
+            Photo.objects.create(
+                step=step, name=f'p{day}', url='http://example.com/p.jpg',
+                taken_at=datetime(2024, 5, day, 12, tzinfo=dt_timezone.utc), lat=lat, lng=4.83,
+            )
+        url = f'/api/trips/{step.trip_id}/steps/{step.id}/derive-from-photos'
+        data = self.client.post(url).json()
+        self.assertEqual((data['photos'], data['located'], data['applied']), (3, 3, False))
+        self.assertEqual(len(data['issues']), 3)  # too far, photos before the start and after the end
+        self.assertEqual((data['lat'], data['lng']), (45.76, 4.83))
+        data = self.client.post(url + '?apply=true').json()
+        self.assertTrue(data['applied'])
+        step.refresh_from_db()
+        self.assertEqual((step.lat, step.lng), (45.76, 4.83))
+        self.assertEqual((step.started_at.day, step.ended_at.day), (1, 3))
+        self.assertEqual(self.client.post(url).json()['issues'], [])
+
+    def test_backfill_command(self):
+        step = make_trip(steps=1, photos=0).steps.first()  # type: ignore[attr-defined]
+        base = owncloud.get_client().webdav_url
+        FakeOwnCloud.files['/remote.php/dav/files/user/old.jpg'] = jpeg_bytes(2000, 1500, taken_at='2023:07:14 09:00:00', lat=40.0, lng=-3.5)
+        photo = Photo.objects.create(step=step, name='old.jpg', url=f'{base}/old.jpg')
+        call_command('extract_photo_exif', '--workers', '2', '--derive-steps', stdout=open(os.devnull, 'w'))
+        photo.refresh_from_db()
+        step.refresh_from_db()
+        self.assertEqual((photo.taken_at.year, photo.orientation), (2023, 1))
+        self.assertEqual((step.lat, step.lng), (photo.lat, photo.lng))
+        self.assertAlmostEqual(photo.lng, -3.5)
+
+    def test_backfill_skips_photos_already_read(self):
+        step = make_trip(steps=1, photos=0).steps.first()  # type: ignore[attr-defined]
+        base = owncloud.get_client().webdav_url
+        FakeOwnCloud.files['/remote.php/dav/files/user/clip.mov'] = b'not an image'
+        photo = Photo.objects.create(step=step, name='clip.mov', url=f'{base}/clip.mov')
+        call_command('extract_photo_exif', stdout=open(os.devnull, 'w'))
+        photo.refresh_from_db()
+        self.assertEqual((photo.exif_checked, photo.orientation), (True, None))
+        FakeOwnCloud.requests.clear()
+        call_command('extract_photo_exif', stdout=open(os.devnull, 'w'))
+        self.assertEqual(FakeOwnCloud.requests, [])
+
+
+class DedupTests(OwnCloudTestCase):
+    def upload(self, step, data: bytes, name='photo.jpg'):
+        response = self.client.post(
+            f'/api/trips/{step.trip_id}/steps/{step.id}/photos/upload',
+            {'file': SimpleUploadedFile(name, data, content_type='image/jpeg')},
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_reupload_reuses_remote_file(self):
+        first_step, second_step = make_trip(steps=2, photos=0).steps.order_by('order')  # type: ignore[attr-defined]
+        first = self.upload(first_step, b'same bytes')
+        self.assertIsNone(first['duplicate_of'])
+        again = self.upload(first_step, b'same bytes', name='copy.jpg')
+        self.assertEqual((again['id'], again['duplicate_of']), (first['id'], first['id']))
+        elsewhere = self.upload(second_step, b'same bytes')
+        self.assertNotEqual(elsewhere['id'], first['id'])
+        self.assertEqual((elsewhere['url'], elsewhere['duplicate_of']), (first['url'], first['id']))
+        self.assertEqual(len(FakeOwnCloud.files), 1)
+        self.assertEqual(Photo.objects.get(id=first['id']).content_hash, hashlib.sha256(b'same bytes').hexdigest())
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_hash_of_file_spooled_to_disk(self):
+        step = make_trip(steps=1, photos=0).steps.first()  # type: ignore[attr-defined]
+        data = os.urandom(5000)
+        photo = self.upload(step, data)
+        self.assertEqual(Photo.objects.get(id=photo['id']).content_hash, hashlib.sha256(data).hexdigest())
+
+    def test_batch_deduplicates(self):
+        step = make_trip(steps=1, photos=0).steps.first()  # type: ignore[attr-defined]
+        existing = self.upload(step, b'known')
+        files = [SimpleUploadedFile(name, data, content_type='image/jpeg') for name, data in (
+            ('a.jpg', b'new'), ('b.jpg', b'known'), ('c.jpg', b'new'), ('d.jpg', b'other'),
+        )]
+        data = self.client.post(f'/api/trips/{step.trip_id}/steps/{step.id}/photos/batch', {'files': files}).json()
+        self.assertEqual((data['created'], data['failed']), (2, 0))
+        photos = [r['photo'] for r in data['results']]
+        self.assertEqual(photos[1]['id'], existing['id'])
+        self.assertEqual(photos[2]['id'], photos[0]['id'])
+        self.assertEqual([p['duplicate_of'] for p in photos], [None, existing['id'], photos[0]['id'], None])
+        self.assertEqual(len(FakeOwnCloud.files), 3)
+        self.assertEqual(step.photos.count(), 3)
+
+    def test_deferred_upload_reuses_remote_file(self):
+        first_step, second_step = make_trip(steps=2, photos=0).steps.order_by('order')  # type: ignore[attr-defined]
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+        with override_settings(UPLOAD_SPOOL_DIR=spool.name):
+            original = self.upload(first_step, b'card')
+            photo = upload_queue.spool_photo(second_step, SimpleUploadedFile('card.jpg', b'card'), 'card.jpg', None)
+            self.assertEqual(upload_queue.spool_photo(second_step, SimpleUploadedFile('card.jpg', b'card'), 'again', None), photo)
+            self.assertTrue(upload_queue.process(photo.id))  # type: ignore[attr-defined]
+        photo.refresh_from_db()
+        self.assertEqual((photo.status, photo.url), (Photo.STATUS_READY, original['url']))
+        self.assertEqual(len(FakeOwnCloud.files), 1)
+        self.assertEqual(os.listdir(spool.name), [])
+
+    @override_settings(PHOTO_PERCEPTUAL_HASH_ENABLED=True)
+    def test_near_duplicates_flagged(self):
+        step = make_trip(steps=1, photos=0).steps.first()  # type: ignore[attr-defined]
+        image = Image.linear_gradient('L').rotate(90).convert('RGB').resize((400, 300))
+        encoded = []
+        for quality, size in ((90, (400, 300)), (40, (200, 150))):
+            out = BytesIO()
+            image.resize(size).save(out, 'JPEG', quality=quality)
+            encoded.append(out.getvalue())
+        out = BytesIO()
+        image.transpose(Image.Transpose.FLIP_LEFT_RIGHT).save(out, 'JPEG')
+        first = self.upload(step, encoded[0])
+        self.assertEqual(first['near_duplicates'], [])
+        self.assertEqual(self.upload(step, encoded[1])['near_duplicates'], [first['id']])
+        self.assertEqual(self.upload(step, out.getvalue())['near_duplicates'], [])
+
+
+class IngestTests(OwnCloudMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.spool = tempfile.TemporaryDirectory()
+        self.addCleanup(self.spool.cleanup)
+        spool_settings = override_settings(UPLOAD_SPOOL_DIR=self.spool.name)
+        spool_settings.enable()
+        self.addCleanup(spool_settings.disable)
+
+    def photos(self) -> dict[str, bytes]:
+        return {
+            'paris/1.jpg': jpeg_bytes(40, 30, taken_at='2024:05:01 10:00:00', lat=48.853, lng=2.349),
+            'paris/2.jpg': jpeg_bytes(40, 30, taken_at='2024:05:01 12:00:00', lat=48.861, lng=2.336),
+            'paris/no-gps.jpg': jpeg_bytes(40, 30, taken_at='2024:05:01 13:00:00'),
+            'lyon/1.jpg': jpeg_bytes(40, 30, taken_at='2024:05:02 09:00:00', lat=45.764, lng=4.835),
+            'lyon/2.jpg': jpeg_bytes(40, 30, taken_at='2024:05:02 09:30:00', lat=45.767, lng=4.833),
+            # Back in Lyon after a long break: a new step
+            'lyon/3.jpg': jpeg_bytes(40, 30, taken_at='2024:05:03 18:00:00', lat=45.765, lng=4.834),
+            'notes.txt': b'not a photo',
+        }
+
+    def assert_trip(self, trip_id: int):
+        steps = list(Step.objects.filter(trip_id=trip_id).order_by('order'))
+        self.assertEqual([(s.order, s.photos.count()) for s in steps], [(0, 3), (1, 2), (2, 1)])  # type: ignore[attr-defined]
+        self.assertAlmostEqual(steps[0].lat, 48.857)
+        self.assertEqual((steps[0].started_at.hour, steps[0].ended_at.hour), (10, 13))
+        self.assertEqual(StepGridCell.objects.get(level=0).count, 3)
+
+    def test_import_archive(self):
+        response = self.client.post('/api/trips/import', {
+            'file': SimpleUploadedFile('france.zip', zip_bytes(self.photos()), content_type='application/zip'),
+        })
+        self.assertEqual(response.status_code, 202, response.content)
+        data = response.json()
+        self.assertEqual((data['steps'], data['progress']['pending'], data['progress']['total']), (3, 6, 6))
+        trip_id = data['trip_id']
+        self.assertEqual(Trip.objects.get(id=trip_id).name, 'france')
+        self.assert_trip(trip_id)
+        for photo_id in upload_queue.claim(100):
+            upload_queue.process(photo_id)
+        self.assertEqual(self.client.get(f'/api/trips/{trip_id}/import').json()['ready'], 6)
+        self.assertEqual(len(FakeOwnCloud.files), 6)
+        self.assertEqual(os.listdir(self.spool.name), [])
+
+    def test_import_rejects_bad_archives(self):
+        for data in (b'not a zip', zip_bytes({'notes.txt': b'text'})):
+            response = self.client.post('/api/trips/import', {'file': SimpleUploadedFile('x.zip', data)})
+            self.assertEqual(response.status_code, 400, response.content)
+        self.assertFalse(Trip.objects.exists())
+
+    def test_import_size_limit(self):
+        files = {**self.photos(), 'notes.txt': b' ' * 100_000}
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name, content in files.items():
+                zf.writestr(name, content)
+        data = archive.getvalue()
+        extracted = sum(len(content) for content in files.values())
+        self.assertLess(len(data), extracted)
+        # Compressed size, then size once extracted (zip bombs)
+        for limit in (len(data) - 1, extracted - 1):
+            with override_settings(TRIP_IMPORT_MAX_BYTES=limit):
+                response = self.client.post('/api/trips/import', {'file': SimpleUploadedFile('x.zip', data)})
+            self.assertEqual(response.status_code, 413, response.content)
+        self.assertFalse(Trip.objects.exists())
+        self.assertEqual(os.listdir(self.spool.name), [])
+        with override_settings(TRIP_IMPORT_MAX_BYTES=max(len(data), extracted)):
+            response = self.client.post('/api/trips/import', {'file': SimpleUploadedFile('x.zip', data)})
+        self.assertEqual(response.status_code, 202, response.content)
+
+    def test_command_imports_directory(self):
+        with tempfile.TemporaryDirectory() as folder:
+            for name, data in self.photos().items():
+                os.makedirs(os.path.dirname(os.path.join(folder, name)), exist_ok=True)
+                with open(os.path.join(folder, name), 'wb') as f:
+                    f.write(data)
+            out = StringIO()
+            call_command('import_trip', folder, '--name', 'France', '--workers', '3', stdout=out)
+        trip = Trip.objects.get(name='France')
+        self.assert_trip(trip.id)  # type: ignore[attr-defined]
+        self.assertEqual(Photo.objects.filter(status=Photo.STATUS_READY).count(), 6)
+        self.assertIn('upload: 6/6', out.getvalue())
+
+
+def zip_bytes(files: dict[str, bytes]) -> bytes:
+    archive = BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        for name, data in files.items():
+            zf.writestr(name, data)
+    return archive.getvalue()
+
+
+class StepOrderTests(TripsTestCase):
+    def add_step(self, trip, **extra):
+        response = self.client.post(f'/api/trips/{trip.id}/steps', {
+            'name': 'S', 'description': '', 'lat': 1.0, 'lng': 2.0, **extra,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_appended_steps_take_the_next_order(self):
+        trip = make_trip(steps=3, photos=0)
+        self.assertEqual(list(trip.steps.order_by('id').values_list('order', flat=True)), [0, 1, 2])  # type: ignore[attr-defined]
+        Step.objects.create(trip=trip, name='Late', description='', lat=0, lng=0, order=10)
+        self.assertEqual(self.add_step(trip)['order'], 11)
+        trip.steps.filter(order__gte=10).delete()  # type: ignore[attr-defined]
+        self.assertEqual(self.add_step(trip)['order'], 12)  # gaps are fine, orders are never reused
+        other = make_trip(steps=1, photos=0)
+        self.assertEqual(other.steps.get().order, 0)  # type: ignore[attr-defined]
+
+    def test_reorder(self):
+        trip = make_trip(steps=4, photos=0)
+        ids = list(trip.steps.order_by('order').values_list('id', flat=True))  # type: ignore[attr-defined]
+        self.client.get(f'/api/trips/{trip.id}')  # type: ignore[attr-defined]
+        new_order = ids[::-1]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(f'/api/trips/{trip.id}/steps/order', {'step_ids': new_order}, content_type='application/json')  # type: ignore[attr-defined]
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json(), [{'id': step_id, 'order': i} for i, step_id in enumerate(new_order)])
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE "trips_step"')]), 1)
+        steps = self.client.get(f'/api/trips/{trip.id}').json()['steps']  # type: ignore[attr-defined]
+        self.assertEqual([s['id'] for s in steps], new_order)
+        self.assertEqual(self.add_step(trip)['order'], 4)
+
+    def test_reorder_requires_every_step_once(self):
+        trip = make_trip(steps=3, photos=0)
+        ids = list(trip.steps.values_list('id', flat=True))  # type: ignore[attr-defined]
+        other = make_trip(steps=1, photos=0).steps.get().id  # type: ignore[attr-defined]
+        for step_ids in (ids[:2], ids + ids[:1], ids[:2] + [other]):
+            response = self.client.patch(f'/api/trips/{trip.id}/steps/order', {'step_ids': step_ids}, content_type='application/json')  # type: ignore[attr-defined]
+            self.assertEqual(response.status_code, 400, response.content)
+        self.assertEqual(self.client.patch('/api/trips/999/steps/order', {'step_ids': []}, content_type='application/json').status_code, 404)
+
+    def test_admin_list_writes_edited_orders_at_once(self):
+        trip = make_trip(steps=3, photos=0)
+        steps = list(trip.steps.order_by('order'))  # type: ignore[attr-defined]
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        data = {'form-TOTAL_FORMS': 3, 'form-INITIAL_FORMS': 3, '_save': 'Save'}
+        for i, (step, order) in enumerate(zip(steps, (2, 1, 0))):
+            data.update({f'form-{i}-id': step.id, f'form-{i}-order': order})
+        calls = []
+        with mock.patch('trips.admin.save_orders', side_effect=lambda edited: calls.append(len(edited)) or save_orders(edited)):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/admin/trips/step/', data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(calls, [2])  # the middle step kept its order
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE "trips_step"')]), 1)
+        # The bulk write is part of the changelist transaction, before the change log entries
+        updated = next(i for i, q in enumerate(queries) if q['sql'].startswith('UPDATE "trips_step"'))
+        self.assertLess(updated, max(i for i, q in enumerate(queries) if 'django_admin_log' in q['sql']))
+        self.assertEqual(list(trip.steps.order_by('order').values_list('id', flat=True)), [s.id for s in steps[::-1]])  # type: ignore[attr-defined]
+
+
+class BulkTests(TripsTestCase):
+    def grid(self):
+        return sorted(StepGridCell.objects.values_list('level', 'x', 'y', 'count'))
+
+    def assert_grid_consistent(self):
+        grid = self.grid()
+        clustering.rebuild()
+        self.assertEqual(grid, self.grid())
+
+    def test_create_steps(self):
+        trip = make_trip(steps=1, photos=0)
+        items = [{'name': f'S{i}', 'lat': 40 + i / 10, 'lng': -3 + i / 10} for i in range(50)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f'/api/trips/{trip.id}/steps/bulk', {'steps': items}, content_type='application/json')  # type: ignore[attr-defined]
+        self.assertEqual(response.status_code, 200, response.content)
+        ids = response.json()['ids']
+        self.assertEqual(len(ids), 50)
+        self.assertLessEqual(len(queries), 25)  # independent of the batch size, apart from the grid chunks
+        self.assertEqual(list(Step.objects.filter(id__in=ids).order_by('order').values_list('id', flat=True)), ids)
+        self.assertEqual(Step.objects.get(id=ids[0]).order, 1)
+        self.assert_grid_consistent()
+        self.assertEqual(len(self.client.get(f'/api/trips/{trip.id}').json()['steps']), 51)  # type: ignore[attr-defined]
+
+    def test_update_steps(self):
+        trip = make_trip(steps=3, photos=1)
+        steps = list(trip.steps.order_by('order'))  # type: ignore[attr-defined]
+        self.client.get(f'/api/trips/{trip.id}')  # type: ignore[attr-defined]
+        response = self.client.patch(f'/api/trips/{trip.id}/steps/bulk', {'steps': [  # type: ignore[attr-defined]
+            {'id': steps[0].id, 'name': 'Renamed'},
+            {'id': steps[2].id, 'lat': -10.5, 'lng': 120.25},
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        data = self.client.get(f'/api/trips/{trip.id}').json()['steps']  # type: ignore[attr-defined]
+        self.assertEqual((data[0]['name'], data[0]['lat']), ('Renamed', steps[0].lat))
+        self.assertEqual((data[2]['lat'], data[2]['lng']), (-10.5, 120.25))
+        self.assert_grid_consistent()
+        self.assertEqual(StepGridCell.objects.get(level=0).cover_photo_id, steps[0].cover_photo_id)  # type: ignore[attr-defined]
+
+    def test_create_photos(self):
+        trip = make_trip(steps=2, photos=0)
+        step = trip.steps.first()  # type: ignore[attr-defined]
+        items = [{'step_id': step.id, 'name': f'p{i}', 'url': f'https://example.com/{i}.jpg'} for i in range(20)]
+        response = self.client.post(f'/api/trips/{trip.id}/photos/bulk', {'photos': items}, content_type='application/json')  # type: ignore[attr-defined]
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(list(step.photos.order_by('id').values_list('id', flat=True)), response.json()['ids'])
+
+    @override_settings(BULK_MAX_ITEMS=5)
+    def test_validation(self):
+        trip = make_trip(steps=1, photos=0)
+        foreign = make_trip(steps=1, photos=0).steps.get()  # type: ignore[attr-defined]
+        url = f'/api/trips/{trip.id}'  # type: ignore[attr-defined]
+        too_many = [{'name': 'S', 'lat': 0, 'lng': 0}] * 6
+        self.assertEqual(self.client.post(f'{url}/steps/bulk', {'steps': too_many}, content_type='application/json').status_code, 400)
+        self.assertEqual(self.client.post(f'{url}/steps/bulk', {'steps': [{'name': 'S', 'lat': 91, 'lng': 0}]}, content_type='application/json').status_code, 422)
+        self.assertEqual(self.client.post('/api/trips/999/steps/bulk', {'steps': too_many[:1]}, content_type='application/json').status_code, 404)
+        self.assertEqual(self.client.patch(f'{url}/steps/bulk', {'steps': [{'id': foreign.id, 'name': 'X'}]}, content_type='application/json').status_code, 400)
+        photo = {'step_id': foreign.id, 'name': 'p', 'url': 'https://example.com/p.jpg'}
+        self.assertEqual(self.client.post(f'{url}/photos/bulk', {'photos': [photo]}, content_type='application/json').status_code, 400)
+        self.assertEqual(Step.objects.count(), 2)
+        self.assertFalse(Photo.objects.exists())
+
+
+def recorded_track() -> list[tuple[float, float, datetime]]:
+    """Ten minutes walking north, half an hour around a café, ten more minutes walking."""
+    start = datetime(2024, 5, 1, 9, tzinfo=dt_timezone.utc)
+    points = [(45.0 + i * 0.0001, 5.0, start + timedelta(seconds=10 * i)) for i in range(60)]
+    cafe = points[-1]
+    for i in range(1, 181):
+        points.append((cafe[0] + (i % 3) * 0.00005, cafe[1] + (i % 2) * 0.00005, cafe[2] + timedelta(seconds=10 * i)))
+    last = points[-1]
+    points += [(last[0] + i * 0.0001, 5.0, last[2] + timedelta(seconds=10 * i)) for i in range(1, 61)]
+    return points
+
+
+def gpx_bytes(points) -> bytes:
+    rows = ''.join(f'<trkpt lat="{lat}" lon="{lng}"><ele>200</ele><time>{t.isoformat()}</time></trkpt>' for lat, lng, t in points)
+    return (
+        '<?xml version="1.0"?><gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">'
+        f'<trk><name>Walk</name><trkseg>{rows}</trkseg></trk></gpx>'
+    ).encode()
+
+
+class TrackImportTests(TripsTestCase):
+    def post(self, trip, data: bytes, name: str, **form):
+        return self.client.post(f'/api/trips/{trip.id}/track', {'file': SimpleUploadedFile(name, data), **form})
+
+    def test_gpx_import(self):
+        trip = make_trip(steps=0, photos=0)
+        response = self.post(trip, gpx_bytes(recorded_track()), 'walk.gpx', create_steps='true')
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        self.assertEqual(data['points'], 300)
+        self.assertLess(data['kept'], 20)
+        self.assertEqual(len(data['stops']), 1)
+        stop = data['stops'][0]
+        started_at, ended_at = datetime.fromisoformat(stop['started_at']), datetime.fromisoformat(stop['ended_at'])
+        # The café visit (09:09:50 - 09:39:50), give or take the walk within the stop radius
+        self.assertTrue(started_at <= datetime(2024, 5, 1, 9, 9, 50, tzinfo=dt_timezone.utc) <= started_at + timedelta(minutes=3))
+        self.assertTrue(ended_at - timedelta(minutes=3) <= datetime(2024, 5, 1, 9, 39, 50, tzinfo=dt_timezone.utc) <= ended_at)
+        step = Step.objects.get(id__in=data['step_ids'])
+        self.assertAlmostEqual(step.lat, 45.0059, places=3)
+        trip.refresh_from_db()
+        line = geo.decode_polyline(trip.track)
+        self.assertEqual((line[0], line[-1]), ((45.0, 5.0), (45.0119, 5.0)))
+        route = self.client.get(f'/api/trips/{trip.id}/route').json()  # type: ignore[attr-defined]
+        self.assertEqual(route['features'][0]['geometry']['coordinates'][0], [5.0, 45.0])
+
+    def test_geojson_import(self):
+        points = recorded_track()
+        feature = {'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': [[lng, lat] for lat, lng, _ in points]},
+                   'properties': {'coordTimes': [t.isoformat() for _, _, t in points]}}
+        trip = make_trip(steps=0, photos=0)
+        data = self.post(trip, orjson.dumps({'type': 'FeatureCollection', 'features': [feature]}), 'walk.geojson').json()
+        self.assertEqual((data['points'], len(data['stops']), data['step_ids']), (300, 1, []))
+        self.assertFalse(trip.steps.exists())  # type: ignore[attr-defined]
+
+    def test_invalid_files(self):
+        trip = make_trip(steps=0, photos=0)
+        for data, name in ((b'<gpx><trk>', 'broken.gpx'), (b'{"type": ', 'broken.json'), (gpx_bytes(recorded_track()[:1]), 'one.gpx')):
+            self.assertEqual(self.post(trip, data, name).status_code, 400)
+
+    def test_malformed_geojson(self):
+        trip = make_trip(steps=0, photos=0)
+        line = {'type': 'LineString', 'coordinates': [[5.0, 45.0], [5.01, 45.01]]}
+        for document in (
+            [1, 2],
+            {'type': 'FeatureCollection', 'features': [1, 2]},
+            {'type': 'FeatureCollection', 'features': 'none'},
+            {'type': 'Feature', 'geometry': 'LineString'},
+            {**line, 'coordinates': [[1], [2, 3]]},
+            {**line, 'coordinates': [['5.0', '45.0'], [5.01, 45.01]]},
+            {**line, 'coordinates': [[5.0, None], [5.01, 45.01]]},
+            {**line, 'coordinates': 7},
+            {'type': 'MultiLineString', 'coordinates': [[5.0, 45.0]]},
+            {'type': 'Point', 'coordinates': []},
+        ):
+            response = self.post(trip, orjson.dumps(document), 'bad.geojson')
+            self.assertEqual(response.status_code, 400, document)
+        with tempfile.NamedTemporaryFile(suffix='.geojson') as f:
+            f.write(orjson.dumps({'type': 'FeatureCollection', 'features': [1, 2]}))
+            f.flush()
+            with self.assertRaises(CommandError):
+                call_command('import_track', str(trip.id), f.name, stdout=open(os.devnull, 'w'))  # type: ignore[attr-defined]
+        # Odd but valid: skipped geometries, null geometry, times that are not strings
+        document = {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'geometry': None, 'properties': None},
+            {'type': 'Feature', 'geometry': {'type': 'Polygon', 'coordinates': 1}, 'properties': {}},
+            {'type': 'Feature', 'geometry': line, 'properties': {'coordTimes': [1, None]}},
+        ]}
+        self.assertEqual(self.post(trip, orjson.dumps(document), 'odd.geojson').json()['points'], 2)
+
+    @override_settings(BULK_MAX_ITEMS=0)
+    def test_track_not_kept_when_steps_fail(self):
+        trip = make_trip(steps=0, photos=0)
+        response = self.post(trip, gpx_bytes(recorded_track()), 'walk.gpx', create_steps='true')
+        self.assertEqual(response.status_code, 400, response.content)
+        trip.refresh_from_db()
+        self.assertFalse(trip.track)
+        self.assertFalse(trip.steps.exists())  # type: ignore[attr-defined]
+
+    def test_polyline(self):
+        self.assertEqual(geo.encode_polyline([(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]), '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        self.assertEqual(geo.decode_polyline('_p~iF~ps|U_ulLnnqC_mqNvxq`@'), [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)])
+
+
+class TripStatsTests(TripsTestCase):
+    def assertStats(self, trip, **expected):
+        trip.refresh_from_db()
+        self.assertEqual({field: getattr(trip, field) for field in expected}, expected)
+
+    def test_maintained_on_writes(self):
+        trip = make_trip(steps=3, photos=2)
+        steps = list(trip.steps.order_by('order'))  # type: ignore[attr-defined]
+        route = [(48.0, 2.0), (49.0, 3.0), (50.0, 4.0)]
+        self.assertStats(trip, step_count=3, photo_count=6, min_lat=48.0, max_lat=50.0, min_lng=2.0, max_lng=4.0)
+        self.assertAlmostEqual(trip.distance_km, geo.haversine_km(*route[0], *route[1]) + geo.haversine_km(*route[1], *route[2]))
+        self.assertEqual(trip.steps_started_at, min(step.started_at for step in steps))
+        self.assertEqual(steps[0].photo_count, 2)
+
+        photo = steps[0].photos.first()  # type: ignore[attr-defined]
+        photo.step = steps[1]
+        photo.save()
+        self.assertEqual([step.photo_count for step in Step.objects.filter(trip=trip).order_by('order')], [1, 3, 2])
+        photo.delete()
+        self.assertStats(trip, photo_count=5)
+
+        stale = Trip.objects.get(id=trip.id)  # type: ignore[attr-defined]
+        steps[2].delete()
+        self.assertStats(trip, step_count=2, photo_count=3, max_lat=49.0)
+        self.assertAlmostEqual(trip.distance_km, geo.haversine_km(*route[0], *route[1]))
+        stale.name = 'Renamed'
+        stale.save()
+        self.assertStats(trip, name='Renamed', step_count=2, photo_count=3)
+
+    def test_step_writes_update_from_the_step(self):
+        trip = make_trip(steps=4, photos=1)
+        first, second, third, fourth = trip.steps.order_by('order')  # type: ignore[attr-defined]
+        other = make_trip('Other', steps=2, photos=1)
+        edits = [
+            (second, {'lat': 47.0}),  # leaves the box
+            (third, {'lat': 49.5, 'lng': 3.5}),  # inside the box
+            (first, {'lat': 48.5}),  # held min_lat
+            (fourth, {'order': 0}),  # reordered
+            (second, {'started_at': second.started_at - timedelta(days=3)}),
+            (third, {'ended_at': third.ended_at + timedelta(days=3)}),
+            (third, {'ended_at': third.ended_at - timedelta(days=6)}),  # held steps_ended_at
+            (first, {'trip': other}),  # moved to another trip, with its photo
+        ]
+        for step, changes in edits:
+            for field, value in changes.items():
+                setattr(step, field, value)
+            step.save()
+            for checked in (trip, other):
+                checked.refresh_from_db()
+                expected = stats.compute([checked.id])[checked.id]  # type: ignore[attr-defined]
+                self.assertAlmostEqual(checked.distance_km, expected.pop('distance_km'), msg=changes)
+                self.assertEqual({field: getattr(checked, field) for field in expected}, expected, changes)
+        self.assertStats(other, step_count=3, photo_count=3)
+        second.delete()
+        trip.refresh_from_db()
+        self.assertAlmostEqual(trip.distance_km, stats.compute([trip.id])[trip.id]['distance_km'])  # type: ignore[attr-defined]
+        self.assertStats(trip, step_count=2, photo_count=2)
+
+    def test_step_write_reads_its_neighbours_only(self):
+        trip = make_trip(steps=30, photos=0)
+        step = trip.steps.order_by('order')[15]  # type: ignore[attr-defined]
+        step.lat += 0.1
+        with CaptureQueriesContext(connection) as context:
+            step.save()
+        reads = [query['sql'] for query in context if query['sql'].startswith('SELECT') and '"trips_step"' in query['sql']]
+        self.assertTrue(reads)
+        self.assertTrue(all('LIMIT 1' in sql for sql in reads), reads)
+
+    def test_only_ready_photos_are_counted(self):
+        trip = make_trip(steps=1, photos=1)
+        step = trip.steps.get()  # type: ignore[attr-defined]
+        pending = Photo.objects.create(step=step, name='pending', status=Photo.STATUS_PENDING)
+        self.assertStats(trip, photo_count=1)
+        stats.refresh([trip.id], photos=True)  # type: ignore[attr-defined]
+        self.assertStats(trip, photo_count=1)
+        pending.status = Photo.STATUS_READY
+        pending.save(update_fields=['status'])
+        self.assertStats(trip, photo_count=2)
+        data = self.client.get(f'/api/trips/{trip.id}').json()  # type: ignore[attr-defined]
+        self.assertEqual((data['photo_count'], len(data['steps'][0]['photos'])), (2, 2))
+        self.assertEqual(data['steps_started_at'], step.started_at.isoformat())
+        pending.status = Photo.STATUS_FAILED
+        pending.save(update_fields=['status'])
+        pending.delete()
+        self.assertStats(trip, photo_count=1)
+
+    def test_bulk_writes_reorder_and_track(self):
+        trip = make_trip(steps=3, photos=0)
+        first, second, third = trip.steps.order_by('order')  # type: ignore[attr-defined]
+        self.client.post(f'/api/trips/{trip.id}/photos/bulk', {'photos': [  # type: ignore[attr-defined]
+            {'step_id': first.id, 'name': 'a', 'url': 'https://cloud.example.com/s/a/download'},
+            {'step_id': third.id, 'name': 'b', 'url': 'https://cloud.example.com/s/b/download'},
+        ]}, content_type='application/json')
+        self.assertStats(trip, photo_count=2)
+        self.assertEqual(Step.objects.get(id=third.id).photo_count, 1)
+        before = trip.distance_km
+        self.client.patch(f'/api/trips/{trip.id}/steps/order', {'step_ids': [first.id, third.id, second.id]}, content_type='application/json')  # type: ignore[attr-defined]
+        trip.refresh_from_db()
+        self.assertGreater(trip.distance_km, before)
+        # The recorded track widens the extent; the payload carries the statistics
+        self.client.post(f'/api/trips/{trip.id}/track', {'file': SimpleUploadedFile('walk.gpx', gpx_bytes(recorded_track()))})  # type: ignore[attr-defined]
+        self.assertStats(trip, min_lat=45.0, max_lat=50.0, min_lng=2.0)
+        data = self.client.get(f'/api/trips/{trip.id}').json()  # type: ignore[attr-defined]
+        self.assertEqual(data['bbox'], [2.0, 45.0, 5.0, 50.0])
+        self.assertEqual((data['step_count'], data['photo_count']), (3, 2))
+        self.assertEqual(data['steps'][0]['photo_count'], 1)
+
+    def test_track_only_trip_is_drawn_on_tiles(self):
+        trip = make_trip(steps=0, photos=0)
+        trip.track = geo.encode_polyline([(45.0, 5.0), (45.01, 5.01)])
+        trip.save(update_fields=['track', 'revision', 'updated_at'])
+        x, y = tile_xy(45.005, 5.005, 10)
+        self.assertIn(trip.name.encode(), self.client.get(f'/api/tiles/10/{x}/{y}.mvt').content)
+
+
+class SyncTests(TripsTestCase):
+    def sync(self, since=0, **params):
+        response = self.client.get('/api/sync', {'since': since, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def changed(self, data):
+        return {key: sorted(item['id'] for item in data[key]) for key in ('trips', 'steps', 'photos')}
+
+    def test_changes_and_deletions_since_token(self):
+        trip = make_trip(steps=2, photos=1)
+        first, second = trip.steps.order_by('order')  # type: ignore[attr-defined]
+        photo = first.photos.get()
+        full = self.sync()
+        self.assertEqual(self.changed(full), {'trips': [trip.id], 'steps': [first.id, second.id], 'photos': [photo.id, second.photos.get().id]})  # type: ignore[attr-defined]
+        self.assertEqual((full['more'], full['steps'][0]['trip_id'], full['photos'][0]['step_id']), (False, trip.id, first.id))  # type: ignore[attr-defined]
+        self.assertEqual(full['trips'][0]['steps'], [])
+        token = full['token']
+        self.assertEqual(self.changed(self.sync(token)), {'trips': [], 'steps': [], 'photos': []})
+
+        second.name = 'Renamed'
+        second.save()
+        data = self.sync(token)
+        self.assertEqual(self.changed(data), {'trips': [trip.id], 'steps': [second.id], 'photos': []})  # type: ignore[attr-defined]
+        self.assertEqual(data['steps'][0]['name'], 'Renamed')
+        token = data['token']
+        photo_id, trip_id = photo.id, trip.id  # type: ignore[attr-defined]
+        photo.delete()
+        data = self.sync(token)
+        self.assertEqual(data['deleted'], {'trips': [], 'steps': [], 'photos': [photo_id]})
+        self.assertEqual(data['steps'][0]['photo_count'], 0)
+        token = data['token']
+        trip.delete()
+        data = self.sync(token)
+        self.assertEqual(data['deleted']['trips'], [trip_id])
+        self.assertEqual(sorted(data['deleted']['steps']), [first.id, second.id])  # type: ignore[attr-defined]
+        # A full sync never reports deletions
+        self.assertEqual(self.sync()['deleted'], {'trips': [], 'steps': [], 'photos': []})
+
+    @override_settings(SYNC_PAGE_MAX=2)
+    def test_pages(self):
+        trip = make_trip(steps=5, photos=0)
+        seen: dict[str, set] = {'trips': set(), 'steps': set(), 'photos': set()}
+        token, pages = 0, 0
+        while True:
+            data = self.sync(token, limit=1)
+            pages += 1
+            # Changes are sequenced SYNC_PAGE_MAX rows at a time and never split
+            self.assertLessEqual(sum(len(data[key]) for key in seen), 2)
+            for key, ids in self.changed(data).items():
+                seen[key].update(ids)
+            token = data['token']
+            if not data['more']:
+                break
+        self.assertEqual(seen['trips'], {trip.id})  # type: ignore[attr-defined]
+        self.assertEqual(seen['steps'], set(Step.objects.values_list('id', flat=True)))
+        self.assertEqual(pages, 4)
+        self.assertEqual(self.client.get('/api/sync', {'limit': 3}).status_code, 400)
+
+    def test_writers_do_not_take_sequence_values(self):
+        trip = make_trip(steps=1, photos=1)
+        token = self.sync()['token']
+        step = trip.steps.get()  # type: ignore[attr-defined]
+        step.name = 'Renamed'
+        step.save()
+        self.client.patch(f'/api/trips/{trip.id}/steps/bulk', {'steps': [{'id': step.id, 'lat': 40.0}]}, content_type='application/json')  # type: ignore[attr-defined]
+        # Marked as changed only: sequence values are handed out by the next sync
+        self.assertIsNone(Step.objects.get(id=step.id).change_seq)  # type: ignore[attr-defined]
+        self.assertEqual(ChangeCounter.objects.get().value, token)
+        data = self.sync(token)
+        self.assertEqual(self.changed(data)['steps'], [step.id])  # type: ignore[attr-defined]
+        self.assertGreater(data['token'], token)
+        self.assertEqual(self.sync(data['token'])['token'], data['token'])
+
+    def test_sync_only_writes_sequence_values(self):
+        trip = make_trip(steps=2, photos=1)
+        token = self.sync()['token']
+        trip.steps.first().delete()  # type: ignore[attr-defined]
+        trip.refresh_from_db()
+        with CaptureQueriesContext(connection) as queries:
+            data = self.sync(token)
+        writes = [q['sql'] for q in queries if q['sql'].startswith(('UPDATE', 'INSERT', 'DELETE'))]
+        self.assertTrue(writes)
+        self.assertTrue(all(
+            sql.startswith('UPDATE "trips_changecounter"') or ' SET "change_seq" = ' in sql for sql in writes
+        ), writes)
+        self.assertEqual(Trip.objects.values_list('revision', 'updated_at').get(id=trip.id), (trip.revision, trip.updated_at))  # type: ignore[attr-defined]
+        # Nothing left to sequence: no writes, and the same request gets the same answer
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.sync(token), data)
+        self.assertFalse([q['sql'] for q in queries if q['sql'].startswith(('UPDATE', 'INSERT', 'DELETE'))])
+
+    def test_pruned_tombstones_expire_old_tokens(self):
+        trip = make_trip(steps=2, photos=0)
+        token = self.sync()['token']
+        trip.steps.first().delete()  # type: ignore[attr-defined]
+        Tombstone.objects.update(deleted_at=datetime.now(dt_timezone.utc) - timedelta(days=100))
+        call_command('prune_tombstones', stdout=StringIO())
+        self.assertFalse(Tombstone.objects.exists())
+        self.assertEqual(self.client.get('/api/sync', {'since': token}).status_code, 410)
+        self.assertEqual(self.client.get('/api/sync', {'since': 10 ** 9}).status_code, 410)
+        data = self.sync()
+        self.assertEqual(len(data['steps']), 1)
+        self.assertEqual(self.changed(self.sync(data['token'])), {'trips': [], 'steps': [], 'photos': []})
+
+
+class SearchTests(TripsTestCase):
+    def search(self, q, **params):
+        response = self.client.get('/api/search', {'q': q, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response
+
+    def test_ranked_across_models(self):
+        trip = make_trip(name='Lyon weekend', steps=1, photos=0)
+        step = trip.steps.get()  # type: ignore[attr-defined]
+        step.name, step.description = 'Old town', 'Traboules of Lyon and the cathedral'
+        step.save()
+        photo = Photo.objects.create(step=step, name='Lyon', url='https://cloud.example.com/s/lyon/download')
+        Photo.objects.create(step=step, name='Lyon (uploading)', status=Photo.STATUS_PENDING)
+        make_trip(name='Paris', steps=1, photos=0)
+        results = self.search('lyon').json()
+        self.assertEqual([(r['type'], r['id']) for r in results], [('photo', photo.id), ('trip', trip.id), ('step', step.id)])  # type: ignore[attr-defined]
+        self.assertEqual((results[0]['trip_id'], results[0]['step_id']), (trip.id, step.id))  # type: ignore[attr-defined]
+        # Every word has to match, in the name or the description
+        self.assertEqual([r['id'] for r in self.search('cathedral lyon').json()], [step.id])  # type: ignore[attr-defined]
+        self.assertEqual(self.search('rome').json(), [])
+
+    def test_pagination_and_validation(self):
+        for i in range(3):
+            make_trip(name=f'Alps {i}', steps=0, photos=0)
+        response = self.search('alps', limit=2)
+        self.assertEqual(len(response.json()), 2)
+        self.assertEqual(response['X-Next-Offset'], '2')
+        response = self.search('alps', limit=2, offset=2)
+        self.assertEqual(len(response.json()), 1)
+        self.assertNotIn('X-Next-Offset', response)
+        self.assertEqual(self.client.get('/api/search', {'q': ' - '}).status_code, 400)
+        self.assertEqual(self.client.get('/api/search', {'q': 'alps', 'limit': 0}).status_code, 400)
+
+    def test_fallback_matching(self):
+        """Substring matching used without PostgreSQL (DB_ENGINE=sqlite); runs on any database."""
+        exact = make_trip(name='Alps', steps=0, photos=0)
+        prefix = make_trip(name='Alps in winter', steps=0, photos=0)
+        inside = make_trip(name='Swiss alps', steps=0, photos=0)
+        described = make_trip(name='Ski', steps=0, photos=0)
+        Trip.objects.filter(id=described.id).update(description='A week in the Alps')  # type: ignore[attr-defined]
+        make_trip(name='Pyrenees', steps=0, photos=0)
+        matches = search._fallback_matches(Trip.objects.all(), 'alps').order_by('-score')
+        self.assertEqual(list(matches.values_list('id', flat=True)), [exact.id, prefix.id, inside.id, described.id])  # type: ignore[attr-defined]
@@ -0,0 +1,227 @@
+"""Recorded GPS tracks (GPX / GeoJSON): streaming parse, simplification, compact storage.
+
+A track is kept on Trip.track as an encoded polyline (precision 1e-5 degrees, ~1 m) after
+Douglas–Peucker simplification, instead of one Step per point. Stops (the device staying
+within TRACK_STOP_RADIUS_M for TRACK_STOP_MIN_MINUTES) can become steps.
+
+GPX is parsed with iterparse. GeoJSON has no streaming parser in the standard library, so
+it is decoded in one go with orjson (still far smaller in memory than the XML DOM).
+"""
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+from typing import BinaryIO, Iterator
+import orjson
+from django.conf import settings
+from django.utils import timezone
+from .geo import encode_polyline, haversine_km
+from .routes import douglas_peucker
+
+# (lat, lng, time or None)
+TrackPoint = tuple[float, float, datetime | None]
+
+METERS_PER_DEGREE = 111_320.0
+
+
+class TrackError(ValueError):
+    pass
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _parse_time(value) -> datetime | None:
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip())
+    except ValueError:
+        return None
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+
+def parse_gpx(source: BinaryIO) -> Iterator[TrackPoint]:
+    """Track and route points of a GPX file, parsed incrementally.
+
+    Each point element is dropped from its parent once read, so memory does not grow with
+    the file size.
+    """
+    parent = None
+    try:
+        for event, elem in ET.iterparse(source, events=('start', 'end')):
+            tag = _local(elem.tag)
+            if event == 'start':
+                if tag in ('trkseg', 'rte'):
+                    parent = elem
+                continue
+            if tag not in ('trkpt', 'rtept'):
+                continue
+            time = next((child.text for child in elem if _local(child.tag) == 'time'), None)
+            try:
+                yield float(elem.attrib['lat']), float(elem.attrib['lon']), _parse_time(time)
+            except (KeyError, ValueError):
+                pass
+            if parent is not None:
+                parent.clear()
+            else:
+                elem.clear()
+    except ET.ParseError as e:
+        raise TrackError(f"Invalid GPX: {e}") from e
+
+
+def _position(value) -> tuple[float, float]:
+    """(lat, lng) of a GeoJSON position ([lng, lat, ...])."""
+    if (
+        not isinstance(value, list) or len(value) < 2
+        or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value[:2])
+    ):
+        raise TrackError(f"Invalid GeoJSON position: {value!r:.50}")
+    return float(value[1]), float(value[0])
+
+
+def _list(value, what: str) -> list:
+    if not isinstance(value, list):
+        raise TrackError(f"Invalid GeoJSON: {what} must be an array")
+    return value
+
+
+def parse_geojson(source: BinaryIO) -> Iterator[TrackPoint]:
+    """Points of the LineString / MultiLineString / Point features of a GeoJSON document.
+
+    Times are read from the `coordTimes` (LineString) or `time` (Point) properties written
+    by most GPX converters. Raises TrackError on malformed features or coordinates; other
+    geometry types and features without a geometry are skipped.
+    """
+    try:
+        document = orjson.loads(source.read())
+    except orjson.JSONDecodeError as e:
+        raise TrackError(f"Invalid GeoJSON: {e}") from e
+    if not isinstance(document, dict):
+        raise TrackError("Invalid GeoJSON: not an object")
+    features = _list(document['features'], 'features') if 'features' in document else [document]
+    for feature in features:
+        if not isinstance(feature, dict):
+            raise TrackError("Invalid GeoJSON: a feature is not an object")
+        geometry = feature.get('geometry', feature) if feature.get('type') == 'Feature' else feature
+        if geometry is None:
+            continue
+        if not isinstance(geometry, dict):
+            raise TrackError("Invalid GeoJSON: a geometry is not an object")
+        properties = feature.get('properties')
+        if not isinstance(properties, dict):
+            properties = {}
+        kind = geometry.get('type')
+        if kind not in ('Point', 'LineString', 'MultiLineString'):
+            continue
+        coordinates = _list(geometry.get('coordinates'), f"{kind} coordinates")
+        coord_times = properties.get('coordTimes')
+        if not isinstance(coord_times, list):
+            coord_times = []
+        if kind == 'Point':
+            lines, times = [[coordinates]], [[properties.get('time')]]
+        elif kind == 'LineString':
+            lines, times = [coordinates], [coord_times]
+        else:
+            lines, times = [_list(line, 'MultiLineString lines') for line in coordinates], coord_times
+        for i, line in enumerate(lines):
+            line_times = times[i] if i < len(times) and isinstance(times[i], list) else []
+            for j, position in enumerate(line):
+                lat, lng = _position(position)
+                yield lat, lng, _parse_time(line_times[j] if j < len(line_times) else None)
+
+
+def parse(source: BinaryIO, filename: str = '') -> Iterator[TrackPoint]:
+    """GPX or GeoJSON points, picked from the extension or the first byte of the file."""
+    name = filename.lower()
+    if name.endswith('.gpx'):
+        return parse_gpx(source)
+    if name.endswith(('.json', '.geojson')):
+        return parse_geojson(source)
+    head = source.read(512).lstrip()
+    source.seek(0)
+    return parse_geojson(source) if head.startswith(b'{') else parse_gpx(source)
+
+
+class StopFinder:
+    """Places where a track stayed within `radius_m` for at least `min_duration`.
+
+    Fed one point at a time (single pass): a stop grows while points stay within the radius
+    of its first point. `stops` lists {'lat', 'lng', 'started_at', 'ended_at', 'points'}.
+    """
+
+    def __init__(self, radius_m: float, min_duration: timedelta):
+        self.radius_m = radius_m
+        self.min_duration = min_duration
+        self.stops: list[dict] = []
+        self.anchor: TrackPoint | None = None
+        self.count = 0
+        self.lat_sum = self.lng_sum = 0.0
+        self.last_time: datetime | None = None
+
+    def feed(self, point: TrackPoint):
+        if point[2] is None:
+            return
+        anchor = self.anchor
+        if anchor is not None and haversine_km(anchor[0], anchor[1], point[0], point[1]) * 1000 <= self.radius_m:
+            self.count += 1
+            self.lat_sum += point[0]
+            self.lng_sum += point[1]
+            self.last_time = point[2]
+            return
+        self.finish()
+        self.anchor, self.count, self.lat_sum, self.lng_sum, self.last_time = point, 1, point[0], point[1], point[2]
+
+    def finish(self):
+        if self.anchor is not None and self.last_time - self.anchor[2] >= self.min_duration:  # type: ignore[operator]
+            self.stops.append({
+                'lat': self.lat_sum / self.count,
+                'lng': self.lng_sum / self.count,
+                'started_at': self.anchor[2],
+                'ended_at': self.last_time,
+                'points': self.count,
+            })
+        self.anchor = None
+
+
+def simplify(points: list[tuple[float, float]], tolerance_m: float) -> list[tuple[float, float]]:
+    """Douglas–Peucker simplified (lat, lng) line."""
+    simplified = douglas_peucker([(lng, lat) for lat, lng in points], tolerance_m / METERS_PER_DEGREE)
+    return [(lat, lng) for lng, lat in simplified]
+
+
+def import_track(source: BinaryIO, filename: str = '') -> dict:
+    """Parse and simplify a track file; returns {'track', 'points', 'kept', 'stops'}.
+
+    `track` is the encoded polyline to store on Trip.track, `stops` the step candidates.
+    While streaming, points closer than TRACK_TOLERANCE_M to the last kept one are dropped
+    (loggers record every second even when standing still), so memory follows the distance
+    covered rather than the file size; stops are detected on the full stream.
+    """
+    stops = StopFinder(settings.TRACK_STOP_RADIUS_M, timedelta(minutes=settings.TRACK_STOP_MIN_MINUTES))
+    kept: list[tuple[float, float]] = []
+    count = 0
+    for point in parse(source, filename):
+        lat, lng, _ = point
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            continue
+        count += 1
+        stops.feed(point)
+        if not kept or haversine_km(kept[-1][0], kept[-1][1], lat, lng) * 1000 >= settings.TRACK_TOLERANCE_M:
+            kept.append((lat, lng))
+    stops.finish()
+    if len(kept) < 2:
+        raise TrackError("The file holds fewer than 2 distinct track points")
+    line = simplify(kept, settings.TRACK_TOLERANCE_M)
+    return {'track': encode_polyline(line), 'points': count, 'kept': len(line), 'stops': stops.stops}
+
+
+def stop_steps(stops: list[dict]) -> list[dict]:
+    """Step fields (for bulk.create_steps) of detected stops."""
+    return [{
+        'name': f"Stop {i + 1}",
+        'description': f"{stop['started_at']:%Y-%m-%d %H:%M} – {stop['ended_at']:%H:%M}",
+        'lat': stop['lat'],
+        'lng': stop['lng'],
+        'started_at': stop['started_at'],
+        'ended_at': stop['ended_at'],
+    } for i, stop in enumerate(stops)]
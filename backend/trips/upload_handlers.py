@@ -0,0 +1,33 @@
+"""Upload handlers computing the SHA-256 of each uploaded file while Django receives it.
+
+The digest is exposed as `file.sha256`, so deduplication (trips.services.dedup) never
+reads an upload a second time.
+"""
+import hashlib
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class HashingMixin:
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)  # type: ignore[misc]
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining = super().receive_data_chunk(raw_data, start)  # type: ignore[misc]
+        if remaining is None:  # this handler is the one storing the file
+            self.sha256.update(raw_data)
+        return remaining
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)  # type: ignore[misc]
+        if file is not None:
+            file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingMixin, TemporaryFileUploadHandler):
+    pass
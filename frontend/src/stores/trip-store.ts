@@ -7,6 +7,13 @@ import { type AxiosInstance } from 'axios';
 export interface CoverPhotoRef {
   id: number;
   url: string;
+  thumbnailUrl: string; // small variant, or url when none was generated
+}
+
+export interface PhotoVariant {
+  url: string;
+  width: number;
+  height: number;
 }
 
 export interface Photo {
@@ -15,6 +22,12 @@ export interface Photo {
   description?: string | null;
   date: string;
   url: string;
+  width?: number | null;
+  height?: number | null;
+  variants?: Record<string, PhotoVariant>; // e.g. thumbnail, medium
+  takenAt?: string | null; // EXIF capture time
+  lat?: number | null;
+  lng?: number | null;
 }
 
 export interface Step {
@@ -27,6 +40,7 @@ export interface Step {
   endedAt: Date | null;
   coverPhoto?: CoverPhotoRef | null; // optional cover reference from backend
   photos?: Photo[]; // lazy-loaded photos for carousel
+  photoCount?: number; // all photos of the step, including uploads still in progress
 }
 
 export interface Trip {
@@ -34,9 +48,13 @@ export interface Trip {
   name: string;
   description: string;
   steps: Step[];
-  startedAt: Date | null;
-  endedAt: Date | null;
+  startedAt: Date | null; // first step start
+  endedAt: Date | null; // last step end
   coverPhoto?: CoverPhotoRef | null; // optional cover reference from backend
+  stepCount?: number;
+  photoCount?: number;
+  bbox?: [number, number, number, number] | null; // [minLng, minLat, maxLng, maxLat] of steps and track
+  distanceKm?: number; // great-circle length of the route through the steps
 }
 
 export const useTripStore = defineStore('trip', () => {